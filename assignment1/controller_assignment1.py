@@ -5,20 +5,53 @@ import pox.lib.packet.arp as arp
 import pox.lib.packet.icmp as icmp
 import pox.lib.packet.ipv4 as ip
 import pox.openflow.libopenflow_01 as of
-from pox.lib.util import dpidToStr
+from pox.lib.util import dpidToStr, str_to_bool
 from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+from sdnlib.rules import RuleIndex
+from sdnlib.classifier import set_match
+from sdnlib.proactive import compile_flow_mods
+from sdnlib.topology import Topology
+from sdnlib.sendbuf import buffer_for
+from sdnlib.learning import LearningTable, port_gone
+from sdnlib.flowcache import FlowCache, track_removal
+from sdnlib.arpproxy import ArpResponder
+from sdnlib.rulestore import RuleStore
+from sdnlib.metrics import Metrics, start_reporting
+from sdnlib.admission import AdmissionControl, ADMIT, BLOCK, BLOCK_PRIORITY
+from sdnlib.snapshot import StateSnapshot, flow_keys
+from sdnlib.fastpath import classify
+from sdnlib.templates import MessageTemplates, buffer_of
+from sdnlib.telemetry import StatsPoller, queue_caps
+from sdnlib.netspec import load_spec
+from sdnlib.timeouts import TimeoutPolicy, rule_class
 
 
 log = core.getLogger()
 
-table={}
+# MAC -> port bindings per switch; they age out and are capped per switch (see launch())
+table=LearningTable()
+
+# flows installed on each switch and not reported removed yet, so duplicate PacketIns don't resend them
+installed=FlowCache()
+
+# PacketIn latency histograms per branch of _handle_PacketIn (see --metrics_interval)
+metrics=Metrics()
+
+# the rule flow_mods packed once per MAC pair and output port, and only given a new xid when reused
+templates=MessageTemplates()
+
+# idle and hard timeouts per rule class, lengthened for long-lived flows and shortened when a switch's table fills up
+timeout_policy=TimeoutPolicy(installed)
 
 rules=[
     #QoS Rules
     # => the first two example of rules have been added for you, you need now to add other rules to satisfy the assignment requirements. 
     # Notice that we will make decisions based on Ethernet address rather than IP address. Rate limiting is implemented by sending the pacet 
     # to the correct port and queue (the queues that you have specified in the topology file).
-    {'EthSrc':'00:00:00:00:00:01', 'EthDst':'00:00:00:00:00:03', 'TCPPort':40, 'queue':0, 'drop':False},  # H1->H3:30Mbps (queue 0 on eth3)
+    # The queue numbers follow the allocation of network_assignment1.json (python -m sdnlib.qos): queue 0 is
+    # uncapped on every port and capped rates get the next ones. Loading that file with --rules_file does this for you
+    {'EthSrc':'00:00:00:00:00:01', 'EthDst':'00:00:00:00:00:03', 'TCPPort':40, 'queue':1, 'drop':False},  # H1->H3:30Mbps (queue 1 on eth3)
     {'EthSrc':'00:00:00:00:00:01', 'EthDst':'00:00:00:00:00:02', 'TCPPort':60, 'queue':1, 'drop':False},  # H1->H2:150Mbps (queue 1 on eth2)
     {'EthSrc':'00:00:00:00:00:01', 'EthDst':'00:00:00:00:00:04', 'queue':0, 'drop':False}, # H1->H4:uncapped
 
@@ -38,34 +71,275 @@ rules=[
     
 ]
 
-def launch ():
+# where the hosts hang off the switch in topo_assignment1.py: MAC -> (switch dpid, port)
+hosts={
+    '00:00:00:00:00:01': (1, 1),  # h1 on s1-eth1
+    '00:00:00:00:00:02': (1, 2),  # h2 on s1-eth2
+    '00:00:00:00:00:03': (1, 3),  # h3 on s1-eth3
+    '00:00:00:00:00:04': (1, 4),  # h4 on s1-eth4
+}
+
+# the static addresses of the hosts in topo_assignment1.py: IP -> MAC, used to answer ARP requests
+host_ips={
+    '10.0.0.1': '00:00:00:00:00:01',
+    '10.0.0.2': '00:00:00:00:00:02',
+    '10.0.0.3': '00:00:00:00:00:03',
+    '10.0.0.4': '00:00:00:00:00:04',
+}
+
+# rules compiled into a hash index by launch(), so PacketIn does not scan the list
+rule_index = None
+topology = Topology()
+proactive_mode = False
+barrier_fence = False
+arp_responder = None
+rule_store = None
+admission = None
+state = None
+miss_length = 128
+telemetry = None
+
+def launch (proactive=False, barrier=False, mac_ttl=300, mac_capacity=4096, install_window=1.0,
+            arp_proxy=False, rules_file=None, watch_interval=1.0, metrics_interval=0, metrics_file=None,
+            host_pktin_rate=0, switch_pktin_rate=0, block_time=10, state_file=None, snapshot_interval=10,
+            miss_send_len=128, stats_interval=0, stats_batch=50, qos_spec=None, table_size=0):
+    # with --proactive the rules are pushed to every switch when it connects, and
+    # PacketIn is only a fallback for traffic the rules table can't decide up front.
+    # with --barrier a barrier request separates each flow_mod from its packet_out.
+    # learned MACs are forgotten after --mac_ttl seconds, and each switch keeps at most --mac_capacity.
+    # PacketIns for a flow installed less than --install_window seconds ago only get a packet_out.
+    # with --arp_proxy the controller answers ARP requests itself instead of flooding them
+    # with --rules_file the rules are read from a JSON/CSV/YAML file instead of the list above, and the
+    # file is checked every --watch_interval seconds so policy changes apply without a restart
+    # every --metrics_interval seconds (0 = never) the PacketIn metrics are logged, or written to
+    # --metrics_file in Prometheus text format
+    # a host sending more than --host_pktin_rate PacketIns/s (bursts of twice that) to a switch gets its
+    # table misses there dropped for --block_time seconds; above --switch_pktin_rate PacketIns/s from
+    # one switch the excess is ignored. 0 turns either limit off
+    # with --state_file the learned MACs and installed flows are saved there every --snapshot_interval seconds
+    # and restored on startup; switches reconnecting after a restart keep their flows instead of being wiped
+    # switches that buffer table misses send us only the first --miss_send_len bytes of each (enough for the
+    # headers we classify on); we then answer by buffer_id instead of sending the whole frame back
+    # every --stats_interval seconds (0 = never) each switch is asked for its flow, port and queue stats, at
+    # most --stats_batch switches at a time, and the rates are kept in telemetry (see sdnlib.telemetry) and
+    # exported with the metrics; with --qos_spec queues sending above the caps of that network spec are logged
+    # flow timeouts shrink once a switch holds more than 3/4 of --table_size of our flows (0 = no limit)
+    global rule_index, topology, proactive_mode, barrier_fence, table, installed, arp_responder
+    global rule_store, admission, state, miss_length, telemetry, timeout_policy
+    if rules_file:
+        rule_store = RuleStore(rules_file, _rules_changed)
+        rule_index = rule_store.index
+        rule_store.watch(float(watch_interval))
+    else:
+        rule_index = RuleIndex(rules)
+    table = LearningTable(ttl=float(mac_ttl), capacity=int(mac_capacity))
+    if table.ttl > 0:
+        Timer(table.ttl, table.expire, recurring=True)  # lookups only drop the expired MACs they run into
+    installed = FlowCache(window=float(install_window))
+    timeout_policy = TimeoutPolicy(installed, table_size=int(table_size))
+    topology = Topology(hosts)
+    proactive_mode = str_to_bool(proactive)
+    barrier_fence = str_to_bool(barrier)
+    miss_length = int(miss_send_len)
+    if str_to_bool(arp_proxy):
+        arp_responder = ArpResponder(host_ips, rule_index)
+    if float(host_pktin_rate) or float(switch_pktin_rate):
+        admission = AdmissionControl(float(host_pktin_rate), float(switch_pktin_rate),
+                                     block_time=float(block_time))
+    if state_file:
+        state = StateSnapshot(state_file, table, installed, keep_priorities=(BLOCK_PRIORITY,))
+        macs, flows = state.restore()
+        log.info("Restored %d learned MACs and %d installed flows from %s", macs, flows, state_file)
+        state.start(float(snapshot_interval))
+        core.openflow.addListenerByName("FlowStatsReceived", _handle_FlowStatsReceived)
     core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
-    core.openflow.addListenerByName("PacketIn",  _handle_PacketIn)
+    core.openflow.addListenerByName("ConnectionDown", _handle_ConnectionDown)
+    core.openflow.addListenerByName("PortStatus", _handle_PortStatus)
+    core.openflow.addListenerByName("FlowRemoved", _handle_FlowRemoved)
+    core.openflow.addListenerByName("PacketIn",  metrics.timed(_handle_PacketIn))
+    if float(stats_interval) > 0:
+        telemetry = StatsPoller(float(stats_interval), batch=int(stats_batch),
+                                caps=queue_caps(load_spec(qos_spec)) if qos_spec else None)
+        telemetry.start()
+    if float(metrics_interval) > 0:
+        start_reporting(metrics, float(metrics_interval), metrics_file, telemetry)
     log.info("Switch running.")
 
 def _handle_ConnectionUp ( event):
     log.info("Starting Switch %s", dpidToStr(event.dpid))
-    #Clear any exsisting flows
-    msg = of.ofp_flow_mod(command = of.OFPFC_DELETE)
-    event.connection.send(msg)
+    out = buffer_for(event.connection, barrier_fence)
+    #only the headers of buffered table misses need to reach us
+    out.send(of.ofp_set_config(miss_send_len = miss_length))
+    if state is not None and state.should_reconcile(event.dpid):
+        #we were restarted and the switch kept its flows: fetch them and only delete the ones we don't know
+        out.send(of.ofp_stats_request(body = of.ofp_flow_stats_request()))
+    else:
+        #Clear any exsisting flows
+        installed.purge_switch(event.dpid)
+        msg = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+        out.send(msg)
+
+    if proactive_mode:
+        #install all drop rules and the forwarding rules whose host port we know, in the same write
+        dpid = event.dpid
+        flow_mods = compile_flow_mods(rule_index, lambda rule, dst: _forward_actions(dpid, rule, dst))
+        if flow_mods:
+            out.barrier()
+            for fm in flow_mods:
+                out.send(fm)
+        log.info("Pre-installed %d flows on switch %s", len(flow_mods), dpidToStr(dpid))
+
+def _handle_FlowStatsReceived ( event):
+    #the flow table of a switch that kept its flows over our restart
+    dpid = event.dpid
+    expected = ()
+    if proactive_mode:
+        expected = flow_keys(compile_flow_mods(rule_index, lambda rule, dst: _forward_actions(dpid, rule, dst)))
+    deletes = state.reconcile(dpid, event.stats, expected)
+    if deletes is None:
+        return
+    out = buffer_for(event.connection, barrier_fence)
+    for fm in deletes:
+        out.send(fm)
+    log.info("Reconciled switch %s: kept %d flows, deleted %d", dpidToStr(dpid), len(event.stats) - len(deletes), len(deletes))
+
+def _handle_ConnectionDown ( event):
+    purged = table.purge_switch(event.dpid)
+    installed.purge_switch(event.dpid)
+    _forget_hosts(purged)
+    if admission is not None:
+        admission.purge_switch(event.dpid)
+    log.info("Switch %s gone, forgot %d learned MACs", dpidToStr(event.dpid), len(purged))
+
+def _handle_PortStatus ( event):
+    #hosts behind a deleted or downed port have to be learned again
+    if port_gone(event):
+        purged = table.purge_port(event.dpid, event.port)
+        _forget_hosts(purged)
+        log.debug("Port %s of switch %s gone, forgot %d learned MACs", event.port, dpidToStr(event.dpid), len(purged))
+
+def _forget_hosts (macs):
+    #the flows towards hosts we no longer know the port of are built and installed afresh when they are learned again
+    for mac in macs:
+        templates.forget_host(mac)
+        installed.forget_host(mac)
+
+def _handle_FlowRemoved ( event):
+    #the flow expired or was deleted, so the next PacketIn for it has to install it again,
+    #with timeouts fitted to how long and busy this one was
+    installed.remove(event.dpid, event.ofp.match)
+    timeout_policy.flow_removed(event.ofp)
+
+def _rules_changed (pairs):
+    #the rules of these MAC pairs were reloaded: delete just their flows everywhere, so the next
+    #packet of each pair is decided by the new rules, and push the new proactive flows right away
+    for connection in core.openflow.connections.values():
+        dpid = connection.dpid
+        out = buffer_for(connection, barrier_fence)
+        for src, dst in pairs:
+            msg = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+            msg.match.dl_src = src
+            msg.match.dl_dst = dst
+            out.send(msg)
+            installed.forget_pair(src, dst)
+            templates.forget_pair(src, dst)
+            timeout_policy.forget_pair(src, dst)
+        if proactive_mode:
+            flow_mods = compile_flow_mods(rule_index, lambda rule, dst: _forward_actions(dpid, rule, dst), pairs)
+            if flow_mods:
+                out.barrier()
+                for fm in flow_mods:
+                    out.send(fm)
+    log.info("Rules of %d MAC pairs changed, their flows were replaced", len(pairs))
+
+def _forward_actions (dpid, rule, dst):
+    #same queue choice as the reactive path below, towards the host's port if we know it
+    port = topology.egress_port(dpid, dst)
+    if port is None:
+        return None
+    return [of.ofp_action_enqueue(port=port, queue_id=rule.get('queue', 0))]
+
+
+def _rule_flow_mod (eth_packet, rule, dst_port, fields=None):
+    #the flow_mod installing a rule for the packet's MAC pair, towards dst_port (flooded if unknown);
+    #_handle_PacketIn packs it once into a template and reuses the bytes for every later packet like it
+    #fields, if given, are the packet's header fields the flow matches on (from rule_index.classify())
+
+    # => start creating a new flow rule for mathcing the ethernet source and destination
+
+    # Create flow mod
+
+    msg_flowmod = of.ofp_flow_mod()
+    msg_flowmod.match.dl_dst = eth_packet.dst
+    msg_flowmod.match.dl_src = eth_packet.src
+    #the idle and hard timeouts are patched in by timeout_policy whenever it is sent
+
+    # => if the rule contains TCP port info, the index only returned it because this packet is
+    # TCP to that port, so add the additional matching fields: IP-protocol type, TCP protocol
+    # type, destination TCP port. Otherwise install the flow without any port restriction
+    tcp_port = rule.get('TCPPort', None)
+    if fields is not None:
+        set_match(msg_flowmod.match, fields)
+    elif tcp_port is not None:
+        msg_flowmod.match.dl_type = 0x800   #for IP packets
+        msg_flowmod.match.nw_proto = 6      #for TCP
+        msg_flowmod.match.tp_dst = tcp_port
+
+    # we check for firewalls, the if drop is true
+    if rule['drop']:
+        #dont check anything, stop packets from going to and fro
+        pass
+    else:
+        #forward packet to destination port
+        q_id = rule.get('queue', 0)
+        if dst_port is not None:
+            msg_flowmod.actions.append(of.ofp_action_enqueue(port=dst_port, queue_id=q_id))
+        else:
+            #if destination is unknown we can flood all ports
+            msg_flowmod.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
+    return track_removal(msg_flowmod)
 
 
 def _handle_PacketIn ( event): # Ths is the main class where your code goes, it will be called every time a packet is sent from the switch to the controller
+    # returns the name of the branch taken, which metrics.timed() files the handling time under
 
     dpid = event.connection.dpid #defines the switch from which the packet came
     sw=dpidToStr(dpid)           #convert to readable string
     inport = event.port          #shows input port from which the packet entered the switch
-    eth_packet = event.parsed    #this parses  the incoming message as an Ethernet packet
-    log.debug("Event: switch %s port %s packet %s" % (sw, inport, eth_packet)) # this is the way you can add debugging information to your text
+    eth_packet = classify(event) #this reads the addresses, ethertype, IP protocol and TCP port straight from the frame bytes;
+                                 #the full Ethernet packet (event.parsed) is only built if something needs more
+    log.debug("Event: switch %s port %s packet %s", sw, inport, eth_packet) # this is the way you can add debugging information to your text
+    out = buffer_for(event.connection, barrier_fence) # messages sent through this are written together at the end of the event loop tick
 
-    table[(dpid,eth_packet.src)] = event.port   # this associates the given port with the sending node using the source address of the incoming packet
-    dst_port = table.get((dpid,eth_packet.dst)) # if available in the table this line determines the destination port of the incoming packet
+    if admission is not None:
+        # hosts and switches over their PacketIn budget are not served; a host that just went over it
+        # gets a short drop flow for its misses, so they stop costing us PacketIns for a while
+        verdict = admission.admit(dpid, eth_packet.src)
+        if verdict is not ADMIT:
+            buffer_id = buffer_of(event.ofp) # a buffered packet is dropped by the block flow, or else by an empty packet_out,
+                                             # so the switch gets its buffer back
+            if verdict is BLOCK:
+                log.info("Blocking table misses from %s on switch %s for %s s", eth_packet.src, sw, admission.block_time)
+                out.send(admission.block_flow(eth_packet.src, inport, buffer_id))
+            elif buffer_id is not None:
+                out.send(admission.release(buffer_id, inport))
+            return verdict
+
+    if table.learn(dpid, eth_packet.src, event.port):  # this associates the given port with the sending node using the source address of the incoming packet
+        templates.forget_host(eth_packet.src)          # the flows towards it (if it moved) go out another port now
+    dst_port = table.lookup(dpid, eth_packet.dst)   # if available (and not expired) in the table this line determines the destination port of the incoming packet
 
 # this part is now separate from next part and deals with ARP messages
 
     ######################################################################################
     ############ CODE SHOULD ONLY BE ADDED BELOW  #################################
 
+    if arp_responder is not None and eth_packet.type == eth.ARP_TYPE:
+        # answer the request from the controller's ARP cache if we can, so nobody has to flood it
+        if arp_responder.handle(event, eth_packet, out):
+            log.debug("Answered ARP request from %s, %d floods avoided", eth_packet.src, arp_responder.replies)
+            return 'arp_proxy'
+
     if dst_port is None and eth_packet.type == eth.ARP_TYPE and eth_packet.dst == EthAddr(b"\xff\xff\xff\xff\xff\xff"): # this identifies that the packet is an ARP broadcast
         # => in this case you want to create a packet so that you can send the message as a broadcast
         # Create ARP flood packet
@@ -73,82 +347,42 @@ def _handle_PacketIn ( event): # Ths is the main class where your code goes, it
         msg = of.ofp_packet_out()
         msg.data = event.ofp
         msg.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        event.connection.send(msg)
-        return
+        out.send(msg)
+        return 'arp_flood'
 
     #now you are adding rules to the flow tables like before. First you check whether there is a rule 
-    #match based on Eth source and destination
-    for rule in rules: 
-        if (eth_packet.dst==EthAddr(rule['EthDst']) and eth_packet.src==EthAddr(rule['EthSrc'])):
-            log.debug("Event: found rule from source %s to dest  %s" % (eth_packet.src, eth_packet.dst))
-            # => start creating a new flow rule for mathcing the ethernet source and destination
-            
-            # Create flow mod
-            
-            msg_flowmod = of.ofp_flow_mod()
-            msg_flowmod.match.dl_dst = EthAddr(rule['EthDst'])
-            msg_flowmod.match.dl_src = EthAddr(rule['EthSrc'])
-            msg_flowmod.hard_timeout = 40
-
-            #if ...
-            # => now check if the rule contains also TCP port info. If not install the flow without any port restriction
-                # => also remember to check if this is a drop rule. The drop function can be added by not sending any action to the flow rule
-                # => also remember that if there is a QoS requirement, then you need to use the of.ofp_action_enqueue() function, instead of the of.ofp_action_output
-                # => and remember that in addition to creating a fow rule, you should also send out the message that came from the Switch
-                # => at the end remember to send out both flow rule and packet
-
-            tcp_port = rule.get('TCPPort', None)
-
-            #else ...
-            # => otherwise:
-            # => if the packet is an IP packet, its protocol is TCP, and the TCP port of the packet matches the TCP rule above
-                # => add additioinal matching fileds to the flow rule you are creating: IP-protocol type, TCP_protocol_type, destination TCP port.
-                # => like above if it requires QoS then use the of.ofp_action_enqueue() function
-                # => also remember to check if this is a drop rule.
-                # => at the end remember to send out both flow rule and packet
-
-            #if IP packet over TCP
-            ip_pack = eth_packet.find('ipv4')
-            if tcp_port and ip_pack and ip_pack.protocol == ip.TCP_PROTOCOL:
-                tcp_pack = ip_pack.find('tcp')
-                if tcp_pack and tcp_pack.dstport == tcp_port:
-                    msg_flowmod.match.dl_type = 0x800   #for IP packets
-                    msg_flowmod.match.nw_proto = 6      #for TCP
-                    msg_flowmod.match.tp_dst = tcp_port
-                else:
-                    continue #even if not in rule
-            elif tcp_port:
-                #for rules that require a specific tcp port
-                #but it doesnt apply to current packet
-                continue
-
-            # we check for firewalls, the if drop is true
-            if rule['drop']:
-                #dont check anything, stop packets from going to and fro
-                pass
-            else:
-                #forward packet to destination port
-                q_id = rule.get('queue', 0)
-                if dst_port is not None:
-                    msg_flowmod.actions.append(of.ofp_action_enqueue(port=dst_port, queue_id=q_id))
-                else:
-                    #if destination is unknown we can flood all ports
-                    msg_flowmod.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-
-            #flow table is now to be sent to packet
-            event.connection.send(msg_flowmod)
-
-            #we also send a packet_out() call to send on the very first packet too
-            msg_fp = of.ofp_packet_out()
-            msg_fp.data = event.ofp
-            if not rule['drop']:
-                if dst_port is not None:
-                    msg_fp.actions.append(of.ofp_action_enqueue(port=dst_port, queue_id=q_id))
-                else:
-                    msg_fp.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-
-                event.connection.send(msg_fp)
-            break
+    #match based on Eth source and destination (and TCP port). The rules were compiled at launch(),
+    #so this is a single lookup returning the same rule the list order would pick
+    #fields is None unless the pair has rules on IP addresses, protocols or port ranges too: then it
+    #holds the header fields of this packet its flow has to match on (see sdnlib.classifier)
+    rule, fields = rule_index.classify(eth_packet)
+    if rule is not None:
+        log.debug("Event: found rule from source %s to dest  %s", eth_packet.src, eth_packet.dst)
+        # => the flow_mod for this rule and destination port is built by _rule_flow_mod() below the first time
+        # it is needed; after that its packed bytes are reused with just a new xid, for every switch
+        tcp_port = rule.get('TCPPort', None)
+        template = templates.flow_mod(eth_packet.src, eth_packet.dst,
+                                      (tcp_port, rule['drop'], dst_port, rule.get('queue', 0), fields),
+                                      lambda: _rule_flow_mod(eth_packet, rule, dst_port, fields))
+
+        #flow table is now to be sent to packet, unless we just did that for an earlier packet
+        #of the same flow that reached us before the switch had installed it
+        #if the switch kept the packet in a buffer, the flow_mod carries its buffer_id and the
+        #switch applies the new flow to it as well
+        buffer_id = buffer_of(event.ofp)
+        idle_timeout, hard_timeout = timeout_policy.timeouts(dpid, rule_class(rule), template.key)
+        new_flow = installed.should_install_key(dpid, template.key, hard_timeout)
+        if new_flow:
+            out.send(template.pack(buffer_id, (idle_timeout, hard_timeout)))
+        else:
+            log.debug("Flow from %s to %s is already being installed", eth_packet.src, eth_packet.dst)
+
+        #otherwise we also send a packet_out() call to send on the very first packet too, with the same actions as the flow
+        if not rule['drop'] and not (new_flow and buffer_id is not None):
+            if new_flow:
+                out.fence()   #make sure the switch has the flow before it handles the packet
+            out.send(template.packet_out(event.ofp))
+        return 'rule_tcp' if tcp_port is not None else 'rule'
 
     else:
         #flood to learn as fall-back, so we're not stuck in the loop
@@ -161,7 +395,8 @@ def _handle_PacketIn ( event): # Ths is the main class where your code goes, it
         else:
             # flood
             msg.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
-        event.connection.send(msg)
+        out.send(msg)
+        return 'flood'
 
     ########### THIS IS THE END OF THE AREA WHERE YOU NEED TO ADD CODE ##################################
     #####################################################################################################
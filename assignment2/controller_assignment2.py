@@ -5,13 +5,44 @@ import pox.lib.packet.arp as arp
 import pox.lib.packet.icmp as icmp
 import pox.lib.packet.ipv4 as ip
 import pox.openflow.libopenflow_01 as of
-from pox.lib.util import dpidToStr
+from pox.lib.util import dpidToStr, str_to_bool
 from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+from sdnlib.rules import RuleIndex
+from sdnlib.classifier import set_match
+from sdnlib.proactive import compile_flow_mods
+from sdnlib.topology import Topology
+from sdnlib.sendbuf import buffer_for
+from sdnlib.learning import LearningTable, port_gone
+from sdnlib.flowcache import FlowCache, track_removal, match_key
+from sdnlib.aggregate import aggregated_drop
+from sdnlib.arpproxy import ArpResponder
+from sdnlib.rulestore import RuleStore
+from sdnlib.metrics import Metrics, start_reporting
+from sdnlib.admission import AdmissionControl, ADMIT, BLOCK, BLOCK_PRIORITY
+from sdnlib.aggregate import PUNT_PRIORITY
+from sdnlib.snapshot import StateSnapshot, flow_keys
+from sdnlib.fastpath import classify
+from sdnlib.templates import MessageTemplates, buffer_of
+from sdnlib.telemetry import StatsPoller, queue_caps
+from sdnlib.netspec import load_spec
+from sdnlib.timeouts import TimeoutPolicy, rule_class
 
 log = core.getLogger()
 
 # A table to map (switch_dpid, source_MAC) -> input_port for basic learning.
-table = {}
+# Bindings expire and each switch's share is capped (see launch()).
+table = LearningTable()
+
+# The flows we installed on each switch that it has not reported removed
+# yet. PacketIns for them are duplicates that raced the flow_mod, and only
+# need the packet forwarded.
+installed = FlowCache()
+
+# The idle and hard timeouts of our flows: set per rule class, lengthened
+# for flows that keep outliving them, and shortened as a switch's flow
+# table fills up (see sdnlib.timeouts).
+timeout_policy = TimeoutPolicy(installed)
 
 # A list of firewall and QoS "rules." Each rule is a dictionary:
 #  - EthSrc / EthDst: match these MACs
@@ -23,8 +54,12 @@ table = {}
 # flows also have a queue=0 with a large max‐rate. 
 # We also create catch‐all rules for the same pair to allow ARP/ICMP (no TCPPort).
 rules = [
-  # 1) H1->H3 on TCP port 40 => shaped at queue=0 (30Mb/s) 
-  {'EthSrc':'00:00:00:00:00:01','EthDst':'00:00:00:00:00:03','TCPPort':40,'queue':0,'drop':False},
+  # Queue numbers follow the allocation of network_assignment2.json (see
+  # sdnlib.qos): queue 0 is uncapped on every port, capped rates get the
+  # next ones. With --rules_file the spec's rules get them automatically.
+
+  # 1) H1->H3 on TCP port 40 => shaped at queue=1 (30Mb/s)
+  {'EthSrc':'00:00:00:00:00:01','EthDst':'00:00:00:00:00:03','TCPPort':40,'queue':1,'drop':False},
 
   # 2) H1->H2 on TCP port 60 => shaped at queue=1 (150Mb/s)
   {'EthSrc':'00:00:00:00:00:01','EthDst':'00:00:00:00:00:02','TCPPort':60,'queue':1,'drop':False},
@@ -54,45 +89,468 @@ rules = [
   {'EthSrc':'00:00:00:00:00:04','EthDst':'00:00:00:00:00:03','drop':True},
 ]
 
-def launch():
+# Where the hosts are attached in topo_assignment2.py: MAC -> (dpid, port).
+# Mininet numbers the switches' dpids after their names (s1 -> 1, s2 -> 2).
+hosts = {
+  '00:00:00:00:00:01': (1, 1),  # h1 on s1-eth1
+  '00:00:00:00:00:02': (1, 2),  # h2 on s1-eth2
+  '00:00:00:00:00:03': (2, 1),  # h3 on s2-eth1
+  '00:00:00:00:00:04': (2, 2),  # h4 on s2-eth2
+}
+
+# The hosts' static addresses in topo_assignment2.py: IP -> MAC. They seed
+# the ARP responder (see --arp_proxy).
+host_ips = {
+  '10.0.0.1': '00:00:00:00:00:01',
+  '10.0.0.2': '00:00:00:00:00:02',
+  '10.0.0.3': '00:00:00:00:00:03',
+  '10.0.0.4': '00:00:00:00:00:04',
+}
+
+# The trunk between the switches: dpid -> {neighbour dpid: local port}.
+# With --discovery the links are learned from openflow.discovery instead.
+links = {
+  1: {2: 3},  # s1-eth3 -> s2
+  2: {1: 3},  # s2-eth3 -> s1
+}
+
+# The rules above compiled into a hash index (see sdnlib.rules), built once
+# by launch() so that PacketIn never has to scan the list.
+rule_index = None
+
+# The switch graph and host locations, seeded from the two tables above and
+# kept up to date as hosts are learned. It lets us install a flow on every
+# switch of its path on the first PacketIn.
+topology = Topology()
+
+# In proactive mode every switch gets the decidable part of the rules table
+# as soon as it connects (see _handle_ConnectionUp).
+proactive_mode = False
+
+# In aggregate mode the default-drop path installs one drop flow per MAC
+# pair the rules table has no verdict for, instead of one per TCP port.
+aggregate_mode = False
+
+# Answers ARP requests from the controller when --arp_proxy is given.
+arp_responder = None
+
+# PacketIn handling time per branch of _handle_PacketIn (see --metrics_interval).
+metrics = Metrics()
+
+# The rule flow_mods, packed once per MAC pair and egress port and only
+# given a new xid when sent again.
+templates = MessageTemplates()
+
+# PacketIn budgets per source MAC and per switch, when enabled (see launch()).
+admission = None
+
+# Saves learned MACs and installed flows across restarts (see --state_file).
+state = None
+
+# The file the rules come from when --rules_file is given (see sdnlib.rulestore).
+rule_store = None
+
+# Whether a barrier request separates each flow_mod from the packet_out that
+# follows it, so the switch never forwards the packet before the flow exists.
+barrier_fence = False
+
+# How much of a table miss a switch that buffers it sends us (see launch()).
+miss_length = 128
+
+# Polls the switches' flow, port and queue stats, when enabled (see launch()).
+telemetry = None
+
+def launch(proactive=False, barrier=False, mac_ttl=300, mac_capacity=4096,
+           install_window=1.0, aggregate=False, discovery=False,
+           arp_proxy=False, rules_file=None, watch_interval=1.0,
+           metrics_interval=0, metrics_file=None, host_pktin_rate=0,
+           switch_pktin_rate=0, block_time=10, state_file=None,
+           snapshot_interval=10, miss_send_len=128, stats_interval=0,
+           stats_batch=50, qos_spec=None, table_size=0):
     """
-    Called by POX upon module load. Registers our handlers for:
+    Called by POX upon module load. Compiles the rules table and registers
+    our handlers for:
       - ConnectionUp (switch just connected)
       - PacketIn (incoming packet that didn't match a flow rule)
+
+    Pass --proactive to pre-install flows on ConnectionUp; PacketIn then
+    only handles traffic the rules table cannot decide up front. Pass
+    --barrier to fence every flow_mod from its packet_out.
+
+    Learned MACs expire after --mac_ttl seconds, and at most --mac_capacity
+    of them are kept per switch. A PacketIn for a flow installed less than
+    --install_window seconds ago does not get another flow_mod.
+
+    Pass --aggregate to drop unpermitted traffic with one flow per MAC pair
+    (see sdnlib.aggregate), so port scans don't fill the switch tables.
+
+    Pass --discovery to take the inter-switch links from openflow.discovery
+    rather than from the links table.
+
+    Pass --arp_proxy to answer ARP requests for known hosts directly
+    instead of flooding them through every switch.
+
+    Pass --rules_file to read the rules from a JSON, CSV or YAML file
+    instead of the table above. The file is checked every --watch_interval
+    seconds, and a change only replaces the flows of the MAC pairs whose
+    rules differ.
+
+    Every PacketIn is timed and counted per branch of the handler. Pass
+    --metrics_interval to log a summary every that many seconds, and
+    --metrics_file to write it there in Prometheus text format instead.
+
+    Pass --host_pktin_rate to limit the PacketIns per second a host can
+    cause at a switch (bursts of twice that): past the limit its table
+    misses there are dropped for --block_time seconds. --switch_pktin_rate
+    caps the PacketIns handled per switch, ignoring the excess.
+
+    Pass --state_file to save the learned MACs and installed flows there
+    every --snapshot_interval seconds and restore them on startup. Switches
+    reconnecting after a restart then have their flow tables reconciled
+    with what we know instead of wiped.
+
+    Switches that buffer their table misses are told to send only the
+    first --miss_send_len bytes of each, enough for the headers we
+    classify on; those packets are then forwarded by buffer_id rather
+    than sent back whole.
+
+    Pass --stats_interval to ask every switch for its flow, port and queue
+    stats every that many seconds, at most --stats_batch switches at a
+    time; the rates are kept in telemetry (see sdnlib.telemetry) and
+    exported with the metrics. With --qos_spec, queues sending above the
+    caps of that network spec are logged.
+
+    The timeouts of the flows shrink once a switch holds more than 3/4 of
+    --table_size of them (0, the default, for no limit).
     """
+    global rule_index, topology, proactive_mode, barrier_fence, table
+    global installed, aggregate_mode, arp_responder, rule_store, admission
+    global state, miss_length, telemetry, timeout_policy
+    if rules_file:
+        rule_store = RuleStore(rules_file, _rules_changed)
+        rule_index = rule_store.index
+        rule_store.watch(float(watch_interval))
+    else:
+        rule_index = RuleIndex(rules)
+    table = LearningTable(ttl=float(mac_ttl), capacity=int(mac_capacity))
+    # lookups only drop the expired MACs they run into; sweep the rest
+    if table.ttl > 0:
+        Timer(table.ttl, table.expire, recurring=True)
+    installed = FlowCache(window=float(install_window))
+    timeout_policy = TimeoutPolicy(installed, table_size=int(table_size))
+    if str_to_bool(discovery):
+        topology = Topology(hosts)
+        core.call_when_ready(
+            lambda: core.openflow_discovery.addListenerByName(
+                "LinkEvent", topology.handle_link_event),
+            "openflow_discovery")
+    else:
+        topology = Topology(hosts, links)
+    proactive_mode = str_to_bool(proactive)
+    barrier_fence = str_to_bool(barrier)
+    aggregate_mode = str_to_bool(aggregate)
+    miss_length = int(miss_send_len)
+    if str_to_bool(arp_proxy):
+        arp_responder = ArpResponder(host_ips, rule_index)
+    if float(host_pktin_rate) or float(switch_pktin_rate):
+        admission = AdmissionControl(float(host_pktin_rate),
+                                     float(switch_pktin_rate),
+                                     block_time=float(block_time))
+    if state_file:
+        state = StateSnapshot(state_file, table, installed,
+                              keep_priorities=(PUNT_PRIORITY, BLOCK_PRIORITY))
+        macs, flows = state.restore()
+        log.info("Restored %d learned MACs and %d installed flows from %s",
+                 macs, flows, state_file)
+        state.start(float(snapshot_interval))
+        core.openflow.addListenerByName("FlowStatsReceived",
+                                        _handle_FlowStatsReceived)
     core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
-    core.openflow.addListenerByName("PacketIn",    _handle_PacketIn)
+    core.openflow.addListenerByName("ConnectionDown", _handle_ConnectionDown)
+    core.openflow.addListenerByName("PortStatus",  _handle_PortStatus)
+    core.openflow.addListenerByName("FlowRemoved", _handle_FlowRemoved)
+    core.openflow.addListenerByName("PacketIn",    metrics.timed(_handle_PacketIn))
+    if float(stats_interval) > 0:
+        telemetry = StatsPoller(float(stats_interval), batch=int(stats_batch),
+                                caps=queue_caps(load_spec(qos_spec)) if qos_spec else None)
+        telemetry.start()
+    if float(metrics_interval) > 0:
+        start_reporting(metrics, float(metrics_interval), metrics_file,
+                        telemetry)
     log.info("Switch running.")
 
 def _handle_ConnectionUp(event):
     """
     Fired when a switch connects. We clear any old flows on that switch
-    to start with a clean slate.
+    to start with a clean slate, and in proactive mode install every drop
+    rule plus each forwarding rule whose way to the destination is already
+    known from the topology -- all in a single write.
     """
     log.info("Starting Switch %s", dpidToStr(event.dpid))
-    clear_flows = of.ofp_flow_mod(command = of.OFPFC_DELETE)
-    event.connection.send(clear_flows)
+    out = buffer_for(event.connection, barrier_fence)
+    # Only the headers of buffered table misses need to reach us
+    out.send(of.ofp_set_config(miss_send_len = miss_length))
+    if state is not None and state.should_reconcile(event.dpid):
+        # We were restarted and the switch kept its flows: ask for them and
+        # delete only what we don't stand behind (_handle_FlowStatsReceived)
+        out.send(of.ofp_stats_request(body = of.ofp_flow_stats_request()))
+    else:
+        installed.purge_switch(event.dpid)
+        clear_flows = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+        out.send(clear_flows)
+
+    if proactive_mode:
+        dpid = event.dpid
+        flow_mods = compile_flow_mods(
+            rule_index, lambda rule, dst: _forward_actions(dpid, rule, dst))
+        if flow_mods:
+            # The barrier keeps the switch from applying them before the delete
+            out.barrier()
+            for fm in flow_mods:
+                out.send(fm)
+        log.info("Pre-installed %d flows on switch %s",
+                 len(flow_mods), dpidToStr(dpid))
+
+def _handle_FlowStatsReceived(event):
+    """
+    Fired with the flow table of a switch; after a restart, flows neither
+    recorded as installed nor compiled from the rules are deleted.
+    """
+    dpid = event.dpid
+    expected = ()
+    if proactive_mode:
+        expected = flow_keys(compile_flow_mods(
+            rule_index, lambda rule, dst: _forward_actions(dpid, rule, dst)))
+    deletes = state.reconcile(dpid, event.stats, expected)
+    if deletes is None:
+        return
+    out = buffer_for(event.connection, barrier_fence)
+    for fm in deletes:
+        out.send(fm)
+    log.info("Reconciled switch %s: kept %d flows, deleted %d",
+             dpidToStr(dpid), len(event.stats) - len(deletes), len(deletes))
+
+def _handle_ConnectionDown(event):
+    """
+    Fired when a switch disconnects: forget everything learned on it.
+    """
+    purged = table.purge_switch(event.dpid)
+    installed.purge_switch(event.dpid)
+    _forget_hosts(purged)
+    if admission is not None:
+        admission.purge_switch(event.dpid)
+    log.info("Switch %s gone, forgot %d learned MACs", dpidToStr(event.dpid), len(purged))
+
+def _handle_PortStatus(event):
+    """
+    Fired when a switch port changes. Hosts behind a deleted or downed port
+    have to be learned again.
+    """
+    if port_gone(event):
+        purged = table.purge_port(event.dpid, event.port)
+        _forget_hosts(purged)
+        log.debug("Port %s of switch %s gone, forgot %d learned MACs",
+                  event.port, dpidToStr(event.dpid), len(purged))
+
+def _forget_hosts(macs):
+    """
+    Drops the flow_mod templates and installed-flow records of the flows
+    towards hosts whose port we forgot, so they are built and installed
+    afresh once the hosts are learned again.
+    """
+    for mac in macs:
+        templates.forget_host(mac)
+        installed.forget_host(mac)
+
+def _handle_FlowRemoved(event):
+    """
+    Fired when a flow we installed expires or is deleted; the next PacketIn
+    for it has to install it again, with timeouts fitted to how long and
+    busy this one was.
+    """
+    installed.remove(event.dpid, event.ofp.match)
+    timeout_policy.flow_removed(event.ofp)
+
+def _rules_changed(pairs):
+    """
+    Called by the rule store after the rules of some MAC pairs were
+    reloaded. Their flows are deleted on every switch -- the aggregate
+    drop and punt flows too, as the delete is not strict, and nothing
+    else, so the rest of the traffic keeps its flows -- and in proactive
+    mode the pairs' new flows are installed behind a barrier.
+    """
+    for connection in core.openflow.connections.values():
+        dpid = connection.dpid
+        out = buffer_for(connection, barrier_fence)
+        for src, dst in pairs:
+            stale = of.ofp_flow_mod(command = of.OFPFC_DELETE)
+            stale.match.dl_src = src
+            stale.match.dl_dst = dst
+            out.send(stale)
+            installed.forget_pair(src, dst)
+            templates.forget_pair(src, dst)
+            timeout_policy.forget_pair(src, dst)
+        if proactive_mode:
+            flow_mods = compile_flow_mods(
+                rule_index, lambda rule, dst: _forward_actions(dpid, rule, dst),
+                pairs)
+            if flow_mods:
+                out.barrier()
+                for fm in flow_mods:
+                    out.send(fm)
+    log.info("Rules of %d MAC pairs changed, their flows were replaced", len(pairs))
+
+def _forward_actions(dpid, rule, dst):
+    """
+    The actions switch dpid applies to traffic of a (non-drop) rule towards
+    dst, or None if the topology doesn't know the way.
+    """
+    hops = topology.route(dpid, dst)
+    if hops is None:
+        return None
+    return _hop_actions(rule, hops[0][1], len(hops) == 1)
+
+def _hop_actions(rule, port, last_hop):
+    """
+    The actions forwarding traffic of a (non-drop) rule out of the given
+    port. The rule's queue is only used on the last hop: the host-facing
+    ports are the ones the topology script configures queues on.
+    """
+    if last_hop and 'queue' in rule:
+        return [of.ofp_action_enqueue(port=port, queue_id=rule['queue'])]
+    return [of.ofp_action_output(port=port)]
+
+def _rule_flow_mod(eth_packet, rule, fields=None):
+    """
+    A flow_mod (without actions or timeouts yet) matching the traffic of a
+    rule between the packet's two hosts. fields, for a pair with rules on
+    more than the TCP port, are the packet's header fields to match on as
+    well (see RuleIndex.classify()).
+    """
+    fm = of.ofp_flow_mod()
+    fm.match.dl_src = eth_packet.src
+    fm.match.dl_dst = eth_packet.dst
+
+    # If also matching a TCP port in the flow (the index only returns
+    # such a rule for TCP packets to that port):
+    if fields is not None:
+        set_match(fm.match, fields)
+    elif 'TCPPort' in rule:
+        fm.match.dl_type = 0x800   # IPv4
+        fm.match.nw_proto = 6      # TCP
+        fm.match.tp_dst   = rule['TCPPort']
+    return fm
+
+def _rule_template(eth_packet, rule, port, last_hop, fields=None):
+    """
+    The template of the flow_mod for a rule between the packet's two hosts
+    that forwards out of port (as _hop_actions() does), or drops if port
+    is None. It is built and packed the first time only, and sent with
+    the timeouts timeout_policy picks each time.
+    """
+    queue = rule.get('queue') if port is not None and last_hop else None
+    def build():
+        fm = _rule_flow_mod(eth_packet, rule, fields)
+        if port is not None:
+            fm.actions.extend(_hop_actions(rule, port, last_hop))
+        return track_removal(fm)
+    return templates.flow_mod(eth_packet.src, eth_packet.dst,
+                              (rule.get('TCPPort'), port, queue, fields), build)
+
+def _install_path(event, eth_packet, rule, hops, out, fields=None):
+    """
+    Installs the flow of a forwarding rule on every switch from this one to
+    the destination host at once, egress switch first so the packet cannot
+    overtake its flow entries, and sends the packet on its way. Setting up
+    the flow then costs one PacketIn however long the path is.
+
+    If this switch kept the packet in a buffer, its flow_mod takes the
+    buffer_id, which applies the flow to the packet and saves the
+    packet_out.
+    """
+    buffer_id = buffer_of(event.ofp)
+    last = len(hops) - 1
+    new_flow = False
+    for hop in range(last, -1, -1):
+        dpid, port = hops[hop]
+        if hop == 0:
+            hop_out = out
+        else:
+            connection = core.openflow.getConnection(dpid)
+            if connection is None:
+                continue  # not connected (yet), it will ask us itself
+            hop_out = buffer_for(connection, barrier_fence)
+        template = _rule_template(eth_packet, rule, port, hop == last, fields)
+        timeouts = timeout_policy.timeouts(dpid, rule_class(rule), template.key)
+        if installed.should_install_key(dpid, template.key, timeouts[1]):
+            new_flow = hop == 0
+            hop_out.send(template.pack(buffer_id if new_flow else None, timeouts))
+
+    # The packet goes out with the actions of this switch's flow, which
+    # the loop above ended with
+    if new_flow and buffer_id is not None:
+        return
+    if new_flow:
+        out.fence()
+    out.send(template.packet_out(event.ofp, event.port))
 
 def _handle_PacketIn(event):
     """
     This function is triggered whenever the switch has a packet
     that doesn't match any installed flow. We'll examine it, check
     our rules, and install new flow entries or drop as needed.
+
+    Returns the name of the branch taken, under which metrics.timed()
+    records the handling time.
     """
     dpid       = event.connection.dpid   # numeric ID of the switch
     sw         = dpidToStr(dpid)         # string for logging
     inport     = event.port              # input port
-    eth_packet = event.parsed            # the parsed Ethernet frame
+    eth_packet = classify(event)         # header fields read from the raw frame
 
     log.debug("PacketIn: switch %s port %s packet %s", sw, inport, eth_packet)
 
-    # 1) Learn the input port for this source MAC, so we can route back later:
-    table[(dpid, eth_packet.src)] = inport
+    # Everything we send is queued here and written to the switch in one
+    # go at the end of the current event-loop tick.
+    out = buffer_for(event.connection, barrier_fence)
+
+    # 0) Hosts and switches over their PacketIn budget are not served. A
+    #    host that just went over it gets a short-lived drop flow for its
+    #    table misses on this switch, so they stop reaching us for a while.
+    #    A buffered packet is dropped by that flow, or else by an empty
+    #    packet_out, so the switch gets its buffer back.
+    if admission is not None:
+        verdict = admission.admit(dpid, eth_packet.src)
+        if verdict is not ADMIT:
+            buffer_id = buffer_of(event.ofp)
+            if verdict is BLOCK:
+                log.info("Blocking table misses from %s on switch %s for %s s",
+                         eth_packet.src, sw, admission.block_time)
+                out.send(admission.block_flow(eth_packet.src, inport, buffer_id))
+            elif buffer_id is not None:
+                out.send(admission.release(buffer_id, inport))
+            return verdict
+
+    # 1) Learn the input port for this source MAC, so we can route back later.
+    #    Unless it came in over the trunk, that is also where the host is:
+    #    If it is new there, flows towards it built for another port are stale:
+    if table.learn(dpid, eth_packet.src, inport):
+        templates.forget_host(eth_packet.src)
+    if not topology.is_link_port(dpid, inport):
+        topology.set_host(eth_packet.src, dpid, inport)
 
     # 2) If we already know how to reach the destination MAC, we store the port:
-    dst_port = table.get((dpid, eth_packet.dst))
+    dst_port = table.lookup(dpid, eth_packet.dst)
 
-    # 3) Special handling for ARP broadcast if destination is unknown:
+    # 3) ARP requests for hosts we know are answered right here, so they
+    #    don't have to be flooded:
+    if arp_responder is not None and eth_packet.type == eth.ARP_TYPE:
+        if arp_responder.handle(event, eth_packet, out):
+            log.debug("Answered ARP request from %s (%d floods avoided)",
+                      eth_packet.src, arp_responder.replies)
+            return 'arp_proxy'
+
+    #    Special handling for ARP broadcast if destination is unknown:
     if (dst_port is None and
         eth_packet.type == eth.ARP_TYPE and
         eth_packet.dst == EthAddr(b"\xff\xff\xff\xff\xff\xff")):
@@ -101,97 +559,94 @@ def _handle_PacketIn(event):
         pkt_out.in_port = inport
         pkt_out.data    = event.ofp
         pkt_out.actions.append(of.ofp_action_output(port = of.OFPP_FLOOD))
-        event.connection.send(pkt_out)
-        return  # done
-
-    # 4) Check each rule in our "rules" list
-    for rule in rules:
-        if (eth_packet.src == EthAddr(rule['EthSrc']) and
-            eth_packet.dst == EthAddr(rule['EthDst'])):
-
-            # If the rule includes a TCPPort, verify this packet is actually TCP 
-            # on that port:
-            if 'TCPPort' in rule:
-                if eth_packet.type != eth_packet.IP_TYPE:
-                    # Not an IP packet => skip this rule
-                    continue
-                ip_pkt = eth_packet.find('ipv4')
-                if not ip_pkt or ip_pkt.protocol != ip.TCP_PROTOCOL:
-                    # Not a TCP packet => skip
-                    continue
-                tcp_pkt = eth_packet.find('tcp')
-                if not tcp_pkt or tcp_pkt.dstport != rule['TCPPort']:
-                    # Different TCP port => skip
-                    continue
-
-            # At this point, we have a match => install a flow entry
-            fm = of.ofp_flow_mod()
-            fm.soft_timeout = 40  # 40-second flow entry as required
-            fm.match.dl_src = eth_packet.src
-            fm.match.dl_dst = eth_packet.dst
-
-            # If also matching a TCP port in the flow:
-            if 'TCPPort' in rule:
-                fm.match.dl_type = 0x800   # IPv4
-                fm.match.nw_proto = 6      # TCP
-                fm.match.tp_dst   = rule['TCPPort']
-
-            # If the rule says drop, we do not add any actions => drop
-            if rule['drop']:
-                # no actions => drop
-                pass
-            else:
-                # Otherwise we forward, possibly with a queue for rate-limiting
-                if dst_port is not None:
-                    if 'queue' in rule:
-                        # Use ofp_action_enqueue to specify queue ID 
-                        fm.actions.append(of.ofp_action_enqueue(
-                            port=dst_port, queue_id=rule['queue'])
-                        )
-                    else:
-                        # Normal forwarding with no queue shaping
-                        fm.actions.append(of.ofp_action_output(port=dst_port))
-
-            # Send the flow_mod to the switch
-            event.connection.send(fm)
-
-            # Also send out this *current* packet (so it is not dropped)
-            po = of.ofp_packet_out()
-            po.data    = event.ofp
-            po.in_port = inport
-
-            if not rule['drop'] and dst_port is not None:
-                # Forward the current packet with the same logic
-                if 'queue' in rule:
-                    po.actions.append(of.ofp_action_enqueue(
-                        port=dst_port, queue_id=rule['queue']))
-                else:
-                    po.actions.append(of.ofp_action_output(port=dst_port))
-
-            event.connection.send(po)
-
-            return  # Stop checking other rules, done
+        out.send(pkt_out)
+        return 'arp_flood'
+
+    # 4) Find the first rule for this (src, dst) pair -- and TCP port, if the
+    #    pair has port-specific rules -- in the compiled rule index. If the
+    #    pair has rules on IP addresses, protocols or port ranges, fields
+    #    are the header fields of this packet its flows match on:
+    rule, fields = rule_index.classify(eth_packet)
+    if rule is not None:
+        # If we know where the destination host is, set up the whole path
+        if not rule['drop']:
+            hops = topology.route(dpid, eth_packet.dst)
+            if hops is not None:
+                _install_path(event, eth_packet, rule, hops, out, fields)
+                return 'path'
+
+        # Otherwise, we have a match => install a flow entry on this switch.
+        # If the rule says drop, it has no actions => drop; otherwise it
+        # forwards, possibly with a queue for rate-limiting
+        template = _rule_template(eth_packet, rule,
+                                  None if rule['drop'] else dst_port, True, fields)
+
+        # Send the flow_mod to the switch -- unless we already did for an
+        # earlier packet of this flow that beat the flow_mod to the switch.
+        # With the buffer_id of the packet, if the switch kept it, the flow
+        # is applied to this packet too
+        buffer_id = buffer_of(event.ofp)
+        timeouts = timeout_policy.timeouts(dpid, rule_class(rule), template.key)
+        new_flow = installed.should_install_key(dpid, template.key, timeouts[1])
+        if new_flow:
+            out.send(template.pack(buffer_id, timeouts))
+            if buffer_id is not None:
+                return 'rule_tcp' if 'TCPPort' in rule else 'rule'
+
+        # Otherwise also send out this *current* packet (so it is not
+        # dropped), with the same actions as the flow
+        if new_flow:
+            out.fence()  # flow_mod before packet_out, if fencing is enabled
+        out.send(template.packet_out(event.ofp, inport))
+
+        return 'rule_tcp' if 'TCPPort' in rule else 'rule'
 
     # 5) If we reach here, no rule matched => default is to drop
     #    This also prevents unknown flows from flooding uncontrollably.
-    fm = of.ofp_flow_mod()
-    fm.soft_timeout = 40
-    fm.match.dl_src = eth_packet.src
-    fm.match.dl_dst = eth_packet.dst
+    if aggregate_mode:
+        # The rules table proves that everything between these two hosts
+        # except the ports it permits is dropped, so say that in one flow
+        flow_mods = aggregated_drop(rule_index, eth_packet.src, eth_packet.dst)
+    else:
+        fm = of.ofp_flow_mod()
+        fm.match.dl_src = eth_packet.src
+        fm.match.dl_dst = eth_packet.dst
 
-    # If IP, also match that so subsequent packets are dropped 
-    # without going to the controller again
-    if eth_packet.type == eth_packet.IP_TYPE:
-        fm.match.dl_type = 0x800
-        ip_pkt = eth_packet.find('ipv4')
-        if ip_pkt and ip_pkt.protocol == ip.TCP_PROTOCOL:
-            tcp_pkt = eth_packet.find('tcp')
-            if tcp_pkt:
+        # If IP, also match that so subsequent packets are dropped 
+        # without going to the controller again -- or whatever the
+        # pair's rules look at, so the drop can't take their traffic
+        if fields is not None:
+            set_match(fm.match, fields)
+        elif eth_packet.type == eth_packet.IP_TYPE:
+            fm.match.dl_type = 0x800
+            if eth_packet.tp_dst is not None:
                 fm.match.nw_proto = 6      # TCP
-                fm.match.tp_dst   = tcp_pkt.dstport
+                fm.match.tp_dst   = eth_packet.tp_dst
+        flow_mods = [fm]
 
-    event.connection.send(fm)
+    # The first flow_mod is the drop; any others only punt permitted ports
+    # back to us, so their removal is of no interest. They go with the
+    # drop's hard timeout but no idle timeout: idling out before the drop
+    # would leave it to take over their traffic, and every reinstall of
+    # the drop resends them, which restarts it. A buffered packet is
+    # dropped by the drop flow itself
+    buffer_id = buffer_of(event.ofp)
+    drop = flow_mods[0]
+    drop.idle_timeout, drop.hard_timeout = timeout_policy.timeouts(dpid, 'drop', match_key(drop.match))
+    for fm in flow_mods[1:]:
+        fm.hard_timeout = drop.hard_timeout
+    new_flow = installed.should_install(dpid, drop.match, drop.hard_timeout)
+    if new_flow:
+        drop.buffer_id = buffer_id
+        out.send(track_removal(drop))
+        for fm in flow_mods[1:]:
+            out.send(fm)
+        if buffer_id is not None:
+            return 'default_drop'
 
     # Drop the *current* packet_in:
     po = of.ofp_packet_out(data=event.ofp, in_port=inport)
-    event.connection.send(po)
+    if new_flow:
+        out.fence()
+    out.send(po)
+    return 'default_drop'
@@ -0,0 +1,8 @@
+"""
+Shared building blocks for the assignment POX controllers.
+
+The controllers in assignment1/ and assignment2/ import from this package,
+so the repository root has to be importable when POX loads them, e.g.:
+
+    PYTHONPATH=/path/to/open-recon-net ./pox.py controller_assignment1
+"""
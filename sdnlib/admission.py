@@ -0,0 +1,173 @@
+"""
+PacketIn admission control.
+
+Every table miss costs the controller a PacketIn, and nothing used to bound
+how many a host can cause: in assignment 1 each unmatched frame is flooded
+from the controller, in assignment 2 each new TCP port of a scan gets its
+own drop flow_mod. AdmissionControl puts token buckets in front of the
+PacketIn handler, one per source MAC at each switch and one per switch. A
+host running out of tokens gets a temporary drop flow on that switch, so
+its misses stop reaching the controller for a while; a switch running out
+only has its excess PacketIns ignored. Well-behaved hosts keep their
+latency either way. A rejected PacketIn whose packet the switch buffered
+still gets an answer -- the block flow carries its buffer_id, or else an
+empty packet_out does -- so the switch frees the buffer.
+"""
+from collections import OrderedDict
+import math
+import time
+
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.aggregate import AGGREGATE_DROP_PRIORITY
+
+# Below every flow the controllers install, so a blocked host only loses
+# the traffic that would have been a table miss; its installed flows stay.
+BLOCK_PRIORITY = AGGREGATE_DROP_PRIORITY - 0x100
+
+ADMIT = 'admit'
+BLOCK = 'block'          # the source just went over its budget
+BLOCKED = 'blocked'      # the source is blocked already
+THROTTLED = 'throttled'  # the switch is over its budget
+
+
+def release(buffer_id, in_port=None):
+    """
+    A packet_out without actions, dropping the buffered packet of a
+    PacketIn that is not forwarded so its switch buffer is freed.
+    """
+    po = of.ofp_packet_out(buffer_id=buffer_id)
+    if in_port is not None:
+        po.in_port = in_port
+    return po
+
+
+class TokenBuckets(object):
+    """
+    Token buckets of rate tokens per second and burst tokens deep, one per
+    key, created full on first use. At most capacity buckets are kept, the
+    least recently used ones are dropped first (they would be full again
+    anyway unless used within burst / rate seconds).
+    """
+
+    def __init__(self, rate, burst, capacity=4096, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.capacity = capacity
+        self._clock = clock
+        self._buckets = OrderedDict()  # key -> [tokens, last refill time]
+
+    def take(self, key):
+        """
+        Takes a token from key's bucket; returns False if it is empty.
+        """
+        now = self._clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.capacity:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def forget(self, key):
+        self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionControl(object):
+    """
+    Per-source and per-switch PacketIn budgets. A rate of 0 disables that
+    limit; bursts default to twice the rate.
+    """
+
+    def __init__(self, host_rate=0, switch_rate=0, host_burst=None, switch_burst=None,
+                 block_time=10, capacity=4096, clock=time.time):
+        self.block_time = block_time
+        self._capacity = capacity
+        self._clock = clock
+        self._hosts = None
+        self._switches = None
+        if host_rate:
+            self._hosts = TokenBuckets(host_rate, host_burst or 2 * host_rate, capacity, clock)
+        if switch_rate:
+            self._switches = TokenBuckets(switch_rate, switch_burst or 2 * switch_rate, capacity, clock)
+        self._blocked = {}  # (dpid, MAC) -> end of the block
+        self.admitted = 0
+        self.blocks = 0
+        self.rejected = 0
+
+    def admit(self, dpid, src):
+        """
+        Decides on a PacketIn from src at switch dpid: ADMIT, BLOCK (install
+        block_flow() for it), BLOCKED or THROTTLED (ignore the PacketIn, but
+        release() its buffer).
+        """
+        key = (dpid, src)
+        if self._blocked:
+            until = self._blocked.get(key)
+            if until is not None:
+                if self._clock() < until:
+                    self.rejected += 1
+                    return BLOCKED
+                del self._blocked[key]
+        if self._hosts is not None and not self._hosts.take(key):
+            if len(self._blocked) >= self._capacity:
+                self._expire_blocks()
+            self._blocked[key] = self._clock() + self.block_time
+            self._hosts.forget(key)
+            self.blocks += 1
+            self.rejected += 1
+            return BLOCK
+        if self._switches is not None and not self._switches.take(dpid):
+            self.rejected += 1
+            return THROTTLED
+        self.admitted += 1
+        return ADMIT
+
+    def _expire_blocks(self):
+        now = self._clock()
+        for key in [key for key, until in self._blocked.items() if until <= now]:
+            del self._blocked[key]
+
+    def purge_switch(self, dpid):
+        for key in [key for key in self._blocked if key[0] == dpid]:
+            del self._blocked[key]
+        if self._switches is not None:
+            self._switches.forget(dpid)
+
+    def block_flow(self, src, in_port=None, buffer_id=None):
+        """
+        The temporary flow dropping src's table misses for block_time
+        seconds. With the buffer_id of the PacketIn, it drops the buffered
+        packet too.
+        """
+        fm = of.ofp_flow_mod()
+        fm.priority = BLOCK_PRIORITY
+        # whole seconds, and at least one: a hard_timeout of 0 never expires
+        fm.hard_timeout = max(1, int(math.ceil(self.block_time)))
+        fm.match.dl_src = src
+        if in_port is not None:
+            fm.match.in_port = in_port
+        if buffer_id is not None:
+            fm.buffer_id = buffer_id
+        return fm
+
+    def release(self, buffer_id, in_port=None):
+        return release(buffer_id, in_port)
+
+    def stats(self):
+        return {
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'blocks': self.blocks,
+            'blocked_now': len(self._blocked),
+        }
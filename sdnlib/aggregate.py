@@ -0,0 +1,66 @@
+"""
+Aggregated drop flows.
+
+When a packet matches no rule, the default-drop path installs a flow for
+exactly that (src, dst, ethertype, TCP port) -- so a port scan costs one
+PacketIn and one switch table entry per port. The rules table usually
+proves a much broader verdict: a MAC pair without any rule drops
+everything, and a pair that only has port-specific rules drops everything
+but those ports. aggregated_drop() turns that into a single pair-wide drop
+flow, plus one entry per permitted port sending that traffic back to the
+controller, where the reactive path installs the real rule above both.
+"""
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.classifier import ofp_matches
+
+# Both sit below the default priority of the reactively installed rule
+# flows, and the punt entries above the drop they carve exceptions out of.
+AGGREGATE_DROP_PRIORITY = of.OFP_DEFAULT_PRIORITY - 0x100
+PUNT_PRIORITY = AGGREGATE_DROP_PRIORITY + 1
+
+
+def aggregated_drop(rule_index, src, dst):
+    """
+    Returns the flow_mods implementing "drop everything from src to dst that
+    no rule permits": the pair-wide drop flow first, then a punt-to-controller
+    flow per TCP port with a forwarding rule.
+
+    The forwarding rules of a pair with rules on more than the TCP port
+    are punted by their own matches (see classifier.ofp_matches()), or
+    without their ports where those take too many matches.
+    """
+    drop = of.ofp_flow_mod()
+    drop.priority = AGGREGATE_DROP_PRIORITY
+    drop.match.dl_src = src
+    drop.match.dl_dst = dst
+    flow_mods = [drop]
+
+    pair = rule_index.pair(src, dst)
+    if pair is None:
+        return flow_mods
+    if pair.rich:
+        for rule in pair.rules:
+            if not rule['drop']:
+                for match in ofp_matches(rule, cover=True):
+                    flow_mods.append(_punt(src, dst, match))
+        return flow_mods
+    for tcp_port, (position, rule) in sorted(pair.ports.items()):
+        if rule['drop']:
+            continue
+        match = of.ofp_match()
+        match.dl_type = 0x800   # IPv4
+        match.nw_proto = 6      # TCP
+        match.tp_dst = tcp_port
+        flow_mods.append(_punt(src, dst, match))
+    return flow_mods
+
+
+def _punt(src, dst, match):
+    punt = of.ofp_flow_mod()
+    punt.priority = PUNT_PRIORITY
+    punt.match = match
+    punt.match.dl_src = src
+    punt.match.dl_dst = dst
+    punt.actions.append(of.ofp_action_output(port=of.OFPP_CONTROLLER))
+    return punt
@@ -0,0 +1,491 @@
+"""
+An asyncio OpenFlow 1.0 front end for the controllers.
+
+POX terminates the switch connections in its recoco scheduler, a
+cooperative single-threaded loop that is hard to profile and tops out at
+a modest number of connections. This module speaks OpenFlow 1.0 itself on
+an asyncio server -- hello, features, echo, packet_in, port_status,
+flow_removed and stats replies in; flow_mod, packet_out and whatever else
+the controller sends out -- and hands the events to an unmodified
+controller module through the sdnlib.shim stand-ins, the way a shard
+worker does. POX is only needed for its libraries. uvloop is used when it
+is installed.
+
+    python -m sdnlib.aioflow --pox ~/pox --controller assignment2 --port 6633 \\
+        --rules_file=assignment2/network_assignment2.json
+
+Options besides the ones listed by --help are passed on to the
+controller's launch(), as with ./pox.py. The recurring timers of
+--watch_interval, --metrics_interval and --snapshot_interval run on the
+asyncio loop (see LoopTimer); --discovery needs POX's own core and is not
+available here.
+
+--selfcheck runs the controller against local fake switches connected over
+loopback sockets instead, and reports what they received:
+
+    python -m sdnlib.aioflow --pox ~/pox --controller assignment1 --selfcheck
+"""
+import argparse
+import asyncio
+import collections
+import os
+import struct
+import sys
+import time
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from sdnlib.shim import init_pox
+
+OFP_VERSION = 0x01
+
+OFPT_HELLO = 0
+OFPT_ERROR = 1
+OFPT_ECHO_REQUEST = 2
+OFPT_ECHO_REPLY = 3
+OFPT_FEATURES_REQUEST = 5
+OFPT_FEATURES_REPLY = 6
+OFPT_PACKET_IN = 10
+OFPT_FLOW_REMOVED = 11
+OFPT_PORT_STATUS = 12
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPT_STATS_REPLY = 17
+OFPT_BARRIER_REPLY = 19
+
+OFPSF_REPLY_MORE = 0x0001
+
+# Events raised for each kind of stats reply, named as POX names them
+STATS_EVENTS = {
+    0: 'SwitchDescReceived',
+    1: 'FlowStatsReceived',
+    2: 'AggregateFlowStatsReceived',
+    3: 'TableStatsReceived',
+    4: 'PortStatsReceived',
+    5: 'QueueStatsReceived',
+}
+
+_HEADER = struct.Struct('!BBHI')
+_DPID = struct.Struct('!Q')
+_ERROR = struct.Struct('!HH')
+_STATS = struct.Struct('!HH')
+
+
+def header(msg_type, length=8, xid=0):
+    return _HEADER.pack(OFP_VERSION, msg_type, length, xid)
+
+
+class LoopTimer(object):
+    """
+    Stands in for pox.lib.recoco.Timer on the running asyncio loop: calls
+    callback(*args, **kw) after interval seconds, and then every interval
+    seconds if recurring. As with recoco, a recurring callback returning
+    False stops the timer.
+    """
+
+    def __init__(self, timeToWake, callback, absoluteTime=False, recurring=False,
+                 args=(), kw={}, scheduler=None, started=True, selfStoppable=True):
+        self._loop = asyncio.get_event_loop()
+        self._interval = timeToWake - time.time() if absoluteTime else timeToWake
+        self._callback = callback
+        self._recurring = recurring
+        self._args = args
+        self._kw = kw
+        self._self_stoppable = selfStoppable
+        self._handle = None
+        if started:
+            self.start()
+
+    def start(self):
+        self._handle = self._loop.call_later(max(self._interval, 0), self._fire)
+
+    def _fire(self):
+        self._handle = None
+        result = self._callback(*self._args, **self._kw)
+        if self._recurring and not (self._self_stoppable and result is False):
+            self.start()
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+class Connection(object):
+    """
+    A switch connection as the controllers see it: a dpid, the features
+    reply and send(), which takes an OpenFlow message or packed bytes.
+    """
+
+    def __init__(self, protocol, transport, dpid, features=None):
+        self.protocol = protocol
+        self.transport = transport
+        self.dpid = dpid
+        self.features = features
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self.transport.write(data)
+
+    def disconnect(self):
+        self.transport.close()
+
+    def __repr__(self):
+        return '<Connection dpid=%s>' % self.dpid
+
+
+class OpenFlowProtocol(asyncio.Protocol):
+    """
+    One switch connection: splits the byte stream into OpenFlow messages,
+    runs the handshake and raises the switch's events on the nexus.
+    """
+
+    def __init__(self, nexus):
+        self.nexus = nexus
+        self.connection = None
+        self.transport = None
+        self._buffer = bytearray()
+        self._stats = {}  # xid -> stats reply parts received so far
+
+    def connection_made(self, transport):
+        import pox.openflow.libopenflow_01 as of
+
+        self.transport = transport
+        transport.write(header(OFPT_HELLO) + header(OFPT_FEATURES_REQUEST, xid=of.generate_xid()))
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf += data
+        offset = 0
+        end = len(buf)
+        while end - offset >= 8:
+            version, msg_type, length, xid = _HEADER.unpack_from(buf, offset)
+            if length < 8:
+                self._fail("bad message length %d" % length)
+                return
+            if end - offset < length:
+                break
+            self._dispatch(msg_type, xid, bytes(buf[offset:offset + length]))
+            offset += length
+        if offset:
+            del buf[:offset]
+
+    def connection_lost(self, exc):
+        self.down()
+
+    def down(self):
+        """
+        Raises ConnectionDown for the switch, once.
+        """
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        from sdnlib import shim
+
+        if self.nexus.connections.get(connection.dpid) is connection:
+            del self.nexus.connections[connection.dpid]
+        self.nexus.raiseEvent('ConnectionDown', shim.Event(connection))
+
+    def _fail(self, reason):
+        _log().warning("Dropping switch %s: %s",
+                      self.connection.dpid if self.connection else '(handshake)', reason)
+        self.transport.close()
+
+    def _dispatch(self, msg_type, xid, raw):
+        import pox.openflow.libopenflow_01 as of
+        from sdnlib import shim
+
+        connection = self.connection
+        if msg_type == OFPT_PACKET_IN:
+            if connection is None:
+                return
+            ofp = of.ofp_packet_in()
+            ofp.unpack(raw)
+            self.nexus.raiseEvent('PacketIn', shim.PacketIn(connection, ofp))
+        elif msg_type == OFPT_ECHO_REQUEST:
+            # after the replies to whatever the switch sent before the echo
+            asyncio.get_event_loop().call_soon(
+                self.transport.write, header(OFPT_ECHO_REPLY, len(raw), xid) + raw[8:])
+        elif msg_type == OFPT_HELLO:
+            if raw[0] != OFP_VERSION:
+                self._fail("speaks OpenFlow version %#x" % raw[0])
+        elif msg_type == OFPT_FEATURES_REPLY:
+            if connection is not None:
+                return
+            features = of.ofp_features_reply()
+            features.unpack(raw)
+            dpid = _DPID.unpack_from(raw, 8)[0]
+            previous = self.nexus.connections.get(dpid)
+            if previous is not None:
+                _log().warning("Switch %s reconnected; dropping its old connection", dpid)
+                previous.protocol.down()
+                previous.disconnect()
+            connection = self.connection = Connection(self, self.transport, dpid, features)
+            self.nexus.connections[dpid] = connection
+            self.nexus.raiseEvent('ConnectionUp', shim.Event(connection, ofp=features))
+        elif connection is None:
+            return
+        elif msg_type == OFPT_PORT_STATUS:
+            ofp = of.ofp_port_status()
+            ofp.unpack(raw)
+            self.nexus.raiseEvent('PortStatus', shim.port_status(connection, ofp))
+        elif msg_type == OFPT_FLOW_REMOVED:
+            ofp = of.ofp_flow_removed()
+            ofp.unpack(raw)
+            self.nexus.raiseEvent('FlowRemoved', shim.Event(connection, ofp=ofp))
+        elif msg_type == OFPT_STATS_REPLY:
+            self._stats_reply(connection, xid, raw)
+        elif msg_type == OFPT_BARRIER_REPLY:
+            self.nexus.raiseEvent('BarrierIn', shim.Event(connection, xid=xid))
+        elif msg_type == OFPT_ERROR:
+            err_type, code = _ERROR.unpack_from(raw, 8)
+            _log().warning("Switch %s reports error type %d code %d for xid %d",
+                          connection.dpid, err_type, code, xid)
+
+    def _stats_reply(self, connection, xid, raw):
+        """
+        Collects the parts of a stats reply and raises the event once the
+        last part is in, with the bodies of all parts in stats.
+        """
+        import pox.openflow.libopenflow_01 as of
+        from sdnlib import shim
+
+        ofp = of.ofp_stats_reply()
+        ofp.unpack(raw)
+        stats_type, flags = _STATS.unpack_from(raw, 8)
+        parts = self._stats.setdefault(xid, [])
+        parts.append(ofp)
+        if flags & OFPSF_REPLY_MORE:
+            return
+        del self._stats[xid]
+        name = STATS_EVENTS.get(stats_type)
+        if name is None:
+            return
+        self.nexus.raiseEvent(name, shim.stats_event(connection, parts))
+
+
+def _log():
+    from pox.core import core
+    return core.getLogger()
+
+
+def new_event_loop(use_uvloop=True):
+    if use_uvloop and uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def setup(controller, launch_args=None, prepare=None):
+    """
+    Registers a shim nexus as core.openflow and launches the controller on
+    it; must run on the event loop serving the switches. prepare(module), if
+    given, can change the controller's tables before launch(). Returns the
+    nexus and the controller module.
+    """
+    import pox.lib.recoco
+    from sdnlib import sendbuf, shim
+
+    core = shim.init_pox()  # if main() did not already
+    nexus = shim.Nexus()
+    core.register('openflow', nexus)
+    # the controllers' modules bind Timer when they are imported
+    pox.lib.recoco.Timer = LoopTimer
+    module = shim.load_controller(controller)
+    if prepare is not None:
+        prepare(module)
+    module.launch(**(launch_args or {}))
+    # one tick is one pass of the loop over the sockets that became readable
+    sendbuf.set_scheduler(asyncio.get_event_loop().call_soon)
+    return nexus, module
+
+
+async def serve(controller, address='0.0.0.0', port=6633, launch_args=None):
+    """
+    Runs the controller on an OpenFlow listener until cancelled.
+    """
+    nexus, module = setup(controller, launch_args)
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(lambda: OpenFlowProtocol(nexus), address, port)
+    _log().info("Listening for switches on %s:%d with %s", address, port,
+               type(loop).__module__.split('.')[0])
+    async with server:
+        await server.serve_forever()
+
+
+class FakeSwitch(object):
+    """
+    A switch for local tests: answers the controller's handshake and echo
+    requests, sends PacketIns and counts the messages it receives by type.
+    """
+
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.received = collections.Counter()
+        self.connected = None
+        self._reader = None
+        self._writer = None
+        self._echoes = {}
+        self._xid = 0
+        self._task = None
+
+    async def connect(self, host, port):
+        self.connected = asyncio.get_event_loop().create_future()
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self._writer.write(header(OFPT_HELLO))
+        self._task = asyncio.ensure_future(self._read())
+        await self.connected
+
+    async def _read(self):
+        try:
+            while True:
+                head = await self._reader.readexactly(8)
+                version, msg_type, length, xid = _HEADER.unpack(head)
+                body = await self._reader.readexactly(length - 8)
+                self.received[msg_type] += 1
+                if msg_type == OFPT_FEATURES_REQUEST:
+                    # datapath_id, n_buffers, n_tables, capabilities, actions; no ports
+                    reply = _DPID.pack(self.dpid) + struct.pack('!IB3xII', 256, 1, 0, 0xfff)
+                    self._writer.write(header(OFPT_FEATURES_REPLY, 8 + len(reply), xid) + reply)
+                    # connected once the controller has handled the reply
+                    self.echo().add_done_callback(lambda f: self.connected.set_result(True))
+                elif msg_type == OFPT_ECHO_REQUEST:
+                    self._writer.write(header(OFPT_ECHO_REPLY, length, xid) + body)
+                elif msg_type == OFPT_ECHO_REPLY:
+                    waiter = self._echoes.pop(xid, None)
+                    if waiter is not None:
+                        waiter.set_result(True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def packet_in(self, in_port, data, buffer_id=0xffffffff):
+        body = struct.pack('!IHHBx', buffer_id, len(data), in_port, 0) + data
+        self._writer.write(header(OFPT_PACKET_IN, 8 + len(body), self._next_xid()) + body)
+
+    def echo(self):
+        """
+        Returns a future done when the controller has answered an echo
+        request; as the controller answers in order, everything sent
+        before it has been handled by then.
+        """
+        xid = self._next_xid()
+        waiter = self._echoes[xid] = asyncio.get_event_loop().create_future()
+        self._writer.write(header(OFPT_ECHO_REQUEST, xid=xid))
+        return waiter
+
+    def _next_xid(self):
+        self._xid += 1
+        return self._xid
+
+    async def close(self):
+        self._writer.close()
+        await self._task
+
+
+async def selfcheck(controller, switches=4, events=10000, launch_args=None):
+    """
+    Serves the controller on a loopback port, connects fake switches and
+    feeds them synthetic PacketIns. Returns a list of problems found.
+    """
+    from sdnlib.bench import synthetic_frames
+
+    nexus, module = setup(controller, launch_args)
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(lambda: OpenFlowProtocol(nexus), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    problems = []
+
+    fakes = [FakeSwitch(dpid) for dpid in range(1, switches + 1)]
+    await asyncio.gather(*[fake.connect('127.0.0.1', port) for fake in fakes])
+    if sorted(nexus.connections) != [fake.dpid for fake in fakes]:
+        problems.append('connected dpids %s, expected 1..%d' % (sorted(nexus.connections), switches))
+
+    started = time.time()
+    await asyncio.gather(*[fake.echo() for fake in fakes])
+    rtt = time.time() - started
+
+    frames = synthetic_frames(module.rules, events)
+    started = time.time()
+    for i, (in_port, data) in enumerate(frames):
+        fakes[i % switches].packet_in(in_port, data)
+        if (i + 1) % 1000 == 0:
+            await asyncio.gather(*[fake.echo() for fake in fakes])
+    await asyncio.gather(*[fake.echo() for fake in fakes])
+    elapsed = time.time() - started
+
+    received = collections.Counter()
+    for fake in fakes:
+        received.update(fake.received)
+        if not fake.received[OFPT_FLOW_MOD] and not fake.received[OFPT_PACKET_OUT]:
+            problems.append('switch %d received no flow_mod or packet_out' % fake.dpid)
+
+    for fake in fakes:
+        await fake.close()
+    await asyncio.sleep(0.05)
+    if nexus.connections:
+        problems.append('connections left after disconnecting: %s' % sorted(nexus.connections))
+    server.close()
+    await server.wait_closed()
+
+    print('%s on %s: %d switches, %d PacketIns in %.2fs (%.0f/s), idle echo %.2f ms'
+          % (controller, type(loop).__module__.split('.')[0], switches, events, elapsed,
+             events / elapsed if elapsed else 0.0, rtt * 1e3))
+    print('received: %d flow_mod, %d packet_out, %d other'
+          % (received[OFPT_FLOW_MOD], received[OFPT_PACKET_OUT],
+             sum(received.values()) - received[OFPT_FLOW_MOD] - received[OFPT_PACKET_OUT]))
+    return problems
+
+
+def _launch_args(extra):
+    """
+    Turns POX style --name=value options into launch() keywords.
+    """
+    args = {}
+    for option in extra:
+        if not option.startswith('--'):
+            raise SystemExit("unexpected argument %s" % option)
+        name, _, value = option[2:].partition('=')
+        args[name.replace('-', '_')] = value if _ else True
+    return args
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a controller on an asyncio OpenFlow listener")
+    parser.add_argument('--pox', default=os.environ.get('POX_HOME'),
+                        help='path of the POX checkout (default: $POX_HOME)')
+    parser.add_argument('--controller', default='assignment2')
+    parser.add_argument('--address', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=6633)
+    parser.add_argument('--no-uvloop', action='store_true', help='use the default asyncio loop')
+    parser.add_argument('--selfcheck', action='store_true',
+                        help='run against local fake switches instead of listening')
+    parser.add_argument('--switches', type=int, default=4, help='fake switches for --selfcheck')
+    parser.add_argument('--events', type=int, default=10000, help='PacketIns for --selfcheck')
+    args, extra = parser.parse_known_args(argv)
+    launch_args = _launch_args(extra)
+
+    # before anything imports pox.core's core, which is None until then
+    init_pox(args.pox)
+
+    loop = new_event_loop(not args.no_uvloop)
+    asyncio.set_event_loop(loop)
+    try:
+        if args.selfcheck:
+            problems = loop.run_until_complete(
+                selfcheck(args.controller, args.switches, args.events, launch_args))
+            for problem in problems:
+                print('problem: %s' % problem)
+            return 1 if problems else 0
+        loop.run_until_complete(serve(args.controller, args.address, args.port, launch_args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
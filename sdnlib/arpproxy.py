@@ -0,0 +1,130 @@
+"""
+ARP responder running in the controller.
+
+Every ARP request for a host the controller has not learned yet is flooded
+out of all ports of the switch, and in a multi-switch domain out of every
+other switch too. ArpResponder keeps IP -> MAC bindings, seeded from the
+controller's host table and learned from every ARP packet it sees, and
+answers requests from that cache with a crafted reply sent straight back
+out of the port the request came in on. Only cache misses still flood.
+
+Seeded bindings are static: an ARP packet claiming a seeded address for
+another MAC does not change them, so a forged ARP cannot redirect the
+hosts. Gratuitous ARPs (sender and target address the same) and probes
+(no sender address) are never answered, so they still reach every host,
+for their caches and for duplicate address detection.
+
+Given the controller's RuleIndex, requests between a pair of hosts whose
+rule drops their traffic are not answered either, but left to the
+controller as before: the proxy must not answer for a host the firewall
+keeps the sender from reaching.
+When the switch buffered an answered request, an empty packet_out frees
+the buffer, as the reply goes out with its own data.
+"""
+import pox.lib.packet as pkt
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr, IP_ANY
+
+from sdnlib.admission import release
+from sdnlib.templates import buffer_of
+
+
+class ArpResponder(object):
+    """
+    IP -> MAC cache answering ARP requests on behalf of the hosts.
+    """
+
+    def __init__(self, bindings=None, rules=None):
+        self._static = {}  # seeded bindings, never overwritten by learn()
+        self._cache = {}   # learned bindings
+        self.rules = rules  # RuleIndex of the firewall, if any
+        self.replies = 0  # requests answered, i.e. floods avoided
+        self.misses = 0   # requests we could not answer
+        self.refused = 0  # requests between hosts the rules keep apart
+        for ip, mac in (bindings or {}).items():
+            self.seed(ip, mac)
+
+    def seed(self, ip, mac):
+        ip = IPAddr(ip)
+        self._static[ip] = EthAddr(mac)
+        self._cache.pop(ip, None)
+
+    def learn(self, arp_packet):
+        """
+        Remembers the sender binding of an ARP packet, unless its address
+        is statically bound.
+        """
+        if (arp_packet.protosrc != IP_ANY and arp_packet.hwsrc != pkt.ETHER_ANY
+                and arp_packet.protosrc not in self._static):
+            self._cache[arp_packet.protosrc] = arp_packet.hwsrc
+
+    def lookup(self, ip):
+        """
+        The MAC bound to ip, static bindings first, or None.
+        """
+        mac = self._static.get(ip)
+        if mac is None:
+            mac = self._cache.get(ip)
+        return mac
+
+    def handle(self, event, eth_packet, out):
+        """
+        Learns from an ARP frame, and answers it through the send buffer out
+        if it is a request for a known address the rules let its sender
+        reach. Returns True if it was answered, so the caller must not flood
+        it.
+        """
+        arp_packet = eth_packet.payload
+        if not isinstance(arp_packet, pkt.arp):
+            return False
+        self.learn(arp_packet)
+        if arp_packet.opcode != pkt.arp.REQUEST:
+            return False
+        if arp_packet.protosrc == IP_ANY or arp_packet.protosrc == arp_packet.protodst:
+            return False  # a probe or a gratuitous ARP: flooded unchanged
+        mac = self.lookup(arp_packet.protodst)
+        if mac is None:
+            self.misses += 1
+            return False
+        if self.dropped(eth_packet.src, mac):
+            self.refused += 1
+            return False
+
+        reply = pkt.arp()
+        reply.opcode = pkt.arp.REPLY
+        reply.hwsrc = mac
+        reply.hwdst = arp_packet.hwsrc
+        reply.protosrc = arp_packet.protodst
+        reply.protodst = arp_packet.protosrc
+        frame = pkt.ethernet(type=pkt.ethernet.ARP_TYPE, src=mac, dst=arp_packet.hwsrc)
+        frame.payload = reply
+
+        po = of.ofp_packet_out(data=frame.pack(), in_port=event.port)
+        po.actions.append(of.ofp_action_output(port=of.OFPP_IN_PORT))
+        out.send(po)
+        buffer_id = buffer_of(event.ofp)
+        if buffer_id is not None:
+            out.send(release(buffer_id, event.port))
+        self.replies += 1
+        return True
+
+    def dropped(self, src, dst):
+        """
+        True if the rules drop the traffic from MAC src to MAC dst.
+        """
+        if self.rules is None:
+            return False
+        rule = self.rules.lookup(src, dst)
+        return rule is not None and rule['drop']
+
+    def __len__(self):
+        return len(self._static) + len(self._cache)
+
+    def stats(self):
+        return {
+            'bindings': len(self),
+            'replies': self.replies,
+            'floods_avoided': self.replies,
+            'misses': self.misses,
+            'refused': self.refused,
+        }
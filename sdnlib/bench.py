@@ -0,0 +1,280 @@
+"""
+Offline PacketIn benchmark for the assignment controllers.
+
+Loads each controller module, runs its launch() against a stand-in for
+core.openflow, and replays synthetic ARP, ICMP and TCP frames through its
+_handle_PacketIn with fake switch connections that only record what is sent.
+No Mininet, Open vSwitch or root is needed -- only a POX checkout, which
+provides the packet and OpenFlow libraries the controllers are written
+against:
+
+    python -m sdnlib.bench --pox ~/pox
+    python -m sdnlib.bench --pox ~/pox --sizes 12,100000 --json > bench.json
+    python -m sdnlib.bench --pox ~/pox --baseline bench.json
+    python -m sdnlib.bench --pox ~/pox --sizes 1000 --buffered
+
+For every controller and rule-table size it reports PacketIns handled per
+second, p50/p99 handler latency, OpenFlow messages and socket writes per
+event, and the control-channel bytes per event in each direction. With
+--buffered every case is run again with switches that keep table misses in
+their buffers and send only the first miss_send_len bytes the controller
+asked for, which shows what answering by buffer_id saves. With --baseline it compares against an earlier --json run and exits
+non-zero when the throughput of any run dropped by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from sdnlib.shim import CONTROLLERS, init_pox
+
+DEFAULT_SIZES = (12, 1000, 10000, 100000)
+
+
+class FakeConnection(object):
+    """
+    Stands in for a POX switch connection; counts the writes and bytes the
+    controller sends to it.
+    """
+
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.writes = 0
+        self.bytes = 0
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self.writes += 1
+        self.bytes += len(data)
+
+
+def synthetic_rules(base_rules, size, seed=1):
+    """
+    Returns base_rules padded to size entries with rules for random
+    locally administered MAC pairs, some of them port-specific or drops.
+    """
+    rng = random.Random(seed)
+    rules = list(base_rules[:size])
+    while len(rules) < size:
+        src = '02:00:%02x:%02x:%02x:%02x' % tuple(rng.randrange(256) for _ in range(4))
+        dst = '02:00:%02x:%02x:%02x:%02x' % tuple(rng.randrange(256) for _ in range(4))
+        kind = rng.random()
+        if kind < 0.1:
+            rules.append({'EthSrc': src, 'EthDst': dst, 'drop': True})
+        elif kind < 0.4:
+            rules.append({'EthSrc': src, 'EthDst': dst, 'TCPPort': rng.choice((40, 60, 80, 5001)),
+                          'queue': rng.randrange(2), 'drop': False})
+        else:
+            rules.append({'EthSrc': src, 'EthDst': dst, 'queue': rng.randrange(2), 'drop': False})
+    return rules
+
+
+def synthetic_frames(rules, count, seed=2):
+    """
+    Returns count (in_port, raw frame) tuples: roughly 20% ARP broadcasts,
+    20% ICMP echo requests and 60% TCP segments, between MAC pairs taken from
+    the rules table so most frames hit a rule. Every host is given a fixed
+    switch port so the controllers can learn it.
+    """
+    import pox.lib.packet as pkt
+    from pox.lib.addresses import EthAddr, IPAddr
+
+    rng = random.Random(seed)
+    pairs = [(r['EthSrc'], r['EthDst']) for r in rules]
+    ports = [r['TCPPort'] for r in rules if 'TCPPort' in r] or [80]
+    host_ports = {}
+    frames = []
+
+    def host(mac):
+        if mac not in host_ports:
+            host_ports[mac] = len(host_ports) % 48 + 1
+        return EthAddr(mac), IPAddr('10.%d.%d.%d' % tuple(EthAddr(mac).toRaw()[3:])), host_ports[mac]
+
+    for _ in range(count):
+        src, dst = rng.choice(pairs)
+        src_mac, src_ip, in_port = host(src)
+        dst_mac, dst_ip, _ = host(dst)
+        kind = rng.random()
+        if kind < 0.2:
+            frame = pkt.ethernet(src=src_mac, dst=pkt.ETHER_BROADCAST, type=pkt.ethernet.ARP_TYPE)
+            frame.payload = pkt.arp(opcode=pkt.arp.REQUEST, hwsrc=src_mac, protosrc=src_ip,
+                                    protodst=dst_ip)
+        else:
+            frame = pkt.ethernet(src=src_mac, dst=dst_mac, type=pkt.ethernet.IP_TYPE)
+            if kind < 0.4:
+                l4 = pkt.icmp(type=pkt.TYPE_ECHO_REQUEST)
+                l4.payload = pkt.echo(id=1, seq=1)
+                proto = pkt.ipv4.ICMP_PROTOCOL
+            else:
+                l4 = pkt.tcp(srcport=rng.randrange(1024, 65536),
+                             dstport=rng.choice(ports) if rng.random() < 0.7 else rng.randrange(1, 1024))
+                l4.off = 5
+                l4.SYN = True
+                l4.payload = b'\x00' * rng.choice((0, 64, 1400))
+                proto = pkt.ipv4.TCP_PROTOCOL
+            ip_pkt = pkt.ipv4(srcip=src_ip, dstip=dst_ip, protocol=proto)
+            ip_pkt.payload = l4
+            frame.payload = ip_pkt
+        frames.append((in_port, frame.pack()))
+    return frames
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run(name, size, events, switches=1, launch_args=None, buffered=False):
+    """
+    Benchmarks one controller with a rules table of the given size and
+    returns the measurements as a dict. With buffered, the PacketIns refer
+    to a switch buffer and carry only the controller's miss_length bytes.
+    """
+    from pox.core import core
+    import pox.openflow.libopenflow_01 as of
+    from sdnlib import sendbuf, shim
+
+    module = shim.load_controller(name)
+    module.rules = synthetic_rules(module.rules, size)
+    nexus = shim.Nexus()
+    core.register('openflow', nexus)
+
+    started = time.perf_counter()
+    module.launch(**(launch_args or {}))
+    compile_time = time.perf_counter() - started
+    # No POX scheduler runs here, so flush the send buffers after each event
+    sendbuf.set_scheduler(None)
+
+    connections = []
+    for dpid in range(1, switches + 1):
+        connection = FakeConnection(dpid)
+        nexus.connections[dpid] = connection
+        connections.append(connection)
+        nexus.raiseEvent('ConnectionUp', shim.Event(connection))
+    sendbuf.flush_pending()
+    for connection in connections:
+        connection.writes = connection.bytes = 0
+
+    frames = synthetic_frames(module.rules, events)
+    miss_length = getattr(module, 'miss_length', 128)
+    packet_ins = []
+    received = 0
+    for i, (in_port, data) in enumerate(frames):
+        connection = connections[i % len(connections)]
+        if buffered:
+            ofp = of.ofp_packet_in(buffer_id=i, in_port=in_port, data=data[:miss_length],
+                                   total_len=len(data), reason=of.OFPR_NO_MATCH)
+        else:
+            ofp = of.ofp_packet_in(in_port=in_port, data=data, total_len=len(data),
+                                   reason=of.OFPR_NO_MATCH)
+        received += 18 + len(ofp.data)
+        packet_ins.append(shim.PacketIn(connection, ofp))
+
+    messages_before = sendbuf.totals['messages']
+    handlers = nexus.handlers['PacketIn']
+    latencies = []
+    clock = time.perf_counter
+    for event in packet_ins:
+        started = clock()
+        for handler in handlers:
+            handler(event)
+        sendbuf.flush_pending()
+        latencies.append(clock() - started)
+
+    total = sum(latencies)
+    latencies.sort()
+    writes = sum(c.writes for c in connections)
+    return {
+        'controller': name,
+        'rules': size,
+        'buffered': buffered,
+        'events': events,
+        'compile_ms': compile_time * 1e3,
+        'packet_in_per_sec': events / total if total else 0.0,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'messages_per_event': float(sendbuf.totals['messages'] - messages_before) / events,
+        'writes_per_event': float(writes) / events,
+        'bytes_per_event': float(sum(c.bytes for c in connections)) / events,
+        'packet_in_bytes_per_event': float(received) / events,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a line for every run whose throughput fell more than tolerance
+    (a fraction) below the matching run in baseline.
+    """
+    previous = dict(((r['controller'], r['rules'], r.get('buffered', False)), r) for r in baseline)
+    regressions = []
+    for r in results:
+        old = previous.get((r['controller'], r['rules'], r['buffered']))
+        if old is None or not old['packet_in_per_sec']:
+            continue
+        change = r['packet_in_per_sec'] / old['packet_in_per_sec'] - 1
+        if change < -tolerance:
+            regressions.append('%s with %d rules%s: %.0f -> %.0f PacketIn/s (%+.1f%%)'
+                               % (r['controller'], r['rules'],
+                                  ' (buffered)' if r['buffered'] else '', old['packet_in_per_sec'],
+                                  r['packet_in_per_sec'], change * 100))
+    return regressions
+
+
+def print_table(results):
+    print('%-12s %8s %4s %10s %9s %9s %9s %8s %8s %9s %10s' % (
+        'controller', 'rules', 'buf', 'compile_ms', 'pktin/s', 'p50_us', 'p99_us',
+        'msgs/ev', 'wr/ev', 'in_b/ev', 'bytes/ev'))
+    for r in results:
+        print('%-12s %8d %4s %10.1f %9.0f %9.1f %9.1f %8.2f %8.2f %9.1f %10.1f' % (
+            r['controller'], r['rules'], 'yes' if r['buffered'] else 'no', r['compile_ms'],
+            r['packet_in_per_sec'], r['p50_us'], r['p99_us'], r['messages_per_event'],
+            r['writes_per_event'], r['packet_in_bytes_per_event'], r['bytes_per_event']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pox', default=os.environ.get('POX_HOME'),
+                        help='path of the POX checkout (default: $POX_HOME)')
+    parser.add_argument('--controllers', default=','.join(sorted(CONTROLLERS)))
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma separated rule-table sizes')
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--switches', type=int, default=1)
+    parser.add_argument('--buffered', action='store_true',
+                        help='also run every case with switches that buffer table misses')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--baseline', help='JSON output of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed throughput drop against --baseline (default 0.10)')
+    args = parser.parse_args(argv)
+
+    # before anything imports pox.core's core, which is None until then
+    init_pox(args.pox)
+
+    results = []
+    for name in args.controllers.split(','):
+        for size in [int(s) for s in args.sizes.split(',')]:
+            for buffered in ((False, True) if args.buffered else (False,)):
+                results.append(run(name, size, args.events, args.switches, buffered=buffered))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            sys.stderr.write('REGRESSION: %s\n' % line)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
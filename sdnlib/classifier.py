@@ -0,0 +1,408 @@
+"""
+Rules on IP prefixes, protocols and port ranges, compiled for lookup.
+
+A rule of the rules table names a MAC pair and at most one TCP destination
+port. Rules may also use these fields, each of which is a wildcard when
+left out:
+
+    IPSrc, IPDst       "10.0.0.1", or a prefix such as "10.0.1.0/24"
+    Proto              "tcp", "udp", "icmp" or an IP protocol number
+    SrcPort, DstPort   a TCP or UDP port (Proto must say which), or a
+                       range, as "1000-2000" or [1000, 2000]
+
+TCPPort: 80 is short for Proto: "tcp", DstPort: 80. A rule matches a
+packet when every field it has matches, and the first rule of the list
+that matches decides, as before. A Classifier of its own also takes "*"
+for EthSrc or EthDst; RuleIndex, which files the rules by MAC pair before
+handing a pair's rules to one, needs both and raises ValueError for a "*".
+
+A Classifier compiles such a table one field at a time. Every field value
+of a rule is a range of integers (a single value, a prefix or a port
+range); the ends of the ranges of all rules cut each field into
+elementary intervals, and each interval gets the set of rules matching
+its values -- a bit per rule, bit i for the i-th rule of the list.
+Intervals with the same set form one equivalence class of the field, so
+a packet is described by one class per field. The first matching rule of
+a combination of classes is the lowest bit of the AND of their sets, and
+is kept in a cross-product table keyed by the combination.
+
+A lookup binary-searches the packet's value of every field among that
+field's at most 2N + 1 bounds (N rules) and looks the classes up in the
+cross-product table. Only the first packet of a combination pays for the
+AND, which takes time in proportion to N / wordsize; the table is filled
+on demand rather than up front, since the full cross product can be huge,
+and is emptied when it outgrows its capacity. A table of N rules with I
+interval bounds in a field takes up to I * N / 8 bytes for that field.
+
+match_fields() compiles a rule to OpenFlow 1.0 matches: the IP fields take
+prefixes, but the ports only exact values, so a port range becomes one
+match per port, up to a limit. flow_fields() gives the match of a reactive
+flow for one packet: exact on every field the table looks at, so the flow
+covers only packets every rule treats alike. linear_lookup() is the
+reference all of them are tested against (tests/test_classifier.py).
+"""
+from bisect import bisect_right
+import itertools
+import socket
+import struct
+
+IP_TYPE = 0x0800
+PROTOCOLS = {'icmp': 1, 'tcp': 6, 'udp': 17}
+
+# The fields of a packet key, in order, with their widths in bits. They are
+# named as in ofp_match.
+FIELDS = (
+    ('dl_src', 48),
+    ('dl_dst', 48),
+    ('dl_type', 16),
+    ('nw_src', 32),
+    ('nw_dst', 32),
+    ('nw_proto', 8),
+    ('tp_src', 16),
+    ('tp_dst', 16),
+)
+DL_SRC, DL_DST, DL_TYPE, NW_SRC, NW_DST, NW_PROTO, TP_SRC, TP_DST = range(len(FIELDS))
+
+# The fields RuleIndex has already decided on when it asks a pair's classifier
+PAIR_FIELDS = (DL_SRC, DL_DST)
+
+# Rule fields only a Classifier understands
+RICH_FIELDS = ('IPSrc', 'IPDst', 'Proto', 'SrcPort', 'DstPort')
+
+# Matches one rule may compile to, by default
+MATCH_LIMIT = 64
+
+# Combinations of field classes a Classifier remembers the rule of, by
+# default; past that its cross-product table starts over
+PRODUCT_CAPACITY = 65536
+
+_IP = struct.Struct('!I')
+
+
+def is_rich(rule):
+    """
+    True if a rule uses any field beyond a MAC pair and a TCP port.
+    """
+    for field in RICH_FIELDS:
+        if field in rule:
+            return True
+    return rule.get('EthSrc') == '*' or rule.get('EthDst') == '*'
+
+
+def _mac(value):
+    return int(str(value).replace('-', ':').replace(':', ''), 16)
+
+
+def _prefix(value):
+    """
+    Parses an IPv4 address or prefix into its (lowest, highest) address.
+    """
+    address, _, length = str(value).partition('/')
+    length = int(length) if length else 32
+    if not 0 <= length <= 32:
+        raise ValueError("bad prefix length in %r" % value)
+    size = 1 << (32 - length)
+    low = _IP.unpack(socket.inet_aton(address))[0] & ~(size - 1) & 0xffffffff
+    return low, low + size - 1
+
+
+def _port_range(value):
+    """
+    Parses a port, "low-high" or [low, high] into (low, high).
+    """
+    if isinstance(value, (list, tuple)):
+        low, high = value
+    elif isinstance(value, str) and '-' in value:
+        low, high = value.split('-', 1)
+    else:
+        low = high = value
+    low, high = int(low), int(high)
+    if not 0 <= low <= high <= 0xffff:
+        raise ValueError("bad port range %r" % (value,))
+    return low, high
+
+
+def _protocol(value):
+    if isinstance(value, str) and value.lower() in PROTOCOLS:
+        return PROTOCOLS[value.lower()]
+    number = int(value)
+    if not 0 <= number <= 0xff:
+        raise ValueError("bad IP protocol %r" % (value,))
+    return number
+
+
+def rule_ranges(rule):
+    """
+    Returns {field index: (low, high)} of the fields a rule constrains;
+    the others are wildcards. Raises ValueError for a malformed rule.
+    """
+    ranges = {}
+    for field, index in (('EthSrc', DL_SRC), ('EthDst', DL_DST)):
+        value = rule.get(field)
+        if value is not None and value != '*':
+            ranges[index] = (_mac(value),) * 2
+    for field, index in (('IPSrc', NW_SRC), ('IPDst', NW_DST)):
+        value = rule.get(field)
+        if value is not None and value != '*':
+            ranges[index] = _prefix(value)
+    proto = rule.get('Proto')
+    if proto is not None and proto != '*':
+        ranges[NW_PROTO] = (_protocol(proto),) * 2
+    if rule.get('TCPPort') is not None:
+        if ranges.get(NW_PROTO, (6, 6)) != (6, 6) or rule.get('DstPort') is not None:
+            raise ValueError("TCPPort rules take no other Proto or DstPort")
+        ranges[NW_PROTO] = (6, 6)
+        ranges[TP_DST] = (int(rule['TCPPort']),) * 2
+    for field, index in (('SrcPort', TP_SRC), ('DstPort', TP_DST)):
+        value = rule.get(field)
+        if value is not None and value != '*':
+            if ranges.get(NW_PROTO) not in ((6, 6), (17, 17)):
+                raise ValueError("%s needs Proto tcp or udp" % field)
+            ranges[index] = _port_range(value)
+    if any(index in ranges for index in (NW_SRC, NW_DST, NW_PROTO)):
+        ranges[DL_TYPE] = (IP_TYPE, IP_TYPE)
+    return ranges
+
+
+def packet_key(headers):
+    """
+    The key of a packet, in FIELDS order, from its fastpath Headers. Fields
+    the packet does not have are None.
+    """
+    tp_src = tp_dst = None
+    if headers.ports is not None:
+        tp_src, tp_dst = headers.ports
+    return (_mac_of(headers.src), _mac_of(headers.dst), headers.type, headers.nw_src,
+            headers.nw_dst, headers.nw_proto, tp_src, tp_dst)
+
+
+def parsed_key(eth_packet):
+    """
+    Like packet_key(), from a frame parsed by POX.
+    """
+    nw_src = nw_dst = nw_proto = tp_src = tp_dst = None
+    ip_pkt = eth_packet.find('ipv4')
+    if ip_pkt is not None:
+        nw_src = ip_pkt.srcip.toUnsigned()
+        nw_dst = ip_pkt.dstip.toUnsigned()
+        nw_proto = ip_pkt.protocol
+        l4 = ip_pkt.find('tcp') or ip_pkt.find('udp')
+        if l4 is not None:
+            tp_src, tp_dst = l4.srcport, l4.dstport
+    return (_mac_of(eth_packet.src), _mac_of(eth_packet.dst), eth_packet.type,
+            nw_src, nw_dst, nw_proto, tp_src, tp_dst)
+
+
+def _mac_of(addr):
+    return int.from_bytes(addr.toRaw(), 'big')
+
+
+def matches(ranges, key):
+    """
+    True if a packet key lies in every range of rule_ranges(); the
+    reference semantics the compiled lookup has to agree with.
+    """
+    for index, (low, high) in ranges.items():
+        value = key[index]
+        if value is None or not low <= value <= high:
+            return False
+    return True
+
+
+def linear_lookup(rules, key):
+    """
+    The first rule matching a packet key, scanning the list.
+    """
+    for rule in rules:
+        if matches(rule_ranges(rule), key):
+            return rule
+    return None
+
+
+class Classifier(object):
+    """
+    A rules table compiled for lookup: for every field the rules use, a
+    sorted list of interval bounds and the equivalence class of each
+    interval, plus a cross-product table from combinations of classes to
+    the first matching rule, filled as packets come.
+
+    Fields in skip (indices into FIELDS) are left out, for a caller that
+    only asks about packets the rules already match on those fields.
+    """
+
+    def __init__(self, rules=(), skip=(), capacity=PRODUCT_CAPACITY):
+        self.rules = list(rules)
+        self.skip = frozenset(skip)
+        self.capacity = capacity
+        all_ranges = [rule_ranges(rule) for rule in self.rules]
+        used = set()
+        for ranges in all_ranges:
+            used.update(ranges)
+        self._all = (1 << len(self.rules)) - 1
+        self._levels = []   # (index, bounds, class of each interval)
+        self._classes = []  # per level, the rule bit set of each class
+        for index in sorted(used - self.skip):
+            self._levels.append(self._level(index, all_ranges))
+        self._products = {}  # tuple of classes -> position of the first matching rule, or None
+        self.fields = self._closure(used - self.skip)
+        self.hits = 0
+        self.misses = 0
+
+    def _level(self, index, all_ranges):
+        """
+        Compiles one field: returns (index, bounds, ids), where ids[i] is
+        the class of the values from bounds[i] up to the next bound. Class
+        0 holds the rules that don't look at the field, the only ones a
+        packet without it can match. The rule sets of the classes go to
+        _classes.
+        """
+        starts = {}  # bound -> bits of the rules whose range starts there
+        ends = {}    # bound -> bits of the rules whose range ended just before
+        absent = 0
+        for position, ranges in enumerate(all_ranges):
+            bit = 1 << position
+            if index not in ranges:
+                absent |= bit
+                continue
+            low, high = ranges[index]
+            starts[low] = starts.get(low, 0) | bit
+            ends[high + 1] = ends.get(high + 1, 0) | bit
+        bounds = sorted(set(starts) | set(ends) | set([0]))
+        classes = {absent: 0}  # rule set -> class
+        ids = []
+        current = 0
+        for bound in bounds:
+            current = (current & ~ends.get(bound, 0)) | starts.get(bound, 0)
+            ids.append(classes.setdefault(current | absent, len(classes)))
+        sets = [None] * len(classes)
+        for bits, number in classes.items():
+            sets[number] = bits
+        self._classes.append(sets)
+        return index, bounds, ids
+
+    @staticmethod
+    def _closure(used):
+        # OpenFlow only matches the IP fields of IP packets, and the ports
+        # of a protocol
+        used = set(used)
+        if used & set((NW_SRC, NW_DST, NW_PROTO, TP_SRC, TP_DST)):
+            used.add(DL_TYPE)
+        if used & set((TP_SRC, TP_DST)):
+            used.add(NW_PROTO)
+        return tuple(sorted(used))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def lookup(self, key):
+        """
+        Returns the first rule matching a packet key (see packet_key()), or
+        None.
+        """
+        combination = tuple(0 if key[index] is None else ids[bisect_right(bounds, key[index]) - 1]
+                            for index, bounds, ids in self._levels)
+        try:
+            position = self._products[combination]
+            self.hits += 1
+        except KeyError:
+            position = self._decide(combination)
+        return None if position is None else self.rules[position]
+
+    def _decide(self, combination):
+        # the first rule in every class of the combination, remembered
+        self.misses += 1
+        candidates = self._all
+        for sets, number in zip(self._classes, combination):
+            candidates &= sets[number]
+            if not candidates:
+                break
+        position = (candidates & -candidates).bit_length() - 1 if candidates else None
+        if len(self._products) >= self.capacity:
+            self._products.clear()
+        self._products[combination] = position
+        return position
+
+    def flow_fields(self, key):
+        """
+        The match of a flow for the packet with the given key, as
+        ((field name, value), ...): the packet's values of all the fields
+        the rules look at, so every packet the flow takes gets the same
+        rule. A TCP or UDP packet whose ports could not be read (a
+        fragment) matches port 0, as switches see fragments.
+        """
+        fields = []
+        for index in self.fields:
+            value = key[index]
+            if value is None:
+                if index < TP_SRC or key[NW_PROTO] not in (6, 17):
+                    continue
+                value = 0
+            fields.append((FIELDS[index][0], value))
+        return tuple(fields)
+
+    def stats(self):
+        return {'rules': len(self.rules), 'fields': len(self._levels),
+                'intervals': sum(len(level[1]) for level in self._levels),
+                'classes': sum(len(sets) for sets in self._classes),
+                'products': len(self._products), 'hits': self.hits, 'misses': self.misses}
+
+
+def match_fields(rule, limit=MATCH_LIMIT, cover=False):
+    """
+    Compiles a rule into OpenFlow 1.0 matches, as a list of ((field name,
+    value), ...), IP fields as (address, prefix length). A port range
+    becomes one match per port; if that takes more than limit matches,
+    returns None -- or with cover, the matches without the ports, which
+    take a superset of the rule's packets.
+    """
+    ranges = rule_ranges(rule)
+    common = []
+    ports = []
+    for index, (low, high) in sorted(ranges.items()):
+        name, bits = FIELDS[index]
+        if index in (NW_SRC, NW_DST):
+            common.append((name, (low, bits + 1 - (high - low + 1).bit_length())))
+        elif index in (TP_SRC, TP_DST):
+            ports.append([(name, port) for port in range(low, high + 1)])
+        else:
+            common.append((name, low))
+    count = 1
+    for values in ports:
+        count *= len(values)
+    if count > limit:
+        if not cover:
+            return None
+        ports = []
+    return [tuple(common) + combination for combination in itertools.product(*ports)]
+
+
+def set_match(match, fields):
+    """
+    Sets the fields of match_fields() or Classifier.flow_fields() on an
+    ofp_match.
+    """
+    from pox.lib.addresses import EthAddr
+
+    for name, value in fields:
+        if name in ('dl_src', 'dl_dst'):
+            value = EthAddr(value.to_bytes(6, 'big'))
+        elif name in ('nw_src', 'nw_dst'):
+            address, length = value if isinstance(value, tuple) else (value, 32)
+            value = socket.inet_ntoa(_IP.pack(address))
+            if length < 32:
+                value += '/%d' % length
+        setattr(match, name, value)
+    return match
+
+
+def ofp_matches(rule, limit=MATCH_LIMIT, cover=False):
+    """
+    Like match_fields(), but returns ofp_match objects.
+    """
+    import pox.openflow.libopenflow_01 as of
+
+    fields = match_fields(rule, limit, cover)
+    if fields is None:
+        return None
+    return [set_match(of.ofp_match(), match) for match in fields]
+
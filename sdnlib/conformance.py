@@ -0,0 +1,297 @@
+"""
+QoS conformance runs: every rule of a network spec checked with iperf.
+
+The topology scripts used to run their iperf checks one after another, with
+a three second pause after each, and print iperf's raw output for a human
+to read. Here the checks are derived from the spec (see sdnlib.netspec):
+every rule becomes one iperf run between its two hosts, expected to be
+blocked, capped at the max-rate of the queue it is sent to, or uncapped.
+Runs that share no host and no switch egress port cannot disturb each other,
+so they are grouped into rounds that run concurrently, and each result is
+parsed from iperf's output and checked against a tolerance.
+
+Everything but run_checks() is plain data in, data out, so planning and
+parsing work without Mininet, e.g. to print the plan of a spec:
+
+    python -m sdnlib.conformance assignment2/network_assignment2.json
+"""
+import argparse
+from collections import deque
+import json
+import re
+import subprocess
+import time
+
+from sdnlib.netspec import load_spec, switch_ports
+
+# iperf's default port, for rules that don't name a TCP port
+DEFAULT_PORT = 5001
+
+# queues at least this fast are the "uncapped" ones
+UNCAPPED_RATE = 10 ** 10
+
+# how long an iperf server gets to start listening before the clients go
+SERVER_TIMEOUT = 5
+
+_RATE = re.compile(r'([\d.]+)\s+([KMG]?)bits/sec')
+_UNITS = {'': 1e-6, 'K': 1e-3, 'M': 1.0, 'G': 1e3}
+
+
+def parse_iperf(output):
+    """
+    Returns the rate an iperf client reported, in Mbit/s, or None if it
+    never connected. With several intervals the last (total) one counts.
+    """
+    rates = _RATE.findall(output)
+    if not rates:
+        return None
+    value, unit = rates[-1]
+    return float(value) * _UNITS[unit]
+
+
+def _links(spec):
+    """
+    Returns {node: {neighbour: egress interface}} for the spec's links; a
+    host's interface is None since only switch queues matter.
+    """
+    ports = dict((switch, deque(names)) for switch, names in switch_ports(spec).items())
+    links = {}
+    for node1, node2 in spec.get('links', []):
+        links.setdefault(node1, {})[node2] = ports[node1].popleft() if node1 in ports else None
+        links.setdefault(node2, {})[node1] = ports[node2].popleft() if node2 in ports else None
+    return links
+
+
+def _egress_ports(links, src, dst):
+    """
+    The switch interfaces traffic from host src to host dst leaves through,
+    in path order, or None if the hosts are not connected.
+    """
+    previous = {src: None}
+    queue = deque([src])
+    while queue:
+        node = queue.popleft()
+        if node == dst:
+            break
+        for neighbour in links.get(node, {}):
+            if neighbour not in previous:
+                previous[neighbour] = node
+                queue.append(neighbour)
+    if dst not in previous:
+        return None
+    path = [dst]
+    while previous[path[-1]] is not None:
+        path.append(previous[path[-1]])
+    path.reverse()
+    return [links[a][b] for a, b in zip(path, path[1:]) if links[a][b] is not None]
+
+
+def _first_rule(rules, src_mac, dst_mac, tcp_port):
+    for rule in rules:
+        if (rule['EthSrc'].lower() == src_mac and rule['EthDst'].lower() == dst_mac
+                and rule.get('TCPPort') in (None, tcp_port)):
+            return rule
+    return None
+
+
+def plan_checks(spec):
+    """
+    Returns one check per rule of the spec: a dict with the hosts, the TCP
+    port, the egress interfaces on the way and the expectation -- 'blocked',
+    'capped' (with its rate in Mbit/s) or 'uncapped'. Rules shadowed by an
+    earlier rule for the same traffic are checked as that rule.
+    """
+    hosts = dict((host['mac'].lower(), host) for host in spec.get('hosts', []))
+    links = _links(spec)
+    rules = spec.get('rules', [])
+    checks = []
+    seen = set()
+    for rule in rules:
+        src = hosts.get(rule['EthSrc'].lower())
+        dst = hosts.get(rule['EthDst'].lower())
+        tcp_port = rule.get('TCPPort') or DEFAULT_PORT
+        if src is None or dst is None or (src['name'], dst['name'], tcp_port) in seen:
+            continue
+        seen.add((src['name'], dst['name'], tcp_port))
+        rule = _first_rule(rules, src['mac'].lower(), dst['mac'].lower(), tcp_port)
+        egress = _egress_ports(links, src['name'], dst['name']) or []
+        check = {
+            'src': src['name'],
+            'dst': dst['name'],
+            'dst_ip': dst['ip'],
+            'port': tcp_port,
+            'egress': egress,
+        }
+        if rule['drop']:
+            check['expect'] = 'blocked'
+        else:
+            # the queue is picked on the last hop, towards the destination host
+            queues = spec.get('qos', {}).get(egress[-1] if egress else None, [])
+            queue = rule.get('queue', 0)
+            rate = queues[queue]['max_rate'] if queue < len(queues) else None
+            if rate is None or rate >= UNCAPPED_RATE:
+                check['expect'] = 'uncapped'
+            else:
+                check['expect'] = 'capped'
+                check['rate'] = rate / 1e6
+        checks.append(check)
+    return checks
+
+
+def _conflicts(a, b):
+    if set((a['src'], a['dst'])) & set((b['src'], b['dst'])):
+        return True
+    if a['expect'] == 'blocked' or b['expect'] == 'blocked':
+        return False
+    return bool(set(a['egress']) & set(b['egress']))
+
+
+def schedule(checks):
+    """
+    Splits the checks into rounds of runs that can go concurrently: no two
+    in a round share a host, and no two passing traffic share a switch
+    egress interface. Greedy, in plan order.
+    """
+    rounds = []
+    for check in checks:
+        for checks_of_round in rounds:
+            if not any(_conflicts(check, other) for other in checks_of_round):
+                checks_of_round.append(check)
+                break
+        else:
+            rounds.append([check])
+    return rounds
+
+
+def evaluate(check, output, tolerance=0.1, uncapped_floor=None):
+    """
+    Returns the result of a check given its iperf client output. A capped
+    run passes within tolerance of its rate, an uncapped one above
+    uncapped_floor Mbit/s, and a blocked one when iperf never connected.
+    """
+    rate = parse_iperf(output)
+    result = dict(check, measured=rate)
+    if check['expect'] == 'blocked':
+        result['passed'] = rate is None
+    elif rate is None:
+        result['passed'] = False
+    elif check['expect'] == 'capped':
+        result['passed'] = abs(rate - check['rate']) <= check['rate'] * tolerance
+    else:
+        result['passed'] = uncapped_floor is None or rate >= uncapped_floor
+    return result
+
+
+def uncapped_floor(checks, tolerance=0.1):
+    """
+    The rate an uncapped run has to beat: clearly above every cap.
+    """
+    caps = [check['rate'] for check in checks if check['expect'] == 'capped']
+    return max(caps) * (1 + tolerance) if caps else None
+
+
+def start_server(host, port, timeout=SERVER_TIMEOUT):
+    """
+    Starts an iperf server on a Mininet host and waits until it listens on
+    port, or for timeout seconds. Returns its pid (None if the shell did not
+    report one), as a host may run several servers that "kill %iperf" cannot
+    tell apart.
+    """
+    words = host.cmd('iperf -s -p %d > /dev/null 2>&1 & echo $!' % port).split()
+    pid = int(words[-1]) if words and words[-1].isdigit() else None
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if host.cmd('ss -Hltn sport = :%d' % port).strip():
+            break
+        time.sleep(0.05)
+    return pid
+
+
+def run_checks(net, spec, duration=5, tolerance=0.1):
+    """
+    Runs the spec's checks on a started Mininet network, round by round,
+    and returns the report as a dict.
+    """
+    started = time.time()
+    checks = plan_checks(spec)
+    floor = uncapped_floor(checks, tolerance)
+    rounds = schedule(checks)
+
+    servers = {}  # (host name, port) -> pid of its iperf server
+    for name, port in sorted(set((check['dst'], check['port']) for check in checks)):
+        servers[name, port] = start_server(net.get(name), port)
+
+    results = []
+    for n, checks_of_round in enumerate(rounds):
+        clients = []
+        for check in checks_of_round:
+            host = net.get(check['src'])
+            clients.append(host.popen(
+                ['iperf', '-c', check['dst_ip'], '-p', str(check['port']), '-t', str(duration)],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT))
+        for check, client in zip(checks_of_round, clients):
+            try:
+                output = client.communicate(timeout=duration + 10)[0]
+            except subprocess.TimeoutExpired:
+                client.kill()
+                output = client.communicate()[0]
+            if isinstance(output, bytes):
+                output = output.decode('utf-8', 'replace')
+            result = evaluate(check, output, tolerance, floor)
+            result['round'] = n
+            results.append(result)
+
+    for (name, port), pid in sorted(servers.items()):
+        if pid:
+            net.get(name).cmd('kill %d' % pid)
+
+    return report(results, len(rounds), time.time() - started)
+
+
+def report(results, rounds, elapsed):
+    return {
+        'passed': all(result['passed'] for result in results),
+        'checks': len(results),
+        'failures': sum(1 for result in results if not result['passed']),
+        'rounds': rounds,
+        'seconds': round(elapsed, 1),
+        'results': results,
+    }
+
+
+def print_report(report):
+    for result in report['results']:
+        if result['expect'] == 'capped':
+            expected = '~%g Mb/s' % result['rate']
+        else:
+            expected = result['expect']
+        measured = 'no connection' if result['measured'] is None else '%.1f Mb/s' % result['measured']
+        print('%-4s %s -> %s port %-5d expected %-12s got %s' % (
+            'ok' if result['passed'] else 'FAIL', result['src'], result['dst'],
+            result['port'], expected, measured))
+    print('%d/%d checks passed in %d rounds, %.1f s' % (
+        report['checks'] - report['failures'], report['checks'],
+        report['rounds'], report['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print the conformance checks of a network spec and how they are scheduled.")
+    parser.add_argument('spec')
+    parser.add_argument('--json', action='store_true', help='print the plan as JSON')
+    args = parser.parse_args(argv)
+
+    rounds = schedule(plan_checks(load_spec(args.spec)))
+    if args.json:
+        print(json.dumps(rounds, indent=2))
+        return
+    for n, checks_of_round in enumerate(rounds):
+        print('round %d:' % n)
+        for check in checks_of_round:
+            expected = '%g Mb/s' % check['rate'] if check['expect'] == 'capped' else check['expect']
+            print('  %s -> %s port %d: %s via %s' % (
+                check['src'], check['dst'], check['port'], expected, ','.join(check['egress'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+PacketIn classification from the raw frame bytes.
+
+event.parsed makes POX build the whole ethernet -> ipv4 -> tcp object tree,
+checksums and options included, and the handlers then walk it again with
+find('ipv4') and find('tcp'). All they need to decide on a frame is the
+MAC pair, the ethertype, the IP addresses and protocol and the TCP or UDP
+ports, which sit at fixed offsets: classify() unpacks just those from
+event.data.
+Anything else -- VLAN tags, truncated or malformed frames, the ARP payload
+the ARP responder reads -- goes through the regular parser, on demand.
+"""
+import struct
+
+from pox.lib.addresses import EthAddr
+
+IP_TYPE = 0x0800
+ARP_TYPE = 0x0806
+TCP_PROTOCOL = 6
+UDP_PROTOCOL = 17
+
+_ETHERTYPE = struct.Struct('!H')
+_PORT = struct.Struct('!H')
+_PORTS = struct.Struct('!HH')
+_ADDRESSES = struct.Struct('!II')
+
+
+class Headers(object):
+    """
+    The header fields the controllers decide on. nw_proto, and the IP
+    addresses (as integers), are None for non-IPv4 frames; ports, the
+    (source, destination) pair, for anything but unfragmented TCP and UDP,
+    and tp_dst, the TCP destination port, for anything but TCP.
+
+    It stands in for the parsed ethernet frame: payload and find() hand
+    over to event.parsed, which POX only builds when first used.
+    """
+    __slots__ = ('src', 'dst', 'type', 'nw_proto', 'tp_dst', 'nw_src', 'nw_dst', 'ports', '_event')
+
+    IP_TYPE = IP_TYPE
+    ARP_TYPE = ARP_TYPE
+
+    def __init__(self, event, src, dst, type, nw_proto=None, tp_dst=None,
+                 nw_src=None, nw_dst=None, ports=None):
+        self._event = event
+        self.src = src
+        self.dst = dst
+        self.type = type
+        self.nw_proto = nw_proto
+        self.tp_dst = tp_dst
+        self.nw_src = nw_src
+        self.nw_dst = nw_dst
+        self.ports = ports
+
+    @property
+    def parsed(self):
+        return self._event.parsed
+
+    @property
+    def payload(self):
+        return self._event.parsed.payload
+
+    def find(self, protocol):
+        return self._event.parsed.find(protocol)
+
+    def __str__(self):
+        return '[%s>%s type:%#06x proto:%s tp_dst:%s]' % (
+            self.src, self.dst, self.type, self.nw_proto, self.tp_dst)
+
+
+def classify(event):
+    """
+    Returns the Headers of a PacketIn's frame.
+    """
+    data = event.data
+    if len(data) >= 14:
+        eth_type = _ETHERTYPE.unpack_from(data, 12)[0]
+        if eth_type != IP_TYPE:
+            if eth_type >= 0x0600 and eth_type != 0x8100:  # not 802.3 length, not VLAN
+                return Headers(event, EthAddr(data[6:12]), EthAddr(data[0:6]), eth_type)
+        elif len(data) >= 34 and data[14] >> 4 == 4:
+            nw_proto = data[23]
+            nw_src, nw_dst = _ADDRESSES.unpack_from(data, 26)
+            tp_dst = ports = None
+            if nw_proto == TCP_PROTOCOL or nw_proto == UDP_PROTOCOL:
+                # like POX, don't look into fragments (MF flag or an offset)
+                fragment = _PORT.unpack_from(data, 20)[0] & 0x3fff
+                l4 = 14 + (data[14] & 0x0f) * 4
+                if not fragment and len(data) >= l4 + 4:
+                    ports = _PORTS.unpack_from(data, l4)
+                    if nw_proto == TCP_PROTOCOL:
+                        tp_dst = ports[1]
+            return Headers(event, EthAddr(data[6:12]), EthAddr(data[0:6]), eth_type,
+                           nw_proto, tp_dst, nw_src, nw_dst, ports)
+    return headers_of(event)
+
+
+def headers_of(event):
+    """
+    Builds the Headers of a PacketIn from POX's parsed frame; the fallback
+    for frames classify() does not read itself.
+    """
+    eth_packet = event.parsed
+    nw_proto = tp_dst = nw_src = nw_dst = ports = None
+    ip_pkt = eth_packet.find('ipv4')
+    if ip_pkt is not None:
+        nw_proto = ip_pkt.protocol
+        nw_src = ip_pkt.srcip.toUnsigned()
+        nw_dst = ip_pkt.dstip.toUnsigned()
+        l4_pkt = ip_pkt.find('tcp') or ip_pkt.find('udp')
+        if l4_pkt is not None:
+            ports = (l4_pkt.srcport, l4_pkt.dstport)
+            if nw_proto == TCP_PROTOCOL:
+                tp_dst = l4_pkt.dstport
+    return Headers(event, eth_packet.src, eth_packet.dst, eth_packet.type, nw_proto, tp_dst,
+                   nw_src, nw_dst, ports)
@@ -0,0 +1,178 @@
+"""
+Record of the flows the controller has installed on each switch.
+
+A burst of packets of one flow reaches the controller as a burst of
+PacketIns, because the switch keeps missing until it has processed the
+first flow_mod. Without a record of what was already sent, every one of
+them is answered with another identical flow_mod. FlowCache remembers the
+flows installed per switch until the switch reports them removed (the
+flow_mods are sent with OFPFF_SEND_FLOW_REM), so duplicates can be answered
+with just a packet_out.
+"""
+import time
+
+import pox.openflow.libopenflow_01 as of
+
+
+def _prefix(address_and_length):
+    # (IPAddr, prefix length) of an IP match field, None if wildcarded
+    return address_and_length if address_and_length[0] is not None else None
+
+
+def match_key(match):
+    """
+    The fields of an ofp_match the controllers' flows differ in. The last
+    three are only set by rules on more than the TCP port; the IP addresses
+    are (IPAddr, prefix length), so flows on nested prefixes stay apart.
+    """
+    return (match.dl_src, match.dl_dst, match.dl_type, match.nw_proto, match.tp_dst,
+            _prefix(match.get_nw_src()), _prefix(match.get_nw_dst()), match.tp_src)
+
+
+class FlowCache(object):
+    """
+    Installed flows per switch: match key -> (install time, expiry time).
+
+    A PacketIn for a flow installed less than window seconds ago is a
+    duplicate that raced the flow_mod. One arriving later means the switch
+    does not have the flow after all (it was evicted, or failed to install),
+    so it is installed again.
+    """
+
+    def __init__(self, window=1.0, clock=time.time):
+        self.window = window
+        self._clock = clock
+        self._switches = {}
+        self.installs = 0
+        self.suppressed = 0
+        self.removals = 0
+
+    def should_install(self, dpid, match, hard_timeout=0):
+        """
+        Tells whether a flow_mod with this match has to be sent to switch
+        dpid, and if so records it as installed. hard_timeout lets entries
+        of flows the switch expires on its own lapse without a FlowRemoved.
+        """
+        return self.should_install_key(dpid, match_key(match), hard_timeout)
+
+    def should_install_key(self, dpid, key, hard_timeout=0):
+        """
+        should_install() for a match given by its match_key(), e.g. the key
+        of a pre-packed flow_mod.
+        """
+        flows = self._switches.get(dpid)
+        if flows is None:
+            flows = self._switches[dpid] = {}
+        now = self._clock()
+        entry = flows.get(key)
+        if entry is not None and now < entry[1] and now - entry[0] < self.window:
+            self.suppressed += 1
+            return False
+        flows[key] = (now, now + hard_timeout if hard_timeout else float('inf'))
+        self.installs += 1
+        return True
+
+    def remove(self, dpid, match):
+        """
+        Forgets a flow the switch reported removed.
+        """
+        flows = self._switches.get(dpid)
+        if flows and flows.pop(match_key(match), None) is not None:
+            self.removals += 1
+
+    def purge_switch(self, dpid):
+        """
+        Forgets every flow of a switch, e.g. after its flows were wiped.
+        """
+        self._switches.pop(dpid, None)
+
+    def switches(self):
+        """
+        The dpids of the switches with recorded flows.
+        """
+        return [dpid for dpid, flows in self._switches.items() if flows]
+
+    def count(self, dpid):
+        """
+        The number of flows recorded on switch dpid.
+        """
+        return len(self._switches.get(dpid, ()))
+
+    def has(self, dpid, match):
+        """
+        Tells whether a flow with this match is recorded as installed on
+        switch dpid (and has not expired).
+        """
+        entry = self._switches.get(dpid, {}).get(match_key(match))
+        return entry is not None and self._clock() < entry[1]
+
+    def retain(self, dpid, keys):
+        """
+        Forgets the flows of switch dpid whose match keys are not in keys,
+        e.g. the ones a flow-stats reply showed missing. Returns how many.
+        """
+        flows = self._switches.get(dpid)
+        if not flows:
+            return 0
+        gone = [key for key in flows if key not in keys]
+        for key in gone:
+            del flows[key]
+        return len(gone)
+
+    def dump(self):
+        """
+        Returns every flow as (dpid, match key, install time, expiry time),
+        e.g. to save it across a restart.
+        """
+        return [(dpid, key, installed, expiry)
+                for dpid, flows in self._switches.items()
+                for key, (installed, expiry) in flows.items()]
+
+    def load(self, flows):
+        """
+        Adds flows from dump(), skipping the ones expired meanwhile.
+        """
+        now = self._clock()
+        loaded = 0
+        for dpid, key, installed, expiry in flows:
+            if expiry > now:
+                self._switches.setdefault(dpid, {})[key] = (installed, expiry)
+                loaded += 1
+        return loaded
+
+    def forget_pair(self, src, dst):
+        """
+        Forgets the flows of one MAC pair on every switch, e.g. after the
+        pair's rules changed and its flows were deleted.
+        """
+        for flows in self._switches.values():
+            for key in [key for key in flows if key[0] == src and key[1] == dst]:
+                del flows[key]
+
+    def forget_host(self, mac):
+        """
+        Forgets the flows towards one MAC on every switch, e.g. after the
+        port it was learned on went away.
+        """
+        for flows in self._switches.values():
+            for key in [key for key in flows if key[1] == mac]:
+                del flows[key]
+
+    def __len__(self):
+        return sum(len(flows) for flows in self._switches.values())
+
+    def stats(self):
+        return {
+            'flows': len(self),
+            'installs': self.installs,
+            'suppressed': self.suppressed,
+            'removals': self.removals,
+        }
+
+
+def track_removal(flow_mod):
+    """
+    Asks the switch to send a FlowRemoved message when the flow goes away.
+    """
+    flow_mod.flags |= of.OFPFF_SEND_FLOW_REM
+    return flow_mod
@@ -0,0 +1,160 @@
+"""
+MAC learning table for the controllers.
+
+Replaces the module-level ``table`` dict keyed by (dpid, MAC), which only
+ever grew: bindings are kept in one shard per switch, expire after a TTL,
+are capped per switch with least-recently-used eviction, and are dropped
+when a switch disconnects or one of its ports goes away.
+"""
+from collections import OrderedDict
+import time
+
+import pox.openflow.libopenflow_01 as of
+
+
+class LearningTable(object):
+    """
+    MAC -> port bindings, sharded by datapath ID.
+
+    Every shard is an OrderedDict in least-recently-used order, mapping a
+    MAC to (port, expiry time). Both learning and a successful lookup count
+    as a use.
+    """
+
+    def __init__(self, ttl=300, capacity=4096, clock=time.time):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._clock = clock
+        self._shards = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0    # bindings pushed out by the capacity limit
+        self.expirations = 0  # bindings found older than the TTL
+
+    def learn(self, dpid, mac, port):
+        """
+        Records that mac was seen on port of switch dpid. Returns True if
+        that is news: the MAC was not known there, or on another port.
+        """
+        shard = self._shards.get(dpid)
+        previous = None
+        if shard is None:
+            shard = self._shards[dpid] = OrderedDict()
+        else:
+            previous = shard.get(mac)
+            if previous is not None:
+                shard.move_to_end(mac)
+        shard[mac] = (port, self._clock() + self.ttl)
+        if len(shard) > self.capacity:
+            shard.popitem(last=False)
+            self.evictions += 1
+        return previous is None or previous[0] != port
+
+    def lookup(self, dpid, mac):
+        """
+        Returns the port mac was last seen on at switch dpid, or None if it is
+        unknown or its binding has expired.
+        """
+        shard = self._shards.get(dpid)
+        entry = shard.get(mac) if shard is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[1] < self._clock():
+            del shard[mac]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        shard.move_to_end(mac)
+        self.hits += 1
+        return entry[0]
+
+    def purge_switch(self, dpid):
+        """
+        Forgets everything learned on a switch, e.g. when it disconnects.
+        Returns the MACs it forgot.
+        """
+        shard = self._shards.pop(dpid, None)
+        return list(shard) if shard else []
+
+    def purge_port(self, dpid, port):
+        """
+        Forgets every MAC learned on one port of a switch. Returns the MACs
+        it forgot.
+        """
+        shard = self._shards.get(dpid)
+        if not shard:
+            return []
+        stale = [mac for mac, entry in shard.items() if entry[0] == port]
+        for mac in stale:
+            del shard[mac]
+        return stale
+
+    def expire(self):
+        """
+        Drops all expired bindings; lookup() drops them lazily anyway, so this
+        only serves to give back memory early. The controllers call it every
+        TTL from a recurring Timer.
+        """
+        now = self._clock()
+        expired = 0
+        for shard in self._shards.values():
+            stale = [mac for mac, entry in shard.items() if entry[1] < now]
+            for mac in stale:
+                del shard[mac]
+            expired += len(stale)
+        self.expirations += expired
+        return expired
+
+    def dump(self):
+        """
+        Returns every binding as (dpid, MAC, port, expiry time), least
+        recently used first, e.g. to save it across a restart.
+        """
+        return [(dpid, mac, port, expiry)
+                for dpid, shard in self._shards.items()
+                for mac, (port, expiry) in shard.items()]
+
+    def load(self, bindings):
+        """
+        Adds bindings from dump(), skipping the ones expired meanwhile.
+        Returns how many were taken.
+        """
+        now = self._clock()
+        loaded = 0
+        for dpid, mac, port, expiry in bindings:
+            if expiry < now:
+                continue
+            shard = self._shards.get(dpid)
+            if shard is None:
+                shard = self._shards[dpid] = OrderedDict()
+            shard[mac] = (port, expiry)
+            shard.move_to_end(mac)
+            if len(shard) > self.capacity:
+                shard.popitem(last=False)
+            loaded += 1
+        return loaded
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards.values())
+
+    def stats(self):
+        return {
+            'switches': len(self._shards),
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+def port_gone(event):
+    """
+    Tells whether a PortStatus event means hosts behind the port can no
+    longer be reached through it: the port was deleted, or is down.
+    """
+    if event.deleted:
+        return True
+    desc = event.ofp.desc
+    return bool(desc.state & of.OFPPS_LINK_DOWN or desc.config & of.OFPPC_PORT_DOWN)
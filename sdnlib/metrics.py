@@ -0,0 +1,226 @@
+"""
+Always-on counters and latency histograms for the PacketIn handlers.
+
+The only insight into where _handle_PacketIn spends its time used to be
+debug logging. Metrics times every PacketIn and files the duration under
+the branch the handler took (ARP flood, rule match, TCP sub-match, default
+drop, fallback flood, ...), which the handler reports by returning the
+branch name. Recording costs two clock reads, a bit_length() and a dict
+increment -- counts and maxima are derived from the buckets when read --
+so it stays on in production.
+
+Histograms are HDR-style: each power of two of nanoseconds is split into
+16 linear sub-buckets, so any percentile is off by at most 1/16 whatever
+the magnitude, with a few dozen buckets in practice. Together with the
+messages, writes and bytes sent to each switch (from sdnlib.sendbuf) they
+can be exported as Prometheus text or as a periodic summary log line, see
+start_reporting(). The Prometheus text also carries the port and queue
+rates of an sdnlib.telemetry.StatsPoller, if one runs.
+"""
+import functools
+import os
+import time
+
+from pox.core import core
+from pox.lib.recoco import Timer
+from pox.lib.util import dpidToStr
+
+log = core.getLogger()
+
+_SUB_BITS = 4   # 2**4 = 16 sub-buckets per power of two
+
+
+class Histogram(object):
+    """
+    Counts of nanosecond values in log-linear buckets.
+
+    A bucket key packs (shift, value >> shift) as shift << 8 | mantissa, so
+    keys sort like the values they hold.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.total = 0
+
+    def record(self, value):
+        shift = value.bit_length() - _SUB_BITS - 1
+        key = (shift << 8) | (value >> shift) if shift > 0 else value
+        buckets = self.buckets
+        buckets[key] = buckets.get(key, 0) + 1
+        self.total += value
+
+    @property
+    def count(self):
+        return sum(self.buckets.values())
+
+    @property
+    def max(self):
+        """
+        The upper bound of the highest non-empty bucket.
+        """
+        return self.upper_bound(max(self.buckets)) if self.buckets else 0
+
+    @staticmethod
+    def upper_bound(key):
+        """
+        The largest value that falls into a bucket.
+        """
+        shift = key >> 8
+        return (((key & 0xff) + 1) << shift) - 1
+
+    def percentile(self, q):
+        """
+        The value below which a fraction q of the recorded values lie,
+        rounded up to its bucket's upper bound.
+        """
+        rank = q * self.count
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen >= rank:
+                return self.upper_bound(key)
+        return 0
+
+    def cumulative(self):
+        """
+        Yields (upper bound, count of values up to it) per non-empty bucket.
+        """
+        seen = 0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            yield self.upper_bound(key), seen
+
+
+class Metrics(object):
+    """
+    PacketIn latency histograms per handler branch.
+    """
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.branches = {}
+
+    def timed(self, handler):
+        """
+        Wraps a PacketIn handler that returns the name of the branch it
+        took, recording its duration under that name.
+        """
+        clock = self.clock
+        branches = self.branches
+
+        @functools.wraps(handler)
+        def wrapper(event):
+            started = clock()
+            branch = handler(event) or 'other'
+            elapsed = clock() - started
+            histogram = branches.get(branch)
+            if histogram is None:
+                histogram = branches[branch] = Histogram()
+            histogram.record(elapsed)
+        return wrapper
+
+    def stats(self):
+        """
+        Returns {branch: {count, mean/p50/p99/max in microseconds}}.
+        """
+        result = {}
+        for branch, histogram in self.branches.items():
+            count = histogram.count
+            result[branch] = {
+                'count': count,
+                'mean_us': histogram.total / 1e3 / count,
+                'p50_us': histogram.percentile(0.5) / 1e3,
+                'p99_us': histogram.percentile(0.99) / 1e3,
+                'max_us': histogram.max / 1e3,
+            }
+        return result
+
+
+def switch_sends(connections):
+    """
+    Returns {dpid: (messages, writes, bytes)} sent through each switch's
+    SendBuffer.
+    """
+    result = {}
+    for connection in connections:
+        buf = getattr(connection, 'send_buffer', None)
+        if buf is not None:
+            result[connection.dpid] = (buf.messages, buf.writes, buf.bytes)
+    return result
+
+
+def prometheus_text(metrics, connections=(), telemetry=None):
+    """
+    Renders the metrics in the Prometheus text exposition format, with the
+    latest rates of telemetry (a StatsPoller) if given.
+    """
+    lines = [
+        '# HELP sdn_packet_in_seconds PacketIn handling time by handler branch.',
+        '# TYPE sdn_packet_in_seconds histogram',
+    ]
+    for branch, histogram in sorted(metrics.branches.items()):
+        count = 0
+        for bound, count in histogram.cumulative():
+            lines.append('sdn_packet_in_seconds_bucket{branch="%s",le="%.9g"} %d'
+                         % (branch, (bound + 1) / 1e9, count))
+        lines.append('sdn_packet_in_seconds_bucket{branch="%s",le="+Inf"} %d'
+                     % (branch, count))
+        lines.append('sdn_packet_in_seconds_sum{branch="%s"} %.9g' % (branch, histogram.total / 1e9))
+        lines.append('sdn_packet_in_seconds_count{branch="%s"} %d' % (branch, count))
+
+    sends = sorted(switch_sends(connections).items())
+    for name, index, help_text in (('messages', 0, 'OpenFlow messages sent'),
+                                   ('writes', 1, 'Socket writes'),
+                                   ('bytes', 2, 'Bytes sent')):
+        lines.append('# HELP sdn_switch_%s_total %s to each switch.' % (name, help_text))
+        lines.append('# TYPE sdn_switch_%s_total counter' % name)
+        for dpid, counts in sends:
+            lines.append('sdn_switch_%s_total{dpid="%s"} %d' % (name, dpidToStr(dpid), counts[index]))
+
+    if telemetry is not None:
+        lines.append('# HELP sdn_port_bits_per_second Port rates from the last two stats polls.')
+        lines.append('# TYPE sdn_port_bits_per_second gauge')
+        for (dpid, port), rates in sorted(telemetry.port_rates().items()):
+            for direction, rate in zip(('rx', 'tx'), rates):
+                if rate is not None:
+                    lines.append('sdn_port_bits_per_second{dpid="%s",port="%d",direction="%s"} %.9g'
+                                 % (dpidToStr(dpid), port, direction, rate))
+        lines.append('# HELP sdn_queue_bits_per_second Queue rates from the last two stats polls.')
+        lines.append('# TYPE sdn_queue_bits_per_second gauge')
+        for (dpid, port, queue_id), rate in sorted(telemetry.queue_rates().items()):
+            lines.append('sdn_queue_bits_per_second{dpid="%s",port="%d",queue="%d"} %.9g'
+                         % (dpidToStr(dpid), port, queue_id, rate))
+    return '\n'.join(lines) + '\n'
+
+
+def summary_line(metrics, connections=()):
+    """
+    One log line with the count and latency percentiles of every branch
+    and the messages sent to each switch.
+    """
+    parts = []
+    for branch, s in sorted(metrics.stats().items()):
+        parts.append('%s=%d p50=%.1fus p99=%.1fus max=%.1fus'
+                     % (branch, s['count'], s['p50_us'], s['p99_us'], s['max_us']))
+    for dpid, (messages, writes, nbytes) in sorted(switch_sends(connections).items()):
+        parts.append('%s sent %d msgs in %d writes' % (dpidToStr(dpid), messages, writes))
+    return '; '.join(parts) or 'no PacketIns yet'
+
+
+def start_reporting(metrics, interval, path=None, telemetry=None):
+    """
+    Every interval seconds, logs summary_line() or, given a path, rewrites
+    that file with prometheus_text() (for node_exporter's textfile
+    collector, say). The file is replaced atomically.
+    """
+    def report():
+        connections = list(core.openflow.connections.values())
+        if path:
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(prometheus_text(metrics, connections, telemetry))
+            os.rename(tmp, path)
+        else:
+            log.info("PacketIn metrics: %s", summary_line(metrics, connections))
+        return True
+    return Timer(interval, report, recurring=True)
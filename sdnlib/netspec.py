@@ -0,0 +1,168 @@
+"""
+Declarative network specs: hosts, switches, links, QoS queues and rules.
+
+The topology scripts used to set up QoS with one `ovs-vsctl` run per port
+and tear it down with one more per port, each forked through a shell, so
+setup and teardown cost grew with the port count. A spec describes the
+whole network in one JSON file:
+
+    {
+      "controller": {"ip": "127.0.0.1", "port": 6633},
+      "hosts": [{"name": "h1", "ip": "10.0.0.1", "mac": "00:00:00:00:00:01"}],
+      "switches": ["s1"],
+      "links": [["h1", "s1"]],
+      "qos": {"s1-eth1": [{"min_rate": 20000000, "max_rate": 30000000}]},
+      "rules": [{"EthSrc": "00:00:00:00:00:01", "EthDst": "...", "drop": false}]
+    }
+
+Links are created in list order, so port N of a switch is its N-th link,
+as Mininet numbers them. "qos" lists the queues of a port by queue id; it
+can be left out when the rules declare their rates instead of queues (see
+sdnlib.qos). "rules" is the controllers' rules table, so the same file can be handed to
+them with --rules_file (see sdnlib.rulestore).
+
+build_network() creates the nodes and links on a Mininet object, and
+setup_qos() / teardown_qos() configure every queue of the spec with a single
+ovs-vsctl transaction each. This module only needs the standard library;
+print the generated transactions without Mininet or OVS present with:
+
+    python -m sdnlib.netspec assignment1/network_assignment1.json
+"""
+import argparse
+import json
+import shlex
+import subprocess
+
+
+def load_spec(path):
+    """
+    Reads a network spec and checks that its links and queues refer to
+    nodes and ports it declares. If its rules declare rates, the queues
+    are allocated from them, and the rules' queue numbers are checked
+    against the queues of their ports (see sdnlib.qos).
+    """
+    from sdnlib.qos import assign_queues, check
+
+    with open(path) as f:
+        spec = assign_queues(json.load(f))
+    nodes = set(host['name'] for host in spec.get('hosts', []))
+    nodes.update(spec.get('switches', []))
+    for link in spec.get('links', []):
+        for node in link:
+            if node not in nodes:
+                raise ValueError("Link %s-%s names unknown node %s" % (link[0], link[1], node))
+    ports = set(port for names in switch_ports(spec).values() for port in names)
+    for port, queues in spec.get('qos', {}).items():
+        if port not in ports:
+            raise ValueError("Queues declared on %s, which no link creates" % port)
+        if not queues:
+            raise ValueError("No queues declared on %s" % port)
+    return check(spec)
+
+
+def switch_ports(spec):
+    """
+    Returns {switch: [interface name, ...]} with the ports in the order the
+    links create them.
+    """
+    switches = spec.get('switches', [])
+    ports = dict((switch, []) for switch in switches)
+    for link in spec.get('links', []):
+        for node in link:
+            if node in ports:
+                ports[node].append('%s-eth%d' % (node, len(ports[node]) + 1))
+    return ports
+
+
+def build_network(net, spec):
+    """
+    Adds the spec's controller, hosts, switches and links to a Mininet
+    object. Returns {name: node}.
+    """
+    from mininet.node import RemoteController
+
+    controller = spec.get('controller', {})
+    net.addController('c0', controller=RemoteController,
+                      ip=controller.get('ip', '127.0.0.1'),
+                      port=controller.get('port', 6633))
+    nodes = {}
+    for host in spec.get('hosts', []):
+        nodes[host['name']] = net.addHost(host['name'], ip=host['ip'], mac=host['mac'])
+    for switch in spec.get('switches', []):
+        nodes[switch] = net.addSwitch(switch)
+    for node1, node2 in spec.get('links', []):
+        net.addLink(nodes[node1], nodes[node2])
+    return nodes
+
+
+def qos_transaction(spec):
+    """
+    The arguments of one ovs-vsctl run creating every QoS record and queue
+    of the spec and attaching them to their ports.
+    """
+    args = ['ovs-vsctl']
+    for n, (port, queues) in enumerate(sorted(spec.get('qos', {}).items())):
+        queue_ids = ['@q%d_%d' % (n, queue_id) for queue_id in range(len(queues))]
+        args += ['--', 'set', 'port', port, 'qos=@qos%d' % n]
+        args += ['--', '--id=@qos%d' % n, 'create', 'qos', 'type=linux-htb',
+                 'queues=' + ','.join('%d=%s' % (queue_id, record)
+                                      for queue_id, record in enumerate(queue_ids))]
+        for record, queue in zip(queue_ids, queues):
+            args += ['--', '--id=' + record, 'create', 'queue',
+                     'other-config:min-rate=%d' % queue['min_rate'],
+                     'other-config:max-rate=%d' % queue['max_rate']]
+    return args
+
+
+def teardown_transaction(spec):
+    """
+    The arguments of one ovs-vsctl run detaching the QoS of every switch
+    port and destroying all QoS and queue records.
+    """
+    args = ['ovs-vsctl']
+    for switch, ports in sorted(switch_ports(spec).items()):
+        for port in ports:
+            args += ['--', 'clear', 'Port', port, 'qos']
+    args += ['--', '--all', 'destroy', 'qos', '--', '--all', 'destroy', 'queue']
+    return args
+
+
+def run_transaction(args, sudo=False, dry_run=False):
+    """
+    Runs an ovs-vsctl transaction, without a shell. With dry_run it is
+    only printed.
+    """
+    if sudo:
+        args = ['sudo'] + args
+    if dry_run:
+        print(' '.join(shlex.quote(arg) for arg in args))
+        return 0
+    return subprocess.call(args)
+
+
+def setup_qos(spec, sudo=False, dry_run=False):
+    if not spec.get('qos'):
+        return 0
+    return run_transaction(qos_transaction(spec), sudo, dry_run)
+
+
+def teardown_qos(spec, sudo=False, dry_run=False):
+    return run_transaction(teardown_transaction(spec), sudo, dry_run)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print the ovs-vsctl transactions of a network spec.")
+    parser.add_argument('spec')
+    parser.add_argument('--sudo', action='store_true')
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    print('# setup')
+    setup_qos(spec, args.sudo, dry_run=True)
+    print('# teardown')
+    teardown_qos(spec, args.sudo, dry_run=True)
+
+
+if __name__ == '__main__':
+    main()
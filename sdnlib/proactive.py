@@ -0,0 +1,97 @@
+"""
+Proactive flow installation.
+
+Instead of waiting for the first packet of every MAC pair to reach the
+controller, the rules table can be turned into flow_mods as soon as a switch
+connects: drop rules need no knowledge of the network at all, and forwarding
+rules only need the way towards the destination host, which is known up
+front when the hosts are declared next to the rules (see sdnlib.topology).
+"""
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.classifier import ofp_matches
+
+# Proactive entries sit above the reactive ones (installed at the default
+# priority), so a broad reactive drop flow can never shadow a declared rule.
+PROACTIVE_PRIORITY = of.OFP_DEFAULT_PRIORITY + 0x100
+
+
+def compile_flow_mods(rule_index, forward_actions, pairs=None):
+    """
+    Compiles every rule of rule_index that can be decided without seeing
+    traffic into a permanent flow_mod.
+
+    forward_actions(rule, dst_mac) returns the actions forwarding a rule's
+    traffic towards its destination, or None if the way there is not known.
+    Drop rules are always compiled, forwarding rules only when the way is
+    known; everything else is left to the reactive PacketIn path.
+
+    Within a MAC pair the rules are ordered like in the list: a port-specific
+    rule listed before the pair's port-agnostic rule gets a higher priority,
+    and one listed after it can never match and is skipped.
+
+    The rules of a pair with rules on more than the TCP port get one
+    priority each, in list order, and compile to the matches of
+    classifier.ofp_matches(). The compilation of such a pair stops at the
+    first rule it cannot compile, as the rules after it would take its
+    traffic.
+
+    pairs, a set of (src, dst) EthAddr pairs, restricts the compilation to
+    those pairs, e.g. the ones whose rules were just reloaded.
+    """
+    flow_mods = []
+    for (src, dst), pair in rule_index.pairs():
+        if pairs is not None and (src, dst) not in pairs:
+            continue
+        if pair.rich:
+            flow_mods.extend(_rich_flow_mods(src, dst, pair.rules, forward_actions))
+            continue
+        if pair.default is not None:
+            default_position, rule = pair.default
+            fm = _flow_mod(src, dst, rule, None, PROACTIVE_PRIORITY, forward_actions)
+            if fm is not None:
+                flow_mods.append(fm)
+        for tcp_port, (position, rule) in pair.ports.items():
+            if pair.default is not None and position > default_position:
+                continue
+            fm = _flow_mod(src, dst, rule, tcp_port, PROACTIVE_PRIORITY + 1, forward_actions)
+            if fm is not None:
+                flow_mods.append(fm)
+    return flow_mods
+
+
+def _flow_mod(src, dst, rule, tcp_port, priority, forward_actions):
+    fm = of.ofp_flow_mod()
+    fm.priority = priority
+    fm.match.dl_src = src
+    fm.match.dl_dst = dst
+    if tcp_port is not None:
+        fm.match.dl_type = 0x800   # IPv4
+        fm.match.nw_proto = 6      # TCP
+        fm.match.tp_dst = tcp_port
+
+    if not rule['drop']:
+        actions = forward_actions(rule, dst)
+        if actions is None:
+            return None
+        fm.actions.extend(actions)
+    return fm
+
+
+def _rich_flow_mods(src, dst, rules, forward_actions):
+    flow_mods = []
+    for position, rule in enumerate(rules):
+        priority = PROACTIVE_PRIORITY + len(rules) - position
+        matches = ofp_matches(rule)
+        actions = [] if rule['drop'] else forward_actions(rule, dst)
+        if matches is None or actions is None or priority > 0xffff:
+            break
+        for match in matches:
+            fm = of.ofp_flow_mod()
+            fm.priority = priority
+            fm.match = match
+            fm.match.dl_src = src
+            fm.match.dl_dst = dst
+            fm.actions.extend(actions)
+            flow_mods.append(fm)
+    return flow_mods
@@ -0,0 +1,212 @@
+"""
+Queue allocation for rate-limited rules.
+
+Rate caps are enforced by linux-htb queues on the switch ports, and a rule
+picks its queue by number. With the numbers written by hand on both sides
+-- the rules in the controller, the queues in the topology script -- they
+drift apart: assignment 2 had queue 0 capped at 30 Mb/s on s2-eth1 while
+queue 0 meant "uncapped" everywhere else, so H2->H3 traffic was capped.
+
+Instead, a rule of a network spec (see sdnlib.netspec) can declare the
+rate it is capped at, in Mbit/s:
+
+    {"EthSrc": "00:00:00:00:00:01", "EthDst": "00:00:00:00:00:03",
+     "TCPPort": 40, "rate": 30, "drop": false}
+
+and, optionally, the rate its queue is guaranteed ("min_rate", Mbit/s;
+MIN_RATE or the whole rate if lower by default).
+
+allocate() then derives the queues of every port and the queue of every
+rule: queue 0 is uncapped on every port, and each distinct rate of the
+rules leaving through a port gets the next queue there, in rule order (so
+changing a rate keeps queue numbers stable). Rules without a rate use
+queue 0. Rates are enforced on the port towards the destination host.
+
+validate() checks queue numbers against a spec's queues; load_spec() and
+the rules files of sdnlib.rulestore refuse specs it finds problems with,
+so no rule can name a queue its port lacks. To change rates at runtime, edit the spec and run
+
+    python -m sdnlib.qos assignment2/network_assignment2.json --apply
+
+which replaces the queues of every port in one ovs-vsctl transaction; the
+controllers pick up the new queue numbers through --rules_file.
+"""
+import argparse
+import sys
+
+from sdnlib.netspec import load_spec, switch_ports, run_transaction, qos_transaction
+
+# The max-rate of the uncapped queue 0, and the min-rate guaranteed to
+# queue 0 and, unless their rules declare a min_rate, to capped queues (or
+# their whole rate, if lower); both in bit/s.
+UNCAPPED_RATE = 1000000000000
+MIN_RATE = 20000000
+
+
+def host_ports(spec):
+    """
+    Returns {host MAC: switch interface the host hangs off}.
+    """
+    macs = dict((host['name'], host['mac'].lower()) for host in spec.get('hosts', []))
+    ports = dict((switch, list(names)) for switch, names in switch_ports(spec).items())
+    used = dict((switch, 0) for switch in ports)
+    result = {}
+    for node1, node2 in spec.get('links', []):
+        for host, switch in ((node1, node2), (node2, node1)):
+            if switch in ports and host in macs:
+                result[macs[host]] = ports[switch][used[switch]]
+        for node in (node1, node2):
+            if node in used:
+                used[node] += 1
+    return result
+
+
+def uses_rates(rules):
+    return any('rate' in rule for rule in rules)
+
+
+def allocate(spec):
+    """
+    Returns (qos, queues): the spec's "qos" section derived from the rules'
+    rates, and the queue number of every rule, in rule order (None for
+    drop rules).
+    """
+    edges = host_ports(spec)
+    qos = {}
+    classes = {}  # port -> {rate: queue}
+    queues = []
+    for rule in spec.get('rules', []):
+        if rule.get('drop'):
+            queues.append(None)
+            continue
+        rate = rule.get('rate')
+        port = edges.get(rule['EthDst'].lower())
+        if rate is None or port is None:
+            queues.append(0)
+            continue
+        bits = int(rate * 1000000)
+        floor = min(int(rule.get('min_rate', MIN_RATE / 1e6) * 1000000), bits)
+        if port not in qos:
+            qos[port] = [{'min_rate': MIN_RATE, 'max_rate': UNCAPPED_RATE}]
+            classes[port] = {}
+        queue = classes[port].get(bits)
+        if queue is None:
+            queue = classes[port][bits] = len(qos[port])
+            qos[port].append({'min_rate': floor, 'max_rate': bits})
+        else:
+            # rules sharing a queue get the largest guarantee any of them declares
+            qos[port][queue]['min_rate'] = max(qos[port][queue]['min_rate'], floor)
+        queues.append(queue)
+    return qos, queues
+
+
+def assign_queues(spec):
+    """
+    If the spec's rules declare rates, fills in its "qos" section and the
+    "queue" of every rule from allocate(). Returns the spec.
+    """
+    rules = spec.get('rules', [])
+    if uses_rates(rules):
+        spec['qos'], queues = allocate(spec)
+        for rule, queue in zip(rules, queues):
+            if queue is not None:
+                rule['queue'] = queue
+    return spec
+
+
+def validate(spec):
+    """
+    Returns a list of problems with the queue numbers of the spec's rules:
+    queues not configured on the rule's egress port, queues whose cap
+    differs from the rule's declared rate, and queue numbers capped on
+    some ports but uncapped on others.
+    """
+    edges = host_ports(spec)
+    qos = spec.get('qos', {})
+    problems = []
+    caps = {}  # queue -> {port: max rate}
+    for rule in spec.get('rules', []):
+        if rule.get('drop'):
+            continue
+        port = edges.get(rule['EthDst'].lower())
+        if port is None:
+            continue
+        queue = rule.get('queue', 0)
+        what = '%s->%s%s' % (rule['EthSrc'], rule['EthDst'],
+                             ' port %s' % rule['TCPPort'] if 'TCPPort' in rule else '')
+        configured = qos.get(port)
+        if configured is None:
+            if queue:
+                problems.append('%s uses queue %d on %s, which has no queues'
+                                % (what, queue, port))
+            continue
+        if queue >= len(configured):
+            problems.append('%s uses queue %d on %s, which only has %d'
+                            % (what, queue, port, len(configured)))
+            continue
+        max_rate = configured[queue]['max_rate']
+        caps.setdefault(queue, {})[port] = max_rate
+        rate = rule.get('rate')
+        if rate is not None and int(rate * 1000000) != max_rate:
+            problems.append('%s is declared at %g Mb/s but queue %d on %s caps at %g Mb/s'
+                            % (what, rate, queue, port, max_rate / 1e6))
+    for queue, ports in sorted(caps.items()):
+        capped = sorted(port for port, rate in ports.items() if rate < UNCAPPED_RATE)
+        uncapped = sorted(port for port, rate in ports.items() if rate >= UNCAPPED_RATE)
+        if capped and uncapped:
+            problems.append('queue %d is uncapped on %s but capped on %s'
+                            % (queue, ', '.join(uncapped), ', '.join(capped)))
+    return problems
+
+
+def check(spec):
+    """
+    Raises ValueError listing the problems validate() finds. Returns the
+    spec.
+    """
+    problems = validate(spec)
+    if problems:
+        raise ValueError('; '.join(problems))
+    return spec
+
+
+def apply_transaction(spec):
+    """
+    One ovs-vsctl transaction replacing all queues of the spec: the ports'
+    old QoS records are detached and destroyed, and the new ones created,
+    so rates change without restarting anything.
+    """
+    args = ['ovs-vsctl']
+    for port in sorted(spec.get('qos', {})):
+        args += ['--', 'clear', 'Port', port, 'qos']
+    args += ['--', '--all', 'destroy', 'qos', '--', '--all', 'destroy', 'queue']
+    return args + qos_transaction(spec)[1:]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check (or apply) the queue allocation of a network spec.")
+    parser.add_argument('spec')
+    parser.add_argument('--apply', action='store_true',
+                        help='replace the queues on the switches with the allocated ones')
+    parser.add_argument('--sudo', action='store_true')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the --apply transaction instead of running it')
+    args = parser.parse_args(argv)
+
+    try:
+        spec = load_spec(args.spec)
+    except ValueError as e:
+        print('problem: %s' % e)
+        return 1
+    for port, queues in sorted(spec.get('qos', {}).items()):
+        print('%s: %s' % (port, ', '.join(
+            'q%d=%s' % (n, 'uncapped' if q['max_rate'] >= UNCAPPED_RATE else '%g Mb/s' % (q['max_rate'] / 1e6))
+            for n, q in enumerate(queues))))
+    if args.apply:
+        return run_transaction(apply_transaction(spec), args.sudo, args.dry_run)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Compiled lookup structure for the controllers' ``rules`` tables.
+
+A rules table is a list of dictionaries that used to be scanned top to
+bottom on every PacketIn, building two EthAddr objects per rule. RuleIndex
+compiles the list once into a hash index keyed by (EthSrc, EthDst) and then
+by TCP destination port, so finding the rule for a packet is constant time.
+
+The rules of a pair that also match on IP addresses, protocols or port
+ranges (see sdnlib.classifier) are compiled into a Classifier of the pair
+instead, which sees all the header fields classify() reads.
+"""
+from pox.lib.addresses import EthAddr
+import pox.lib.packet.ipv4 as ip
+
+from sdnlib.classifier import (Classifier, IP_TYPE, PAIR_FIELDS, is_rich, packet_key, parsed_key,
+                               rule_ranges)
+
+
+class _PairRules(object):
+    """
+    The rules of one (EthSrc, EthDst) pair. Every rule is stored together
+    with its position in the original list so that list order can still
+    decide between a port-specific and a port-agnostic rule.
+    """
+    __slots__ = ('default', 'ports', 'count', 'rules', 'rich', '_classifier')
+
+    def __init__(self):
+        self.default = None  # (position, rule) of the first rule without TCPPort
+        self.ports = {}      # TCP port -> (position, rule) of the first rule for it
+        self.count = 0       # rules of the pair, shadowed ones included
+        self.rules = []      # all of them, in list order
+        self.rich = False    # whether any needs the classifier
+        self._classifier = None
+
+    def add(self, position, rule):
+        entry = (position, rule)
+        self.count += 1
+        self.rules.append(rule)
+        if is_rich(rule):
+            rule_ranges(rule)  # raises ValueError for a malformed rule
+            self.rich = True
+            self._classifier = None
+        tcp_port = rule.get('TCPPort')
+        if tcp_port is None:
+            if self.default is None:
+                self.default = entry
+        elif tcp_port not in self.ports:
+            self.ports[tcp_port] = entry
+
+    def match(self, tcp_port):
+        if tcp_port is not None:
+            hit = self.ports.get(tcp_port)
+            if hit is not None and (self.default is None or hit[0] < self.default[0]):
+                return hit[1]
+        if self.default is not None:
+            return self.default[1]
+        return None
+
+    @property
+    def classifier(self):
+        """
+        The Classifier of the pair's rules, compiled when first needed.
+        """
+        classifier = self._classifier
+        if classifier is None:
+            classifier = self._classifier = Classifier(self.rules, skip=PAIR_FIELDS)
+        return classifier
+
+
+class RuleIndex(object):
+    """
+    Two-level hash index over a list of rule dictionaries.
+
+    A rule only ever matches packets of its own (EthSrc, EthDst) pair, so the
+    first level narrows the list to that pair. A rule carrying a TCPPort only
+    matches TCP packets to that port, while a rule without one matches
+    anything; the earlier of the two candidates wins, which is exactly the
+    rule the old linear scan would have stopped at.
+
+    Every rule needs both MACs: a "*" EthSrc or EthDst raises ValueError.
+    Everything keyed by the pair relies on it -- reloading one pair's rules
+    (replace_pairs), the proactive flows and aggregates installed per pair,
+    the cached flow_mod templates -- as would the precedence between a
+    pair's rules and a wildcard rule elsewhere in the list. A table that
+    needs MAC wildcards can use a Classifier of its own.
+    """
+
+    def __init__(self, rules=()):
+        self._pairs = {}
+        self.size = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        """
+        Appends a rule, i.e. it gets lower precedence than every rule added
+        before it.
+        """
+        key = rule_pair(rule)
+        pair = self._pairs.get(key)
+        if pair is None:
+            pair = self._pairs[key] = _PairRules()
+        pair.add(self.size, rule)
+        self.size += 1
+
+    def replace_pairs(self, groups):
+        """
+        Replaces the rules of some MAC pairs. groups maps (src, dst) EthAddr
+        pairs to their new rules in list order; an empty list removes the
+        pair. Only list order within a pair matters, so the other pairs stay
+        untouched. The new index is built on the side and swapped in with a
+        single assignment, so a lookup never sees a half-updated table.
+        """
+        pairs = dict(self._pairs)
+        size = self.size
+        for key, rules in groups.items():
+            old = pairs.pop(key, None)
+            if old is not None:
+                size -= old.count
+            if rules:
+                pair = pairs[key] = _PairRules()
+                for position, rule in enumerate(rules):
+                    pair.add(position, rule)
+                size += len(rules)
+        self._pairs = pairs
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def pairs(self):
+        """
+        Iterates over ((src, dst), compiled pair rules) for every MAC pair.
+        """
+        return iter(self._pairs.items())
+
+    def pair(self, src, dst):
+        """
+        Returns the compiled rules of a MAC pair, or None if the table has no
+        rule for it at all.
+        """
+        return self._pairs.get((src, dst))
+
+    def lookup(self, src, dst, tcp_port=None):
+        """
+        Returns the first rule matching the given MAC pair and TCP destination
+        port (None for non-TCP traffic), or None if no rule matches. Rules
+        on other header fields see a packet without them.
+        """
+        pair = self._pairs.get((src, dst))
+        if pair is None:
+            return None
+        if pair.rich:
+            return pair.classifier.lookup(_tcp_key(tcp_port))
+        return pair.match(tcp_port)
+
+    def classify(self, headers):
+        """
+        Returns (rule, flow fields) for a packet's fastpath Headers: the first
+        rule matching it, or None, and for a pair with rules on more than
+        the TCP port, the fields its flows match on (see
+        Classifier.flow_fields()), else None.
+        """
+        pair = self._pairs.get((headers.src, headers.dst))
+        if pair is None:
+            return None, None
+        if pair.rich:
+            classifier = pair.classifier
+            key = packet_key(headers)
+            return classifier.lookup(key), classifier.flow_fields(key)
+        return pair.match(headers.tp_dst), None
+
+    def match_packet(self, eth_packet):
+        """
+        Like lookup(), but takes a parsed Ethernet frame. The TCP header is only
+        looked at when the pair actually has port-specific rules.
+        """
+        pair = self._pairs.get((eth_packet.src, eth_packet.dst))
+        if pair is None:
+            return None
+        if pair.rich:
+            return pair.classifier.lookup(parsed_key(eth_packet))
+        tcp_port = None
+        if pair.ports:
+            tcp_port = tcp_dst_port(eth_packet)
+        return pair.match(tcp_port)
+
+
+def rule_pair(rule):
+    """
+    Returns the (EthSrc, EthDst) EthAddr pair of a rule. Rules are filed
+    by MAC pair, so a missing or "*" MAC raises ValueError.
+    """
+    for field in ('EthSrc', 'EthDst'):
+        value = rule.get(field)
+        if value is None or value == '*':
+            raise ValueError("%s %r: rules tables need a MAC for both EthSrc and EthDst "
+                             "('*' is only taken by a Classifier of its own)" % (field, value))
+    return EthAddr(rule['EthSrc']), EthAddr(rule['EthDst'])
+
+
+def _tcp_key(tcp_port):
+    # the packet key of lookup()'s arguments; the MAC pair is decided already
+    if tcp_port is None:
+        return (None,) * 8
+    return (None, None, IP_TYPE, None, None, ip.TCP_PROTOCOL, None, tcp_port)
+
+
+def tcp_dst_port(eth_packet):
+    """
+    Returns the TCP destination port of a parsed Ethernet frame, or None if
+    the frame does not carry TCP over IPv4.
+    """
+    ip_pkt = eth_packet.find('ipv4')
+    if ip_pkt is None or ip_pkt.protocol != ip.TCP_PROTOCOL:
+        return None
+    tcp_pkt = ip_pkt.find('tcp')
+    if tcp_pkt is None:
+        return None
+    return tcp_pkt.dstport
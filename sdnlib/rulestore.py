@@ -0,0 +1,182 @@
+"""
+Rules tables loaded from a file and reloaded while the controller runs.
+
+The rules used to be a list literal in each controller module, so every
+policy change meant restarting POX, which wipes all flows and learned
+state. A RuleStore loads the list from a JSON, CSV or (with PyYAML
+installed) YAML file instead and polls the file for changes. On a change
+it works out which MAC pairs' rules differ, recompiles just those pairs
+into the RuleIndex -- swapped in atomically -- and tells the controller
+which pairs changed, so only their flows need to be touched on the
+switches.
+
+JSON files hold either a list of rule objects or {"rules": [...]}, such as
+a network spec whose rules declare rates instead of queues; CSV
+files have a header row naming the rule fields (EthSrc, EthDst, TCPPort,
+queue, drop, and the IPSrc, IPDst, Proto, SrcPort and DstPort of
+sdnlib.classifier). Empty CSV cells mean the field is absent. Both MACs
+are required: a rule with a "*" EthSrc or EthDst is rejected, as the
+RuleIndex and the reloads are keyed by MAC pair.
+"""
+from collections import OrderedDict
+import csv
+import json
+import os
+
+from pox.core import core
+from pox.lib.addresses import EthAddr
+from pox.lib.recoco import Timer
+from pox.lib.util import str_to_bool
+
+from sdnlib.rules import RuleIndex, rule_pair
+from sdnlib.classifier import is_rich, rule_ranges
+from sdnlib.qos import assign_queues, check
+
+log = core.getLogger()
+
+_INT_FIELDS = ('TCPPort', 'queue')
+
+
+def normalize_rule(rule):
+    """
+    Returns a rule with MACs in lower case, numeric fields as ints, drop as
+    a bool and absent (None or empty) fields removed. Raises ValueError for
+    a malformed rule.
+    """
+    result = {}
+    for field, value in rule.items():
+        if value is None or value == '':
+            continue
+        if field in ('EthSrc', 'EthDst') and value != '*':
+            value = str(EthAddr(value))
+        elif field in _INT_FIELDS:
+            value = int(value)
+        elif field in ('rate', 'min_rate'):
+            value = float(value)
+        elif field == 'drop':
+            value = str_to_bool(value)
+        result[field] = value
+    result.setdefault('drop', False)
+    rule_pair(result)  # raises ValueError for a "*" MAC
+    if is_rich(result):
+        rule_ranges(result)
+    return result
+
+
+def load_rules(path):
+    """
+    Reads a rules table from a .json, .csv or .yaml/.yml file.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path) as f:
+        if extension == '.csv':
+            rules = list(csv.DictReader(f))
+        elif extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is needed to read %s" % path)
+            rules = yaml.safe_load(f)
+        else:
+            rules = json.load(f)
+    if isinstance(rules, dict):
+        # a network spec (see sdnlib.netspec): rules declaring rates get their queues from it,
+        # and a rule naming a queue its port lacks fails the load
+        rules = check(assign_queues(rules))['rules']
+    return [normalize_rule(rule) for rule in rules]
+
+
+def group_by_pair(rules):
+    """
+    Returns an OrderedDict mapping (EthSrc, EthDst) strings to the pair's
+    rules in list order.
+    """
+    groups = OrderedDict()
+    for rule in rules:
+        groups.setdefault((rule['EthSrc'], rule['EthDst']), []).append(rule)
+    return groups
+
+
+def changed_pairs(old_rules, new_rules):
+    """
+    Returns {(src EthAddr, dst EthAddr): new rules of the pair} for every MAC
+    pair whose rules differ between the two tables; removed pairs map to an
+    empty list.
+    """
+    old = group_by_pair(old_rules)
+    new = group_by_pair(new_rules)
+    changed = {}
+    for key, rules in new.items():
+        if old.get(key) != rules:
+            changed[(EthAddr(key[0]), EthAddr(key[1]))] = rules
+    for key in old:
+        if key not in new:
+            changed[(EthAddr(key[0]), EthAddr(key[1]))] = []
+    return changed
+
+
+class RuleStore(object):
+    """
+    A rules table backed by a file.
+
+    on_change(pairs) is called after a reload changed the rules of some MAC
+    pairs, with the set of (src, dst) EthAddr pairs affected; the index has
+    already been updated by then.
+    """
+
+    def __init__(self, path, on_change=None):
+        self.path = path
+        self.on_change = on_change
+        self._stamp = self._stat()
+        self.rules = load_rules(path)
+        self.index = RuleIndex(self.rules)
+        self.reloads = 0
+        self._timer = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def check(self):
+        """
+        Reloads the file if it changed since the last look. Returns True
+        while the timer calling it should keep running.
+        """
+        stamp = self._stat()
+        if stamp is not None and stamp != self._stamp:
+            self._stamp = stamp
+            self.reload()
+        return True
+
+    def reload(self):
+        """
+        Re-reads the file and applies the difference. A file that fails to
+        parse is logged and ignored, so the running policy stays in force.
+        """
+        try:
+            rules = load_rules(self.path)
+        except Exception as e:
+            log.error("Keeping the current rules, %s does not load: %s", self.path, e)
+            return set()
+
+        changed = changed_pairs(self.rules, rules)
+        self.rules = rules
+        if not changed:
+            return set()
+        self.index.replace_pairs(changed)
+        self.reloads += 1
+        log.info("Reloaded %s: rules of %d MAC pairs changed", self.path, len(changed))
+        pairs = set(changed)
+        if self.on_change is not None:
+            self.on_change(pairs)
+        return pairs
+
+    def watch(self, interval=1.0):
+        """
+        Polls the file for changes every interval seconds.
+        """
+        if self._timer is None:
+            self._timer = Timer(interval, self.check, recurring=True)
@@ -0,0 +1,151 @@
+"""
+Per-connection coalescing of outgoing OpenFlow messages.
+
+connection.send() packs and writes every message on its own, so a PacketIn
+answered with a flow_mod and a packet_out costs two socket writes. A
+SendBuffer collects the messages queued for a switch and writes them with a
+single send() once the current event-loop tick is over, i.e. after POX has
+dispatched every message it read in this round. All PacketIns of a burst
+from one switch therefore share one write.
+"""
+import pox.core
+import pox.openflow.libopenflow_01 as of
+
+# Buffers holding unsent messages, flushed together by flush_pending()
+_pending = []
+
+# How a flush_pending() call gets scheduled for the end of the current tick;
+# see set_scheduler().
+_schedule = None
+
+# Counters summed over all connections (see stats())
+totals = {
+    'writes': 0,     # connection.send() calls made
+    'messages': 0,   # OpenFlow messages written, barriers included
+    'barriers': 0,   # barrier requests inserted by fence()/barrier()
+    'bytes': 0,
+    'max_batch': 0,  # most messages coalesced into one write
+}
+
+
+class SendBuffer(object):
+    """
+    Outgoing message buffer of one switch connection.
+
+    With barrier=True, fence() inserts an ofp_barrier_request so the switch
+    finishes everything queued before it -- typically a flow_mod -- before it
+    processes what is queued after it, such as the matching packet_out.
+    """
+
+    def __init__(self, connection, barrier=False):
+        self.connection = connection
+        self.barrier_fences = barrier
+        self._parts = []
+        self.writes = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def send(self, msg):
+        """
+        Queues an OpenFlow message (or already packed bytes holding exactly
+        one message) for the next flush.
+        """
+        if not isinstance(msg, bytes):
+            msg = msg.pack()
+        if not self._parts:
+            _pending.append(self)
+            if len(_pending) == 1 and _schedule is not None:
+                _schedule(flush_pending)
+        self._parts.append(msg)
+
+    def barrier(self):
+        """
+        Queues a barrier request unconditionally.
+        """
+        self.send(of.ofp_barrier_request())
+        totals['barriers'] += 1
+
+    def fence(self):
+        """
+        Queues a barrier request if this buffer was created with barrier=True
+        and there is something queued for it to order against.
+        """
+        if self.barrier_fences and self._parts:
+            self.barrier()
+
+    def flush(self):
+        """
+        Writes everything queued so far with a single connection.send().
+        """
+        parts = self._parts
+        if not parts:
+            return
+        self._parts = []
+        data = parts[0] if len(parts) == 1 else b''.join(parts)
+        self.connection.send(data)
+
+        self.writes += 1
+        self.messages += len(parts)
+        self.bytes += len(data)
+        totals['writes'] += 1
+        totals['messages'] += len(parts)
+        totals['bytes'] += len(data)
+        if len(parts) > totals['max_batch']:
+            totals['max_batch'] = len(parts)
+
+    @property
+    def messages_per_write(self):
+        return float(self.messages) / self.writes if self.writes else 0.0
+
+
+def buffer_for(connection, barrier=False):
+    """
+    Returns the SendBuffer of a connection, creating it on first use with the
+    given barrier setting.
+    """
+    buf = getattr(connection, 'send_buffer', None)
+    if buf is None:
+        buf = SendBuffer(connection, barrier)
+        connection.send_buffer = buf
+    return buf
+
+
+def flush_pending():
+    """
+    Flushes every buffer with queued messages.
+    """
+    global _pending
+    buffers, _pending = _pending, []
+    for buf in buffers:
+        buf.flush()
+
+
+def _call_later(function):
+    # core is looked up on every call, as it is only set once POX has been
+    # initialized, which may be after this module is imported
+    pox.core.core.callLater(function)
+
+
+def set_scheduler(schedule):
+    """
+    Sets the function used to run flush_pending() at the end of the current
+    tick; POX's core.callLater by default. With None nothing is scheduled
+    and the caller has to call flush_pending() itself, which is what offline
+    harnesses without a running POX scheduler do.
+    """
+    global _schedule
+    _schedule = schedule
+
+
+def stats():
+    """
+    Returns the global counters plus the average number of messages per
+    write.
+    """
+    result = dict(totals)
+    result['messages_per_write'] = (float(totals['messages']) / totals['writes']
+                                    if totals['writes'] else 0.0)
+    return result
+
+
+set_scheduler(_call_later)
@@ -0,0 +1,438 @@
+"""
+Multi-process controller sharding by datapath ID.
+
+POX runs every handler in its single cooperative thread, so one busy switch
+delays the PacketIns of all others. In sharded mode the POX process only
+terminates the OpenFlow connections: it forwards each switch's events to
+one of N worker processes (dpid % N), and writes back whatever the worker
+sends. Every worker loads its own copy of the controller module and runs
+its launch() and handlers against sdnlib.shim stand-ins, so learning
+tables, rule indexes and flow caches are per worker and never contended.
+
+One OpenFlow listener feeding the workers:
+
+    ./pox.py openflow.of_01 sdnlib.sharding \\
+        --controller=assignment2 --workers=4 --aggregate
+
+Any option besides --controller and --workers is passed on to the
+controller's launch(); files a controller writes (--state_file,
+--metrics_file) get the worker's number appended, so the workers don't
+overwrite each other's. A worker only sends to the switches it owns, so
+the FlowRemoved and stats replies of its flows come back to it, and runs
+the controller's timers between batches. Alternatively, run one plain POX per shard on
+ports listen_port(dpid, base, workers) and point each switch at its port;
+no forwarding is involved then.
+
+Locally, without switches, the pool can be driven with synthetic switch
+connections to measure how throughput scales with the worker count:
+
+    python -m sdnlib.sharding --pox ~/pox --controller assignment2 \\
+        --workers 1,2,4 --switches 32 --events 100000
+"""
+import argparse
+import heapq
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from sdnlib.shim import init_pox
+
+# How many forwarded batches a worker may have unanswered; further events
+# wait in its queue until it answers one, which keeps the pipes from
+# buffering without bound.
+MAX_IN_FLIGHT = 64
+
+# launch() options naming files a controller writes; every worker gets its own
+PER_WORKER_FILES = ('state_file', 'metrics_file')
+
+# Events forwarded with the packed parts of a stats reply
+STATS_EVENTS = ('FlowStatsReceived', 'PortStatsReceived', 'QueueStatsReceived')
+
+
+def listen_port(dpid, base_port=6633, workers=1):
+    """
+    The OpenFlow port of the shard owning dpid when every shard runs its
+    own POX listener on base_port + shard number.
+    """
+    return base_port + dpid % workers
+
+
+class _WorkerConnection(object):
+    """
+    A switch connection inside a worker: whatever is sent on it is collected
+    and shipped back to the POX process after the current batch.
+    """
+
+    def __init__(self, dpid, replies):
+        self.dpid = dpid
+        self._replies = replies
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self._replies.append((self.dpid, data))
+
+
+class _WorkerTimer(object):
+    """
+    Stands in for pox.lib.recoco.Timer in a worker process, whose only
+    thread waits for batches: the timers due are run between them (see
+    _worker_main). As with recoco, a recurring callback returning False
+    stops the timer.
+    """
+    _queue = []  # heap of (due, sequence number, timer)
+    _count = 0
+
+    def __init__(self, timeToWake, callback, absoluteTime=False, recurring=False,
+                 args=(), kw={}, scheduler=None, started=True, selfStoppable=True):
+        self._interval = timeToWake - time.time() if absoluteTime else timeToWake
+        self._callback = callback
+        self._recurring = recurring
+        self._args = args
+        self._kw = kw
+        self._self_stoppable = selfStoppable
+        self._cancelled = False
+        if started:
+            self.start()
+
+    def start(self):
+        _WorkerTimer._count += 1
+        heapq.heappush(self._queue, (time.time() + max(self._interval, 0), self._count, self))
+
+    def cancel(self):
+        self._cancelled = True
+
+    @classmethod
+    def run_due(cls):
+        """
+        Runs the timers that are due; returns the seconds until the next
+        one, or None if there is none.
+        """
+        queue = cls._queue
+        while queue and queue[0][0] <= time.time():
+            timer = heapq.heappop(queue)[2]
+            if timer._cancelled:
+                continue
+            result = timer._callback(*timer._args, **timer._kw)
+            if timer._recurring and not (timer._self_stoppable and result is False):
+                timer.start()
+        return max(queue[0][0] - time.time(), 0) if queue else None
+
+
+def _worker_main(path, controller, launch_args, index, workers, inbox, outbox):
+    """
+    Entry point of worker number index of workers: runs the controller and
+    feeds it the event batches arriving on inbox, answering each batch on
+    outbox with (batch number, [(dpid, bytes to write), ...]). What the
+    controller's timers send goes out as (None, [...]).
+    """
+    sys.path[:] = path
+    from sdnlib import shim
+    # a spawned process starts without POX's core, like any other program
+    core = shim.init_pox()
+    import pox.lib.recoco
+    import pox.openflow.libopenflow_01 as of
+    from sdnlib import sendbuf
+
+    # Handlers run batch by batch in this thread; a batch is our event tick
+    sendbuf.set_scheduler(None)
+
+    replies = []
+    # only the switches this worker owns: their FlowRemoved and stats
+    # replies come back here, so whatever is installed on a switch is
+    # installed by the worker that hears about it
+    nexus = shim.Nexus(lambda dpid: _WorkerConnection(dpid, replies)
+                       if dpid % workers == index else None)
+    core.register('openflow', nexus)
+    # the controllers' modules bind Timer when they are imported
+    pox.lib.recoco.Timer = _WorkerTimer
+    module = shim.load_controller(controller)
+    module.launch(**launch_args)
+
+    while True:
+        wait = _WorkerTimer.run_due()
+        sendbuf.flush_pending()
+        if replies:
+            outbox.send((None, replies[:]))
+            del replies[:]
+        if not inbox.poll(wait):
+            continue
+        batch = inbox.recv()
+        if batch is None:
+            break
+        number, events = batch
+        for kind, dpid, fields in events:
+            connection = nexus.getConnection(dpid)
+            if kind == 'PacketIn':
+                buffer_id, in_port, reason, total_len, data = fields
+                ofp = of.ofp_packet_in(buffer_id=buffer_id, in_port=in_port, reason=reason,
+                                       total_len=total_len, data=data)
+                event = shim.PacketIn(connection, ofp)
+            elif kind == 'PortStatus':
+                ofp = of.ofp_port_status()
+                ofp.unpack(fields)
+                event = shim.port_status(connection, ofp)
+            elif kind == 'FlowRemoved':
+                ofp = of.ofp_flow_removed()
+                ofp.unpack(fields)
+                event = shim.Event(connection, ofp=ofp)
+            elif kind in STATS_EVENTS:
+                parts = []
+                for data in fields:
+                    part = of.ofp_stats_reply()
+                    part.unpack(data)
+                    parts.append(part)
+                event = shim.stats_event(connection, parts)
+            elif kind == 'BarrierIn':
+                event = shim.Event(connection, xid=fields)
+            else:
+                event = shim.Event(connection)
+                if kind == 'ConnectionDown':
+                    nexus.connections.pop(dpid, None)
+            nexus.raiseEvent(kind, event)
+        sendbuf.flush_pending()
+        outbox.send((number, replies[:]))
+        del replies[:]
+
+
+class _Worker(object):
+    def __init__(self, context, controller, launch_args, index, workers, deliver, ready):
+        self.inbox, parent_inbox = context.Pipe(duplex=False)
+        parent_outbox, self.outbox = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_worker_main,
+            args=(list(sys.path), controller, launch_args, index, workers,
+                  self.inbox, self.outbox))
+        self._to_worker = parent_inbox
+        self._from_worker = parent_outbox
+        self.process.daemon = True
+        self.process.start()
+        self.pending = []
+        self.sent = 0
+        self.answered = 0
+        self._window = threading.Semaphore(MAX_IN_FLIGHT)
+        self._deliver = deliver
+        self._ready = ready
+        self._reader = threading.Thread(target=self._read_replies)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def flush(self):
+        """
+        Sends the queued events as one batch, unless MAX_IN_FLIGHT batches
+        are unanswered: then they stay queued, and ready() is called once
+        the worker answers one. Never blocks.
+        """
+        if not self.pending:
+            return
+        if not self._window.acquire(False):
+            return
+        self.sent += 1
+        self._to_worker.send((self.sent, self.pending))
+        self.pending = []
+
+    def _read_replies(self):
+        while True:
+            try:
+                number, replies = self._from_worker.recv()
+            except (EOFError, OSError):
+                return
+            if replies:
+                self._deliver(replies)
+            if number is None:
+                continue  # sent by the controller's timers
+            self.answered = number
+            self._window.release()
+            if self.pending:
+                self._ready()
+
+    def stop(self):
+        try:
+            self._to_worker.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(5)
+
+
+class ShardPool(object):
+    """
+    N worker processes, each owning the switches with dpid % N equal to its
+    number.
+
+    Events are queued with dispatch() and forwarded one batch per worker by
+    flush(). deliver([(dpid, data), ...]) is called from a reader thread
+    with what the workers want written to the switches, and ready(), also
+    from a reader thread, when a worker whose events had to wait can take
+    a batch again; flush() is to be called then.
+    """
+
+    def __init__(self, controller, workers, launch_args=None, deliver=None, ready=None):
+        context = multiprocessing.get_context('spawn')
+        self._deliver = deliver or (lambda replies: None)
+        self._ready = ready or (lambda: None)
+        self.workers = [_Worker(context, controller, worker_args(launch_args or {}, index),
+                                index, workers, self._deliver, self._ready)
+                        for index in range(workers)]
+
+    def shard(self, dpid):
+        return self.workers[dpid % len(self.workers)]
+
+    def dispatch(self, kind, dpid, fields=None):
+        """
+        Queues an event for the worker owning dpid. PacketIn fields are
+        (buffer_id, in_port, reason, total_len, data); PortStatus and
+        FlowRemoved carry the packed OpenFlow message, the STATS_EVENTS a
+        list of the packed parts of the reply and BarrierIn its xid.
+        """
+        self.shard(dpid).pending.append((kind, dpid, fields))
+
+    def flush(self):
+        for worker in self.workers:
+            worker.flush()
+
+    def drain(self, timeout=60):
+        """
+        Sends whatever is still queued and waits until the workers have
+        answered every batch.
+        """
+        deadline = time.time() + timeout
+        while any(w.answered < w.sent or w.pending for w in self.workers):
+            if time.time() > deadline:
+                raise RuntimeError("shard workers did not answer in %s seconds" % timeout)
+            self.flush()
+            time.sleep(0.001)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+def worker_args(launch_args, index):
+    """
+    The launch() options of worker number index: those of PER_WORKER_FILES
+    get a .<index> suffix.
+    """
+    args = dict(launch_args)
+    for name in PER_WORKER_FILES:
+        if args.get(name):
+            args[name] = '%s.%d' % (args[name], index)
+    return args
+
+
+def launch(controller, workers=2, **launch_args):
+    """
+    POX component: forwards all switch events to a ShardPool running the
+    given controller module in --workers processes.
+    """
+    from pox.core import core
+
+    def write(replies):
+        for dpid, data in replies:
+            connection = core.openflow.getConnection(dpid)
+            if connection is not None:
+                connection.send(data)
+
+    scheduled = [False]
+    pool = ShardPool(controller, int(workers), launch_args,
+                     lambda replies: core.callLater(write, replies),
+                     lambda: core.callLater(flush))
+
+    def forward(kind, dpid, fields=None):
+        pool.dispatch(kind, dpid, fields)
+        if not scheduled[0]:
+            scheduled[0] = True
+            core.callLater(flush)
+
+    def flush():
+        scheduled[0] = False
+        pool.flush()
+
+    def packet_in(event):
+        ofp = event.ofp
+        forward('PacketIn', event.dpid,
+                (ofp.buffer_id, ofp.in_port, ofp.reason, ofp.total_len, ofp.data))
+
+    core.openflow.addListenerByName("ConnectionUp",
+                                    lambda event: forward('ConnectionUp', event.dpid))
+    core.openflow.addListenerByName("ConnectionDown",
+                                    lambda event: forward('ConnectionDown', event.dpid))
+    core.openflow.addListenerByName("PortStatus",
+                                    lambda event: forward('PortStatus', event.dpid, event.ofp.pack()))
+    core.openflow.addListenerByName("FlowRemoved",
+                                    lambda event: forward('FlowRemoved', event.dpid, event.ofp.pack()))
+    core.openflow.addListenerByName("PacketIn", packet_in)
+    for name in STATS_EVENTS:
+        core.openflow.addListenerByName(
+            name, lambda event, name=name: forward(name, event.dpid, [part.pack() for part in event.ofp]))
+    core.openflow.addListenerByName("BarrierIn",
+                                    lambda event: forward('BarrierIn', event.dpid, event.xid))
+    core.addListenerByName("DownEvent", lambda event: pool.stop())
+    core.getLogger().info("Sharding %s over %s workers", controller, workers)
+
+
+def _bench(controller, workers, switches, events, batch):
+    """
+    Runs one ShardPool against synthetic switches and returns the PacketIns
+    handled per second.
+    """
+    import pox.openflow.libopenflow_01 as of
+    from sdnlib.bench import synthetic_frames
+    from sdnlib.shim import load_controller
+
+    frames = synthetic_frames(load_controller(controller).rules, events)
+    written = [0]
+    lock = threading.Lock()
+
+    def count(replies):
+        with lock:
+            written[0] += len(replies)
+
+    pool = ShardPool(controller, workers, deliver=count)
+    try:
+        for dpid in range(1, switches + 1):
+            pool.dispatch('ConnectionUp', dpid)
+        pool.flush()
+        pool.drain()
+
+        started = time.time()
+        for i, (in_port, data) in enumerate(frames):
+            pool.dispatch('PacketIn', i % switches + 1,
+                          (None, in_port, of.OFPR_NO_MATCH, len(data), data))
+            if (i + 1) % batch == 0:
+                pool.flush()
+        pool.flush()
+        pool.drain()
+        elapsed = time.time() - started
+    finally:
+        pool.stop()
+    return events / elapsed, written[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure sharded PacketIn throughput")
+    parser.add_argument('--pox', default=os.environ.get('POX_HOME'),
+                        help='path of the POX checkout (default: $POX_HOME)')
+    parser.add_argument('--controller', default='assignment2')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated worker counts')
+    parser.add_argument('--switches', type=int, default=32)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--batch', type=int, default=256,
+                        help='PacketIns forwarded per batch, i.e. per simulated event-loop tick')
+    args = parser.parse_args(argv)
+
+    # the workers get our sys.path, POX included
+    init_pox(args.pox)
+
+    print('%8s %10s %10s %8s' % ('workers', 'pktin/s', 'writes', 'speedup'))
+    single = None
+    for workers in [int(w) for w in args.workers.split(',')]:
+        rate, writes = _bench(args.controller, workers, args.switches, args.events, args.batch)
+        single = single or rate
+        print('%8d %10.0f %10d %8.2f' % (workers, rate, writes, rate / single))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Stand-ins for the parts of POX's OpenFlow layer the controllers touch.
+
+The controller modules only ever see core.openflow (to register handlers
+and look up connections), connection objects with send() and a dpid, and
+events carrying a connection plus a few message fields. Providing those is
+enough to run a controller's launch() and handlers outside a POX process
+that owns the switch sockets -- in a benchmark, a shard worker, or another
+OpenFlow front end.
+"""
+import importlib.util
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONTROLLERS = {
+    'assignment1': os.path.join(REPO_ROOT, 'assignment1', 'controller_assignment1.py'),
+    'assignment2': os.path.join(REPO_ROOT, 'assignment2', 'controller_assignment2.py'),
+}
+
+
+class Nexus(object):
+    """
+    Stands in for core.openflow: records the handlers registered with
+    addListenerByName() and hands events to them.
+
+    connection_factory(dpid), if given, creates connection objects on
+    demand for getConnection().
+    """
+
+    def __init__(self, connection_factory=None):
+        self.handlers = {}
+        self.connections = {}
+        self._connection_factory = connection_factory
+
+    def addListenerByName(self, name, handler, **kw):
+        self.handlers.setdefault(name, []).append(handler)
+
+    def getConnection(self, dpid):
+        connection = self.connections.get(dpid)
+        if connection is None and self._connection_factory is not None:
+            connection = self.connections[dpid] = self._connection_factory(dpid)
+        return connection
+
+    def raiseEvent(self, name, event):
+        for handler in self.handlers.get(name, ()):
+            handler(event)
+
+
+class Event(object):
+    """
+    An OpenFlow event of some switch connection; any further fields the
+    handlers read (port, ofp, ...) are passed as keywords.
+    """
+
+    def __init__(self, connection, **fields):
+        self.connection = connection
+        self.dpid = connection.dpid
+        self.__dict__.update(fields)
+
+
+class PacketIn(Event):
+    """
+    A PacketIn event. Like POX's, it parses the frame only when a handler
+    first reads event.parsed.
+    """
+
+    def __init__(self, connection, ofp):
+        Event.__init__(self, connection, ofp=ofp, port=ofp.in_port, data=ofp.data)
+        self._parsed = None
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            from pox.lib.packet import ethernet
+            self._parsed = ethernet(self.data)
+        return self._parsed
+
+
+def port_status(connection, ofp):
+    """
+    Builds a PortStatus event from an ofp_port_status message.
+    """
+    import pox.openflow.libopenflow_01 as of
+    return Event(connection, ofp=ofp, port=ofp.desc.port_no,
+                 added=ofp.reason == of.OFPPR_ADD,
+                 deleted=ofp.reason == of.OFPPR_DELETE,
+                 modified=ofp.reason == of.OFPPR_MODIFY)
+
+
+def stats_event(connection, parts):
+    """
+    Builds a *StatsReceived event from the ofp_stats_reply parts of one
+    reply: ofp is the list of parts, and stats holds the bodies of all.
+    """
+    stats = []
+    for part in parts:
+        if isinstance(part.body, list):
+            stats.extend(part.body)
+        else:
+            stats.append(part.body)
+    return Event(connection, ofp=parts, stats=stats)
+
+
+def init_pox(path=None):
+    """
+    Puts a POX checkout (and the repository root) on sys.path and
+    initializes pox.core the way pox.py does before it loads a component.
+    Until then pox.core.core is None, and so is the core every module
+    imports with "from pox.core import core" -- the controllers and most of
+    sdnlib -- so this has to run before any of them is imported. Returns
+    core; raises ImportError if POX cannot be found.
+    """
+    if path:
+        path = os.path.abspath(os.path.expanduser(path))
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import pox.core
+    if pox.core.core is None:
+        pox.core.initialize()
+    return pox.core.core
+
+
+def load_controller(name):
+    """
+    Imports a fresh copy of a controller module, given as 'assignment1',
+    'assignment2' or the path of a module file. Every call returns a new
+    module object, so copies don't share state.
+    """
+    path = CONTROLLERS.get(name, name)
+    module_name = 'controller_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
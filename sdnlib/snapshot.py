@@ -0,0 +1,187 @@
+"""
+Controller state that survives a restart.
+
+A restarted controller used to start from nothing: the learned MAC bindings
+were gone, and ConnectionUp wiped every flow of the reconnecting switches,
+so all traffic paid the PacketIn setup latency again and was flooded until
+the hosts were relearned. StateSnapshot saves the learning table and the
+record of installed flows to a file every few seconds (and when POX shuts
+down), and loads it on startup.
+
+A switch the snapshot knows is then not wiped when it reconnects. The
+controller asks for its flow table instead, and reconcile() keeps every
+flow the controller still stands behind -- the recorded ones and the ones
+the rules table compiles to -- deleting only the rest, so established
+flows never notice the failover.
+
+The file is JSON, rewritten atomically (written aside, then renamed):
+
+    {"version": 1, "saved": 1700000000.0,
+     "macs": [[dpid, "00:00:00:00:00:01", port, expiry], ...],
+     "flows": [[dpid, dl_src, dl_dst, dl_type, nw_proto, tp_dst, installed, expiry,
+                nw_src, nw_dst, tp_src], ...]}
+
+The last three fields of a flow are left out of files written before the
+flows matched on them.
+"""
+import json
+import os
+import time
+
+from pox.core import core
+from pox.lib.addresses import EthAddr, IPAddr
+from pox.lib.recoco import Timer
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.flowcache import match_key
+
+log = core.getLogger()
+
+VERSION = 1
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+def _eth(value):
+    return None if value is None else EthAddr(value)
+
+
+def _prefix_str(value):
+    return None if value is None else '%s/%d' % value
+
+
+def _prefix(value):
+    # "address/length", or just the address in files of older versions
+    if value is None:
+        return None
+    address, _, length = value.partition('/')
+    return (IPAddr(address), int(length) if length else 32)
+
+
+def _field(flow, index):
+    return flow[index] if len(flow) > index else None
+
+
+class StateSnapshot(object):
+    """
+    Saves and restores a LearningTable and a FlowCache through a file.
+
+    keep_priorities are the priorities of flows the controller installs
+    without recording them (e.g. punt entries) and that are left alone
+    when reconciling.
+    """
+
+    def __init__(self, path, table, installed, keep_priorities=(), clock=time.time):
+        self.path = path
+        self.table = table
+        self.installed = installed
+        self.keep_priorities = frozenset(keep_priorities)
+        self._clock = clock
+        self._restored = set()  # dpids whose flows are reconciled instead of wiped
+        self._pending = set()   # dpids asked for their flows, reply not seen yet
+        self.saves = 0
+
+    def save(self):
+        """
+        Writes the current state to the file.
+        """
+        state = {
+            'version': VERSION,
+            'saved': self._clock(),
+            'macs': [[dpid, str(mac), port, expiry]
+                     for dpid, mac, port, expiry in self.table.dump()],
+            'flows': [[dpid, _str(key[0]), _str(key[1]), key[2], key[3], key[4],
+                       installed, None if expiry == float('inf') else expiry,
+                       _prefix_str(key[5]), _prefix_str(key[6]), key[7]]
+                      for dpid, key, installed, expiry in self.installed.dump()],
+        }
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.rename(tmp, self.path)
+        self.saves += 1
+        return True
+
+    def restore(self):
+        """
+        Loads the file, if there is one. Returns the number of MAC bindings
+        and flows restored; an unreadable file is logged and ignored.
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except IOError:
+            return 0, 0
+        except ValueError as e:
+            log.error("Ignoring unreadable state file %s: %s", self.path, e)
+            return 0, 0
+        if state.get('version') != VERSION:
+            log.warning("Ignoring state file %s of version %s", self.path, state.get('version'))
+            return 0, 0
+
+        macs = self.table.load((dpid, EthAddr(mac), port, expiry)
+                               for dpid, mac, port, expiry in state['macs'])
+        flows = self.installed.load(
+            (flow[0], (_eth(flow[1]), _eth(flow[2]), flow[3], flow[4], flow[5],
+                       _prefix(_field(flow, 8)), _prefix(_field(flow, 9)), _field(flow, 10)),
+             flow[6], float('inf') if flow[7] is None else flow[7])
+            for flow in state['flows'])
+        self._restored.update(dpid for dpid, mac, port, expiry in state['macs'])
+        self._restored.update(self.installed.switches())
+        return macs, flows
+
+    def start(self, interval):
+        """
+        Saves the state every interval seconds and when POX goes down.
+        """
+        core.addListenerByName("GoingDownEvent", lambda event: self.save())
+        return Timer(interval, self.save, recurring=True)
+
+    def should_reconcile(self, dpid):
+        """
+        Tells, once per switch, whether its flows survived from before the
+        restart and are to be reconciled rather than wiped.
+        """
+        if dpid in self._restored:
+            self._restored.discard(dpid)
+            self._pending.add(dpid)
+            return True
+        return False
+
+    def reconcile(self, dpid, flow_stats, expected=()):
+        """
+        Returns the flow_mods deleting the flows of a flow-stats reply the
+        controller does not stand behind any more: those neither recorded in
+        the flow cache, nor in expected (a set of (match key, priority) the
+        rules table compiles to), nor at one of keep_priorities. Recorded
+        flows the switch no longer has are forgotten.
+
+        Returns None for a reply nobody asked for through should_reconcile().
+        """
+        if dpid not in self._pending:
+            return None
+        self._pending.discard(dpid)
+        present = set()
+        deletes = []
+        for stat in flow_stats:
+            key = match_key(stat.match)
+            if (self.installed.has(dpid, stat.match) or (key, stat.priority) in expected
+                    or stat.priority in self.keep_priorities):
+                present.add(key)
+                continue
+            fm = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+            fm.match = stat.match
+            fm.priority = stat.priority
+            deletes.append(fm)
+        self.installed.retain(dpid, present)
+        return deletes
+
+
+def flow_keys(flow_mods):
+    """
+    The (match key, priority) of flow_mods, in the form reconcile() takes
+    as expected.
+    """
+    return set((match_key(fm.match), fm.priority) for fm in flow_mods)
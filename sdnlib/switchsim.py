@@ -0,0 +1,1067 @@
+"""
+Emulated switches and traffic matrices for controller scale tests.
+
+The Mininet topologies have four hosts and need root and Open vSwitch, so
+they say nothing about how the controllers cope with hundreds of switches
+and tens of thousands of hosts. This module emulates the switches instead:
+N datapaths wired as a tree, each with its own OpenFlow connection to the
+controller over a loopback socket. Every switch keeps a flow table that
+honours the flow_mods it is sent -- priorities, wildcards, idle and hard
+timeouts, FlowRemoved notifications, flow-stats requests -- and forwards
+matching packets along the tree. Table misses become PacketIns, and
+packet_outs are forwarded like hits. With --buffers the switches keep table
+misses in that many packet buffers, as hardware switches do, and send only
+the first miss_send_len bytes; packet_outs and flow_mods carrying the
+buffer_id release them.
+
+Traffic comes from a matrix of demands, each a host pair (with an optional
+TCP port) and the rate of new connections between them, per second:
+
+    {"demands": [{"src": 1, "dst": 70, "TCPPort": 80, "rate": 2.5}, ...]}
+
+Hosts are given by number (host n has MAC 02:00 followed by n) or by MAC;
+host n hangs off port ((n - 1) % hosts) + 1 of switch ((n - 1) // hosts) + 1.
+Without --matrix, --pairs random demands are drawn. Each new connection
+sends its first packet only (a TCP SYN, or an ICMP echo without TCPPort).
+
+By default each controller runs in-process on an sdnlib.aioflow listener,
+its host, link and rules tables replaced by the emulated network's (one
+forwarding rule per demand). --connect points the switches at a controller
+running elsewhere instead; --write-rules saves the matching rules file for
+its --rules_file. For each run it reports the flow setup rate, the latency
+from a PacketIn to the flow_mod covering its packet, the control-channel
+bytes per PacketIn and the flow table occupancy over time:
+
+    python -m sdnlib.switchsim --pox ~/pox --switches 64 --hosts 100 \\
+        --pairs 20000 --rate 5000 --duration 30
+
+In-process, the switches and the controller share one CPU, so the
+latencies include the emulation's own cost.
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import random
+import socket
+import struct
+import sys
+from collections import OrderedDict
+from operator import itemgetter
+
+from sdnlib.aioflow import (header, new_event_loop, _launch_args, _HEADER, OFPT_HELLO,
+                            OFPT_ECHO_REQUEST, OFPT_ECHO_REPLY, OFPT_FEATURES_REQUEST, OFPT_FEATURES_REPLY,
+                            OFPT_PACKET_IN, OFPT_FLOW_REMOVED, OFPT_PACKET_OUT, OFPT_FLOW_MOD,
+                            OFPT_STATS_REPLY, OFPT_BARRIER_REPLY, OFPSF_REPLY_MORE)
+from sdnlib.bench import percentile
+from sdnlib.shim import CONTROLLERS, init_pox
+
+OFPT_SET_CONFIG = 9
+OFPT_STATS_REQUEST = 16
+OFPT_BARRIER_REQUEST = 18
+
+OFPP_IN_PORT = 0xfff8
+OFPP_TABLE = 0xfff9
+OFPP_FLOOD = 0xfffb
+OFPP_ALL = 0xfffc
+OFPP_CONTROLLER = 0xfffd
+OFPP_NONE = 0xffff
+
+OFPFC_ADD = 0
+OFPFC_MODIFY = 1
+OFPFC_MODIFY_STRICT = 2
+OFPFC_DELETE = 3
+OFPFC_DELETE_STRICT = 4
+OFPFF_SEND_FLOW_REM = 1
+
+OFPR_NO_MATCH = 0
+OFPR_ACTION = 1
+OFPRR_IDLE_TIMEOUT = 0
+OFPRR_HARD_TIMEOUT = 1
+OFPRR_DELETE = 2
+
+OFPAT_OUTPUT = 0
+OFPAT_ENQUEUE = 11
+OFPST_FLOW = 1
+
+NO_BUFFER = 0xffffffff
+
+# Wildcard bits of the match fields, in ofp_match order: in_port, dl_src,
+# dl_dst, dl_vlan, dl_vlan_pcp, dl_type, nw_tos, nw_proto, nw_src, nw_dst,
+# tp_src, tp_dst. The IP addresses are wildcarded by prefix length instead.
+_FIELD_BITS = (1, 4, 8, 2, 1 << 20, 16, 1 << 21, 32, None, None, 64, 128)
+_NW_SRC, _NW_DST = 8, 9
+_DL_PAIR = 4 | 8
+
+_MATCH = struct.Struct('!IH6s6sHBxHBB2xIIHH')
+_FLOW_MOD = struct.Struct('!QHHHHIHH')
+_ACTION = struct.Struct('!HHH')
+_PACKET_IN = struct.Struct('!IHHBx')
+_PACKET_OUT = struct.Struct('!IHH')
+_FLOW_REMOVED = struct.Struct('!QHBxIIH2xQQ')
+_FLOW_STATS = struct.Struct('!HBx40sIIHHH6xQQQ')
+_STATS = struct.Struct('!HH')
+_PHY_PORT = struct.Struct('!H6s16sIIIIII')
+_SET_CONFIG = struct.Struct('!HH')
+
+_ETH = struct.Struct('!6s6sH')
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_IP_ADDRS = struct.Struct('!II')
+_PORTS = struct.Struct('!HH')
+_TCP = struct.Struct('!HHIIBBHHH')
+_ICMP = struct.Struct('!BBHHH')
+
+# Forwarding more hops than this is a loop
+MAX_HOPS = 32
+
+# Bytes of flow stats per reply message before the rest goes in another one
+STATS_CHUNK = 60000
+
+# What a switch sends of a buffered table miss until told otherwise
+DEFAULT_MISS_SEND_LEN = 128
+
+
+def host_mac(number):
+    return b'\x02\x00' + struct.pack('!I', number)
+
+
+def host_ip(number):
+    return struct.pack('!I', (10 << 24) | number)
+
+
+def mac_str(mac):
+    return ':'.join('%02x' % b for b in mac)
+
+
+def ip_str(ip):
+    return '.'.join(str(b) for b in ip)
+
+
+def _checksum(data):
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def tcp_syn(src, dst, src_port, dst_port):
+    """
+    The frame of a TCP SYN from host number src to host number dst.
+    """
+    ip = _IPV4.pack(0x45, 0, 40, 0, 0x4000, 64, 6, 0, host_ip(src), host_ip(dst))
+    ip = ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:]
+    tcp = _TCP.pack(src_port, dst_port, 0, 0, 5 << 4, 0x02, 65535, 0, 0)
+    return _ETH.pack(host_mac(dst), host_mac(src), 0x0800) + ip + tcp
+
+
+def icmp_echo(src, dst, ident):
+    """
+    The frame of an ICMP echo request from host number src to host dst.
+    """
+    icmp = _ICMP.pack(8, 0, 0, ident, 1) + b'\x00' * 32
+    icmp = icmp[:2] + struct.pack('!H', _checksum(icmp)) + icmp[4:]
+    ip = _IPV4.pack(0x45, 0, 20 + len(icmp), 0, 0x4000, 64, 1, 0, host_ip(src), host_ip(dst))
+    ip = ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:]
+    return _ETH.pack(host_mac(dst), host_mac(src), 0x0800) + ip + icmp
+
+
+def packet_fields(frame):
+    """
+    The match fields of a frame, in ofp_match order without in_port, as
+    OpenFlow 1.0 switches extract them.
+    """
+    dl_dst, dl_src, dl_type = _ETH.unpack_from(frame, 0)
+    nw_tos = nw_proto = nw_src = nw_dst = tp_src = tp_dst = 0
+    if dl_type == 0x0800 and len(frame) >= 34:
+        ihl = (frame[14] & 0x0f) * 4
+        nw_tos = frame[15] & 0xfc
+        nw_proto = frame[23]
+        nw_src, nw_dst = _IP_ADDRS.unpack_from(frame, 26)
+        l4 = 14 + ihl
+        fragment = struct.unpack_from('!H', frame, 20)[0] & 0x1fff
+        if not fragment and len(frame) >= l4 + 4:
+            if nw_proto in (6, 17):
+                tp_src, tp_dst = _PORTS.unpack_from(frame, l4)
+            elif nw_proto == 1:
+                tp_src, tp_dst = frame[l4], frame[l4 + 1]
+    elif dl_type == 0x0806 and len(frame) >= 42:
+        nw_proto = frame[21]
+        nw_src = struct.unpack_from('!I', frame, 28)[0]
+        nw_dst = struct.unpack_from('!I', frame, 38)[0]
+    return (dl_src, dl_dst, 0xffff, 0, dl_type, nw_tos, nw_proto, nw_src, nw_dst, tp_src, tp_dst)
+
+
+def _prefix_mask(wildcards, shift):
+    bits = (wildcards >> shift) & 0x3f
+    return 0 if bits >= 32 else (0xffffffff << bits) & 0xffffffff
+
+
+def parse_actions(raw):
+    """
+    Returns the output ports of an action list (output and enqueue
+    actions); other actions are ignored.
+    """
+    ports = []
+    offset = 0
+    while offset + 8 <= len(raw):
+        action_type, length, port = _ACTION.unpack_from(raw, offset)
+        if length < 8:
+            break
+        if action_type in (OFPAT_OUTPUT, OFPAT_ENQUEUE):
+            ports.append(port)
+        offset += length
+    return ports
+
+
+class _Mask(object):
+    """
+    The flows of a table sharing one set of wildcards, hashed on the fields
+    those leave exact.
+    """
+    __slots__ = ('wildcards', 'get', 'nw_src', 'nw_dst', 'prefixes', 'flows')
+
+    def __init__(self, wildcards):
+        fields = [i for i, bit in enumerate(_FIELD_BITS) if bit is not None and not wildcards & bit]
+        self.wildcards = wildcards
+        self.get = itemgetter(*fields) if fields else (lambda key: ())
+        self.nw_src = _prefix_mask(wildcards, 8)
+        self.nw_dst = _prefix_mask(wildcards, 14)
+        self.prefixes = self.nw_src or self.nw_dst
+        self.flows = {}  # projected key -> [entries, highest priority first]
+
+    def project(self, key):
+        if self.prefixes:
+            return (self.get(key), key[_NW_SRC] & self.nw_src, key[_NW_DST] & self.nw_dst)
+        return self.get(key)
+
+
+class FlowEntry(object):
+    __slots__ = ('match', 'wildcards', 'key', 'priority', 'rank', 'cookie', 'idle_timeout',
+                 'hard_timeout', 'flags', 'actions', 'raw_actions', 'installed', 'used',
+                 'packets', 'bytes', 'mask', 'projected', 'removed')
+
+    def __init__(self, match, cookie, priority, idle_timeout, hard_timeout, flags, raw_actions, now):
+        fields = _MATCH.unpack(match)
+        self.match = match
+        self.wildcards = fields[0]
+        self.key = fields[1:]
+        self.priority = priority
+        # exact-match flows take precedence over all wildcarded ones
+        self.rank = priority if self.wildcards & 0x3fffff else 0x10000
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+        self.flags = flags
+        self.raw_actions = raw_actions
+        self.actions = parse_actions(raw_actions)
+        self.installed = self.used = now
+        self.packets = self.bytes = 0
+        self.mask = self.projected = None
+        self.removed = False
+
+    def matches(self, key):
+        return self.mask.project(key) == self.projected
+
+    def deadline(self):
+        deadline = float('inf')
+        if self.hard_timeout:
+            deadline = self.installed + self.hard_timeout
+        if self.idle_timeout:
+            deadline = min(deadline, self.used + self.idle_timeout)
+        return deadline
+
+
+def covers(wildcards, key, entry):
+    """
+    Tells whether a flow_mod match (wildcards, key) covers a flow entry, as
+    non-strict MODIFY and DELETE select entries.
+    """
+    for i, bit in enumerate(_FIELD_BITS):
+        if bit is not None and not wildcards & bit:
+            if entry.wildcards & bit or entry.key[i] != key[i]:
+                return False
+    for i, shift in ((_NW_SRC, 8), (_NW_DST, 14)):
+        mask = _prefix_mask(wildcards, shift)
+        if mask:
+            if _prefix_mask(entry.wildcards, shift) & mask != mask:
+                return False
+            if entry.key[i] & mask != key[i] & mask:
+                return False
+    return True
+
+
+class FlowTable(object):
+    """
+    An OpenFlow 1.0 flow table: the highest priority entry matching a
+    packet wins. Entries are hashed per set of wildcards, so a lookup costs
+    one dict probe per distinct wildcard set rather than a scan.
+    """
+
+    def __init__(self):
+        self._masks = {}
+        self._deadlines = []  # heap of (deadline, sequence, entry)
+        self._sequence = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for mask in list(self._masks.values()):
+            for entries in list(mask.flows.values()):
+                for entry in entries:
+                    yield entry
+
+    def lookup(self, key):
+        best = None
+        for mask in self._masks.values():
+            entries = mask.flows.get(mask.project(key))
+            if entries is not None and (best is None or entries[0].rank > best.rank):
+                best = entries[0]
+        return best
+
+    def add(self, entry):
+        """
+        Adds an entry, replacing one with the same match and priority.
+        """
+        mask = self._masks.get(entry.wildcards)
+        if mask is None:
+            mask = self._masks[entry.wildcards] = _Mask(entry.wildcards)
+        entry.mask = mask
+        entry.projected = mask.project(entry.key)
+        entries = mask.flows.setdefault(entry.projected, [])
+        for i, other in enumerate(entries):
+            if other.priority == entry.priority:
+                other.removed = True
+                entries[i] = entry
+                break
+        else:
+            entries.append(entry)
+            entries.sort(key=lambda e: -e.rank)
+            self.count += 1
+        if entry.idle_timeout or entry.hard_timeout:
+            self._sequence += 1
+            heapq.heappush(self._deadlines, (entry.deadline(), self._sequence, entry))
+
+    def remove(self, entry):
+        entries = entry.mask.flows.get(entry.projected)
+        if entries is None or entry not in entries:
+            return
+        entries.remove(entry)
+        if not entries:
+            del entry.mask.flows[entry.projected]
+            if not entry.mask.flows:
+                del self._masks[entry.wildcards]
+        entry.removed = True
+        self.count -= 1
+
+    def select(self, wildcards, key, priority=None, strict=False, out_port=OFPP_NONE):
+        """
+        The entries a MODIFY or DELETE flow_mod with this match applies to.
+        """
+        if strict:
+            mask = self._masks.get(wildcards)
+            if mask is None:
+                return []
+            selected = [e for e in mask.flows.get(mask.project(key), ()) if e.priority == priority]
+        else:
+            selected = [e for e in self if covers(wildcards, key, e)]
+        if out_port != OFPP_NONE:
+            selected = [e for e in selected if out_port in e.actions]
+        return selected
+
+    def expire(self, now):
+        """
+        Removes the entries whose timeouts ran out; returns [(entry, reason)].
+        """
+        expired = []
+        heap = self._deadlines
+        while heap and heap[0][0] <= now:
+            deadline, sequence, entry = heapq.heappop(heap)
+            if entry.removed:
+                continue
+            deadline = entry.deadline()
+            if deadline > now:
+                heapq.heappush(heap, (deadline, sequence, entry))
+                continue
+            hard = entry.hard_timeout and entry.installed + entry.hard_timeout <= now
+            self.remove(entry)
+            expired.append((entry, OFPRR_HARD_TIMEOUT if hard else OFPRR_IDLE_TIMEOUT))
+        return expired
+
+
+class Network(object):
+    """
+    switches switches wired as a tree of the given fanout, with hosts
+    hosts on ports 1..hosts of every switch; link ports follow, the uplink
+    first.
+    """
+
+    def __init__(self, switches, hosts, fanout=4):
+        self.switches = switches
+        self.hosts_per_switch = hosts
+        self.host_count = switches * hosts
+        self.links = dict((dpid, {}) for dpid in range(1, switches + 1))
+        self.peers = {}  # (dpid, port) -> (neighbour dpid, neighbour port)
+        next_port = dict((dpid, hosts + 1) for dpid in range(1, switches + 1))
+        for dpid in range(2, switches + 1):
+            parent = (dpid - 2) // fanout + 1
+            up, down = next_port[dpid], next_port[parent]
+            next_port[dpid] += 1
+            next_port[parent] += 1
+            self.links[dpid][parent] = up
+            self.links[parent][dpid] = down
+            self.peers[dpid, up] = (parent, down)
+            self.peers[parent, down] = (dpid, up)
+        self.ports = dict((dpid, next_port[dpid] - 1) for dpid in next_port)
+
+    def locate(self, number):
+        """
+        The (dpid, port) host number number hangs off.
+        """
+        return (number - 1) // self.hosts_per_switch + 1, (number - 1) % self.hosts_per_switch + 1
+
+    def number(self, host):
+        """
+        The number of a host given by number or MAC.
+        """
+        if isinstance(host, int):
+            return host
+        return int(host.replace(':', '').replace('-', ''), 16) & 0xffffffff
+
+    def host_locations(self):
+        """
+        MAC -> (dpid, port) of every host, in the format of the controllers'
+        hosts tables.
+        """
+        return dict((mac_str(host_mac(n)), self.locate(n)) for n in range(1, self.host_count + 1))
+
+    def host_ips(self):
+        return dict((ip_str(host_ip(n)), mac_str(host_mac(n))) for n in range(1, self.host_count + 1))
+
+
+def random_demands(network, pairs, tcp_ports=(80, 443, 5001), seed=1):
+    """
+    pairs demands between random hosts, of rate 1, most to a TCP port.
+    """
+    rng = random.Random(seed)
+    n = network.host_count
+    demands = []
+    for _ in range(pairs):
+        src = rng.randint(1, n)
+        dst = rng.randint(1, n - 1)
+        if dst >= src:
+            dst += 1
+        demand = {'src': src, 'dst': dst, 'rate': 1.0}
+        if rng.random() < 0.8:
+            demand['TCPPort'] = rng.choice(tcp_ports)
+        demands.append(demand)
+    return demands
+
+
+def load_matrix(path, network):
+    """
+    Reads the demands of a traffic matrix file, with hosts as numbers.
+    """
+    with open(path) as f:
+        matrix = json.load(f)
+    demands = matrix['demands'] if isinstance(matrix, dict) else matrix
+    result = []
+    for demand in demands:
+        demand = dict(demand)
+        demand['src'] = network.number(demand['src'])
+        demand['dst'] = network.number(demand['dst'])
+        for host in (demand['src'], demand['dst']):
+            if not 1 <= host <= network.host_count:
+                raise ValueError("Host %d is not in the emulated network" % host)
+        demand.setdefault('rate', 1.0)
+        result.append(demand)
+    return result
+
+
+def demand_rules(demands):
+    """
+    A forwarding rule for every host pair (and TCP port) of the demands, in
+    the format of the controllers' rules tables.
+    """
+    rules = []
+    seen = set()
+    for demand in demands:
+        key = (demand['src'], demand['dst'], demand.get('TCPPort'))
+        if key in seen:
+            continue
+        seen.add(key)
+        rule = {'EthSrc': mac_str(host_mac(demand['src'])), 'EthDst': mac_str(host_mac(demand['dst']))}
+        if demand.get('TCPPort') is not None:
+            rule['TCPPort'] = demand['TCPPort']
+        rule['queue'] = 0
+        rule['drop'] = False
+        rules.append(rule)
+    return rules
+
+
+class SimSwitch(asyncio.Protocol):
+    """
+    One emulated datapath and its OpenFlow connection.
+    """
+
+    def __init__(self, sim, dpid):
+        self.sim = sim
+        self.dpid = dpid
+        self.table = FlowTable()
+        self.host_ports = sim.network.hosts_per_switch
+        self.link_ports = sorted(sim.network.links[dpid].values())
+        self.miss_send_len = DEFAULT_MISS_SEND_LEN
+        self.buffers = OrderedDict()  # buffer_id -> (in_port, frame), oldest first
+        self._next_buffer = 0
+        self.transport = None
+        self.connected = None
+        self._buffer = bytearray()
+        self._out = []
+        self._xid = 0
+        self._echoes = {}
+        self._waiting = {}  # (dl_src, dl_dst) -> [(key, PacketIn time)]
+
+    # -- OpenFlow connection --
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send(header(OFPT_HELLO))
+
+    def connection_lost(self, exc):
+        self.transport = None
+        if self.connected is not None and not self.connected.done():
+            self.connected.set_exception(ConnectionError("switch %d lost its connection" % self.dpid))
+
+    def _send(self, data):
+        if self.transport is None:
+            return
+        if not self._out:
+            asyncio.get_event_loop().call_soon(self._flush)
+        self._out.append(data)
+
+    def _flush(self):
+        out, self._out = self._out, []
+        if self.transport is not None and out:
+            self.transport.write(b''.join(out))
+
+    def _next_xid(self):
+        self._xid += 1
+        return self._xid
+
+    def echo(self):
+        """
+        Returns a future done once the controller answered an echo request,
+        and so has seen everything the switch sent before it.
+        """
+        xid = self._next_xid()
+        waiter = self._echoes[xid] = asyncio.get_event_loop().create_future()
+        self._send(header(OFPT_ECHO_REQUEST, xid=xid))
+        return waiter
+
+    def data_received(self, data):
+        self.sim.bytes_received += len(data)
+        buf = self._buffer
+        buf += data
+        offset = 0
+        end = len(buf)
+        while end - offset >= 8:
+            version, msg_type, length, xid = _HEADER.unpack_from(buf, offset)
+            if end - offset < length:
+                break
+            self._dispatch(msg_type, xid, bytes(buf[offset:offset + length]))
+            offset += length
+        if offset:
+            del buf[:offset]
+
+    def _dispatch(self, msg_type, xid, raw):
+        sim = self.sim
+        if msg_type == OFPT_FLOW_MOD:
+            sim.flow_mods += 1
+            self._flow_mod(raw)
+        elif msg_type == OFPT_PACKET_OUT:
+            sim.packet_outs += 1
+            self._packet_out(raw)
+        elif msg_type == OFPT_ECHO_REQUEST:
+            self._send(header(OFPT_ECHO_REPLY, len(raw), xid) + raw[8:])
+        elif msg_type == OFPT_ECHO_REPLY:
+            waiter = self._echoes.pop(xid, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(True)
+        elif msg_type == OFPT_FEATURES_REQUEST:
+            self._features_reply(xid)
+        elif msg_type == OFPT_BARRIER_REQUEST:
+            self._send(header(OFPT_BARRIER_REPLY, xid=xid))
+        elif msg_type == OFPT_SET_CONFIG:
+            flags, self.miss_send_len = _SET_CONFIG.unpack_from(raw, 8)
+        elif msg_type == OFPT_STATS_REQUEST:
+            self._stats_reply(xid, raw)
+
+    def _features_reply(self, xid):
+        ports = b''.join(
+            _PHY_PORT.pack(port, struct.pack('!HI', self.dpid, port), b's%d-eth%d' % (self.dpid, port),
+                           0, 0, 0, 0, 0, 0)
+            for port in range(1, self.sim.network.ports[self.dpid] + 1))
+        body = struct.pack('!QIB3xII', self.dpid, self.sim.buffers, 1, 0, 0xfff) + ports
+        self._send(header(OFPT_FEATURES_REPLY, 8 + len(body), xid) + body)
+        # connected once the controller has handled the reply
+        self.echo().add_done_callback(lambda f: self.connected.set_result(True))
+
+    # -- the flow table --
+
+    def _flow_mod(self, raw):
+        match = raw[8:48]
+        cookie, command, idle_timeout, hard_timeout, priority, buffer_id, out_port, flags = \
+            _FLOW_MOD.unpack_from(raw, 48)
+        now = self.sim.clock()
+        if command in (OFPFC_DELETE, OFPFC_DELETE_STRICT):
+            fields = _MATCH.unpack(match)
+            for entry in self.table.select(fields[0], fields[1:], priority,
+                                           command == OFPFC_DELETE_STRICT, out_port):
+                self.table.remove(entry)
+                if entry.flags & OFPFF_SEND_FLOW_REM:
+                    self._flow_removed(entry, OFPRR_DELETE, now)
+            return
+        if command in (OFPFC_MODIFY, OFPFC_MODIFY_STRICT):
+            fields = _MATCH.unpack(match)
+            entries = self.table.select(fields[0], fields[1:], priority,
+                                        command == OFPFC_MODIFY_STRICT)
+            if entries:
+                for entry in entries:
+                    entry.raw_actions = raw[72:]
+                    entry.actions = parse_actions(entry.raw_actions)
+                if buffer_id != NO_BUFFER:
+                    self._release(buffer_id, entries[0].actions)
+                return
+        entry = FlowEntry(match, cookie, priority, idle_timeout, hard_timeout, flags, raw[72:], now)
+        self.table.add(entry)
+        self.sim.installs += 1
+        self._answered(entry, now)
+        if buffer_id != NO_BUFFER:
+            self._release(buffer_id, entry.actions)
+
+    def _answered(self, entry, now):
+        """
+        Records the setup latency of the PacketIns waiting for a flow the
+        new entry covers.
+        """
+        if not self._waiting:
+            return
+        if entry.wildcards & _DL_PAIR:
+            pairs = list(self._waiting)
+        else:
+            pairs = [(entry.key[1], entry.key[2])]
+        for pair in pairs:
+            waiting = self._waiting.get(pair)
+            if not waiting:
+                continue
+            left = []
+            for key, sent in waiting:
+                if entry.matches(key):
+                    self.sim.setup(now - sent)
+                else:
+                    left.append((key, sent))
+            if left:
+                self._waiting[pair] = left
+            else:
+                del self._waiting[pair]
+
+    def expire(self, now):
+        for entry, reason in self.table.expire(now):
+            self.sim.expired += 1
+            if entry.flags & OFPFF_SEND_FLOW_REM:
+                self._flow_removed(entry, reason, now)
+
+    def _flow_removed(self, entry, reason, now):
+        duration = now - entry.installed
+        body = entry.match + _FLOW_REMOVED.pack(
+            entry.cookie, entry.priority, reason, int(duration), int(duration % 1 * 1e9),
+            entry.idle_timeout, entry.packets, entry.bytes)
+        self._send(header(OFPT_FLOW_REMOVED, 8 + len(body), self._next_xid()) + body)
+        self.sim.flows_removed += 1
+
+    def _stats_reply(self, xid, raw):
+        stats_type = _STATS.unpack_from(raw, 8)[0]
+        parts = []
+        if stats_type == OFPST_FLOW:
+            fields = _MATCH.unpack_from(raw, 12)
+            out_port = struct.unpack_from('!H', raw, 54)[0]
+            now = self.sim.clock()
+            chunk = []
+            size = 0
+            for entry in self.table.select(fields[0], fields[1:], out_port=out_port):
+                duration = now - entry.installed
+                stat = _FLOW_STATS.pack(
+                    _FLOW_STATS.size + len(entry.raw_actions), 0, entry.match, int(duration),
+                    int(duration % 1 * 1e9), entry.priority, entry.idle_timeout,
+                    entry.hard_timeout, entry.cookie, entry.packets, entry.bytes) + entry.raw_actions
+                if size + len(stat) > STATS_CHUNK:
+                    parts.append(chunk)
+                    chunk, size = [], 0
+                chunk.append(stat)
+                size += len(stat)
+            parts.append(chunk)
+        else:
+            parts.append([])
+        for n, chunk in enumerate(parts):
+            flags = OFPSF_REPLY_MORE if n < len(parts) - 1 else 0
+            body = _STATS.pack(stats_type, flags) + b''.join(chunk)
+            self._send(header(OFPT_STATS_REPLY, 8 + len(body), xid) + body)
+
+    # -- forwarding --
+
+    def receive(self, in_port, frame, fields, hops=0):
+        """
+        A packet arriving on in_port: forwarded by the matching flow, or
+        sent to the controller.
+        """
+        key = (in_port,) + fields
+        entry = self.table.lookup(key)
+        if entry is None:
+            self._packet_in(in_port, frame, key, OFPR_NO_MATCH)
+            return
+        entry.used = self.sim.clock()
+        entry.packets += 1
+        entry.bytes += len(frame)
+        self.sim.hits += 1
+        self.output(entry.actions, in_port, frame, fields, hops)
+
+    def _packet_in(self, in_port, frame, key, reason):
+        buffer_id = NO_BUFFER
+        if reason != OFPR_NO_MATCH:
+            data = frame[:self.miss_send_len]
+        elif self.sim.buffers:
+            buffer_id = self._buffer_packet(in_port, frame)
+            data = frame[:self.miss_send_len]
+        else:
+            data = frame
+        body = _PACKET_IN.pack(buffer_id, len(frame), in_port, reason) + data
+        self._send(header(OFPT_PACKET_IN, 8 + len(body), self._next_xid()) + body)
+        self.sim.packet_ins += 1
+        self.sim.packet_in_bytes += 8 + len(body)
+        if reason == OFPR_NO_MATCH:
+            self._waiting.setdefault((key[1], key[2]), []).append((key, self.sim.clock()))
+
+    def _packet_out(self, raw):
+        buffer_id, in_port, actions_len = _PACKET_OUT.unpack_from(raw, 8)
+        actions = parse_actions(raw[16:16 + actions_len])
+        if buffer_id != NO_BUFFER:
+            self._release(buffer_id, actions, in_port)
+            return
+        frame = raw[16 + actions_len:]
+        if len(frame) < 14:
+            return
+        self.output(actions, in_port, frame, packet_fields(frame), 0)
+
+    def _buffer_packet(self, in_port, frame):
+        """
+        Keeps a table miss in a packet buffer, reusing the oldest one if
+        they are all taken, and returns its buffer_id.
+        """
+        if len(self.buffers) >= self.sim.buffers:
+            self.buffers.popitem(last=False)
+            self.sim.buffers_reused += 1
+        buffer_id = self._next_buffer
+        self._next_buffer = (buffer_id + 1) & 0x7fffffff
+        self.buffers[buffer_id] = (in_port, frame)
+        return buffer_id
+
+    def _release(self, buffer_id, actions, in_port=None):
+        """
+        Applies actions to the packet in a buffer, freeing it; in_port
+        defaults to the one the packet came in on.
+        """
+        packet = self.buffers.pop(buffer_id, None)
+        if packet is None:
+            self.sim.unknown_buffers += 1
+            return
+        if in_port is None:
+            in_port = packet[0]
+        frame = packet[1]
+        self.output(actions, in_port, frame, packet_fields(frame), 0)
+
+    def output(self, ports, in_port, frame, fields, hops):
+        network = self.sim.network
+        for port in ports:
+            if port == OFPP_FLOOD or port == OFPP_ALL:
+                self.sim.delivered += self.host_ports - (1 <= in_port <= self.host_ports)
+                targets = [p for p in self.link_ports if p != in_port]
+            elif port == OFPP_IN_PORT:
+                targets = [in_port]
+            elif port == OFPP_CONTROLLER:
+                self._packet_in(in_port, frame, (in_port,) + fields, OFPR_ACTION)
+                continue
+            elif port == OFPP_TABLE:
+                self.receive(in_port, frame, fields, hops)
+                continue
+            else:
+                targets = [port]
+            for target in targets:
+                peer = network.peers.get((self.dpid, target))
+                if peer is None:
+                    if 1 <= target <= self.host_ports:
+                        self.sim.delivered += 1
+                elif hops < MAX_HOPS:
+                    self.sim.switches[peer[0]].receive(peer[1], frame, fields, hops + 1)
+                else:
+                    self.sim.loops += 1
+
+    def unanswered(self):
+        return sum(len(waiting) for waiting in self._waiting.values())
+
+
+class Simulation(object):
+    """
+    A Network of SimSwitches, the traffic they are offered and what they
+    measured.
+    """
+
+    def __init__(self, network, demands, seed=3, buffers=0):
+        self.network = network
+        self.demands = demands
+        self.buffers = buffers
+        self.clock = asyncio.get_event_loop().time
+        self.switches = dict((dpid, SimSwitch(self, dpid)) for dpid in range(1, network.switches + 1))
+        self._rng = random.Random(seed)
+        self.arrivals = self.hits = self.packet_ins = self.packet_outs = 0
+        self.flow_mods = self.installs = self.setups = 0
+        self.expired = self.flows_removed = self.delivered = self.loops = 0
+        self.packet_in_bytes = self.bytes_received = 0
+        self.buffers_reused = self.unknown_buffers = 0
+        self.latencies = []
+        self.samples = []
+
+    def setup(self, latency):
+        self.setups += 1
+        self.latencies.append(latency)
+
+    async def connect(self, host, port):
+        loop = asyncio.get_event_loop()
+        for switch in self.switches.values():
+            switch.connected = loop.create_future()
+            await loop.create_connection(lambda switch=switch: switch, host, port)
+        await asyncio.gather(*[s.connected for s in self.switches.values()])
+
+    def inject(self, demand):
+        """
+        Starts a new connection of a demand: its first packet enters the
+        source host's switch.
+        """
+        src, dst = demand['src'], demand['dst']
+        if demand.get('TCPPort') is not None:
+            frame = tcp_syn(src, dst, self._rng.randrange(1024, 65536), demand['TCPPort'])
+        else:
+            frame = icmp_echo(src, dst, self._rng.randrange(65536))
+        dpid, port = self.network.locate(src)
+        self.arrivals += 1
+        self.switches[dpid].receive(port, frame, packet_fields(frame))
+
+    async def run(self, rate, duration, interval=1.0, tick=0.01):
+        """
+        Offers rate new connections per second for duration seconds, picked
+        from the demands by their rates, and samples the counters every
+        interval seconds. Ends once the controller has caught up.
+        """
+        weights = []
+        total = 0.0
+        for demand in self.demands:
+            total += demand['rate']
+            weights.append(total)
+        start = self.clock()
+        started = 0
+        next_sample = interval
+        previous = self._counters()
+        self.samples = []
+        while True:
+            now = self.clock() - start
+            due = int(min(now, duration) * rate)
+            for demand in self._rng.choices(self.demands, cum_weights=weights, k=due - started):
+                self.inject(demand)
+            started = due
+            for switch in self.switches.values():
+                switch.expire(self.clock())
+            if now >= next_sample:
+                previous = self._sample(next_sample, interval, previous)
+                next_sample += interval
+            if now >= duration:
+                break
+            await asyncio.sleep(tick)
+        await asyncio.gather(*[s.echo() for s in self.switches.values()])
+        self.elapsed = self.clock() - start
+
+    def _counters(self):
+        return (self.arrivals, self.packet_ins, self.setups)
+
+    def _sample(self, t, interval, previous):
+        counters = self._counters()
+        sizes = [len(s.table) for s in self.switches.values()]
+        self.samples.append({
+            't': t,
+            'arrivals_per_sec': (counters[0] - previous[0]) / interval,
+            'packet_ins_per_sec': (counters[1] - previous[1]) / interval,
+            'setups_per_sec': (counters[2] - previous[2]) / interval,
+            'flows': sum(sizes),
+            'max_flows_per_switch': max(sizes),
+        })
+        return counters
+
+    async def close(self):
+        for switch in self.switches.values():
+            if switch.transport is not None:
+                switch.transport.close()
+        await asyncio.sleep(0)
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        return {
+            'switches': self.network.switches,
+            'hosts': self.network.host_count,
+            'demands': len(self.demands),
+            'seconds': self.elapsed,
+            'arrivals': self.arrivals,
+            'table_hits': self.hits,
+            'packet_ins': self.packet_ins,
+            'flow_mods': self.flow_mods,
+            'packet_outs': self.packet_outs,
+            'buffers': self.buffers,
+            'packet_in_bytes': self.packet_in_bytes,
+            'bytes_received': self.bytes_received,
+            'buffers_reused': self.buffers_reused,
+            'unknown_buffers': self.unknown_buffers,
+            'flow_setups': self.setups,
+            'setups_per_sec': self.setups / self.elapsed if self.elapsed else 0.0,
+            'unanswered': sum(s.unanswered() for s in self.switches.values()),
+            'flows_expired': self.expired,
+            'flows_removed_sent': self.flows_removed,
+            'delivered': self.delivered,
+            'loops': self.loops,
+            'setup_p50_ms': percentile(latencies, 0.50) * 1e3,
+            'setup_p90_ms': percentile(latencies, 0.90) * 1e3,
+            'setup_p99_ms': percentile(latencies, 0.99) * 1e3,
+            'setup_max_ms': latencies[-1] * 1e3 if latencies else 0.0,
+            'flows': sum(len(s.table) for s in self.switches.values()),
+            'occupancy': self.samples,
+        }
+
+
+def print_report(name, report):
+    print('%s: %d switches, %d hosts, %d demands, %.1f s' % (
+        name, report['switches'], report['hosts'], report['demands'], report['seconds']))
+    print('  %d connections: %d table hits, %d PacketIns, %d flow_mods, %d packet_outs' % (
+        report['arrivals'], report['table_hits'], report['packet_ins'], report['flow_mods'],
+        report['packet_outs']))
+    print('  %d flow setups (%.0f/s), %d PacketIns never got a flow; %d flows expired' % (
+        report['flow_setups'], report['setups_per_sec'], report['unanswered'], report['flows_expired']))
+    packet_ins = report['packet_ins'] or 1
+    print('  %.1f bytes to the controller and %.1f back per PacketIn (%d packet buffers per switch, '
+          '%d reused while full, %d unknown buffer_ids)' % (
+              float(report['packet_in_bytes']) / packet_ins, float(report['bytes_received']) / packet_ins,
+              report['buffers'], report['buffers_reused'], report['unknown_buffers']))
+    print('  PacketIn -> flow_mod: p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+        report['setup_p50_ms'], report['setup_p90_ms'], report['setup_p99_ms'], report['setup_max_ms']))
+    print('  %6s %10s %10s %10s %10s %10s' % ('t', 'conn/s', 'pktin/s', 'setups/s', 'flows', 'max/switch'))
+    for sample in report['occupancy']:
+        print('  %6.1f %10.0f %10.0f %10.0f %10d %10d' % (
+            sample['t'], sample['arrivals_per_sec'], sample['packet_ins_per_sec'],
+            sample['setups_per_sec'], sample['flows'], sample['max_flows_per_switch']))
+
+
+async def simulate(network, demands, rate, duration, interval, controller=None,
+                   launch_args=None, connect=None, buffers=0):
+    """
+    Runs one simulation, against controller in-process or against the
+    controller listening at connect ((host, port)). Returns the report.
+    """
+    sim = Simulation(network, demands, buffers=buffers)
+    server = None
+    if connect is None:
+        from sdnlib import aioflow
+
+        rules = demand_rules(demands)
+
+        def prepare(module):
+            module.rules = rules
+            module.hosts = network.host_locations()
+            module.host_ips = network.host_ips()
+            if hasattr(module, 'links'):
+                module.links = network.links
+
+        nexus, module = aioflow.setup(controller, launch_args, prepare)
+        server = await asyncio.get_event_loop().create_server(
+            lambda: aioflow.OpenFlowProtocol(nexus), '127.0.0.1', 0)
+        connect = ('127.0.0.1', server.sockets[0].getsockname()[1])
+    try:
+        await sim.connect(*connect)
+        await sim.run(rate, duration, interval)
+    finally:
+        await sim.close()
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+    return sim.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scale-test the controllers on emulated switches")
+    parser.add_argument('--pox', default=os.environ.get('POX_HOME'),
+                        help='path of the POX checkout (default: $POX_HOME)')
+    parser.add_argument('--controllers', default=','.join(sorted(CONTROLLERS)))
+    parser.add_argument('--connect', help='host:port of a running controller to use instead')
+    parser.add_argument('--switches', type=int, default=16)
+    parser.add_argument('--hosts', type=int, default=64, help='hosts per switch')
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--matrix', help='JSON traffic matrix (default: --pairs random demands)')
+    parser.add_argument('--pairs', type=int, default=2000)
+    parser.add_argument('--rate', type=float,
+                        help='new connections per second (default: the sum of the demand rates)')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=1, help='seconds between samples')
+    parser.add_argument('--buffers', type=int, default=0,
+                        help='packet buffers per switch (default: 0, PacketIns carry whole frames)')
+    parser.add_argument('--write-rules', help='write the rules table of the demands to this file')
+    parser.add_argument('--no-uvloop', action='store_true')
+    parser.add_argument('--json', action='store_true', help='print the reports as JSON')
+    args, extra = parser.parse_known_args(argv)
+
+    if not args.connect:
+        # the controllers run in-process: POX's core first, as pox.py does
+        init_pox(args.pox)
+    launch_args = _launch_args(extra)
+
+    network = Network(args.switches, args.hosts, args.fanout)
+    if args.matrix:
+        demands = load_matrix(args.matrix, network)
+    else:
+        demands = random_demands(network, args.pairs)
+    rate = args.rate or sum(demand['rate'] for demand in demands)
+    if args.write_rules:
+        with open(args.write_rules, 'w') as f:
+            json.dump(demand_rules(demands), f, indent=1)
+
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+        runs = [(args.connect, None, (host, int(port)))]
+    else:
+        runs = [(name, name, None) for name in args.controllers.split(',')]
+
+    reports = {}
+    for name, controller, connect in runs:
+        loop = new_event_loop(not args.no_uvloop)
+        asyncio.set_event_loop(loop)
+        try:
+            reports[name] = loop.run_until_complete(simulate(
+                network, demands, rate, args.duration, args.interval, controller, launch_args,
+                connect, args.buffers))
+        finally:
+            loop.close()
+        if not args.json:
+            print_report(name, reports[name])
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""
+Flow, port and queue rates polled from the switches.
+
+Whether the 30/150/200 Mb/s queue caps hold used to show only in the
+one-off iperf output of the topology scripts. StatsPoller asks every
+connected switch for its flow, port and queue statistics every interval
+seconds and turns the byte counters of consecutive replies into rates, in
+bit/s: per flow, per port and direction, and per queue.
+
+The polls are spread out. A switch is first polled at a random point of
+the interval after it connects, and from then on every interval seconds
+give or take jitter (a fraction of it), so switches that connected
+together drift apart rather than into step. The poller wakes ten times
+per interval and sends at most batch switches their requests each time;
+the three requests of a switch go out in one write.
+
+Every series of rates is a RateSeries: a fixed-size ring of (time, bit/s)
+samples kept in two arrays, so memory is bounded by the number of series.
+The series of a flow, port or queue missing from its switch's latest reply
+are dropped, as are those of a switch that disconnects, and past
+max_series no new ones are started. Queries:
+
+    poller.queue_rates()       {(dpid, port, queue_id): bit/s}
+    poller.port_rates()        {(dpid, port): (rx bit/s, tx bit/s)}
+    poller.flow_rates()        {(dpid, match key, in_port, priority): bit/s}
+    poller.heavy_hitters(10)   [(bit/s, dpid, match key, in_port, priority), ...]
+    poller.over_cap(caps)      [(dpid, port, queue_id, bit/s, cap), ...]
+    poller.series(kind, key)   [(time, bit/s), ...], oldest first
+
+queue_caps() reads the caps from a network spec (see sdnlib.netspec); a
+poller given caps logs the queues that go above them.
+"""
+import heapq
+import random
+import time
+from array import array
+
+from pox.core import core
+from pox.lib.recoco import Timer
+from pox.lib.util import dpidToStr
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.flowcache import match_key
+from sdnlib.sendbuf import buffer_for
+
+log = core.getLogger()
+
+# Kinds of series, as series() takes them
+FLOW = 'flow'
+PORT_RX = 'port_rx'
+PORT_TX = 'port_tx'
+QUEUE = 'queue'
+
+
+class RateSeries(object):
+    """
+    The rates between consecutive readings of a byte counter, in a ring of
+    the last capacity samples.
+    """
+    __slots__ = ('times', 'rates', 'count', 'last_time', 'last_bytes')
+
+    def __init__(self, capacity):
+        self.times = array('d', bytes(8 * capacity))
+        self.rates = array('d', bytes(8 * capacity))
+        self.count = 0
+        self.last_time = None
+        self.last_bytes = 0
+
+    def update(self, now, byte_count):
+        """
+        Takes a reading of the counter at time now. A counter that went
+        backwards (a flow replaced, a port reset) only starts over.
+        """
+        last_time = self.last_time
+        if last_time is not None and now > last_time and byte_count >= self.last_bytes:
+            i = self.count % len(self.rates)
+            self.times[i] = now
+            self.rates[i] = (byte_count - self.last_bytes) * 8 / (now - last_time)
+            self.count += 1
+        self.last_time = now
+        self.last_bytes = byte_count
+
+    def __len__(self):
+        return min(self.count, len(self.rates))
+
+    def rate(self, samples=1):
+        """
+        The mean of the last samples rates, or None before the second
+        reading.
+        """
+        n = min(samples, len(self))
+        if not n:
+            return None
+        size = len(self.rates)
+        return sum(self.rates[(self.count - k) % size] for k in range(1, n + 1)) / n
+
+    def samples(self):
+        """
+        Returns [(time, bit/s)], oldest first.
+        """
+        size = len(self.rates)
+        return [(self.times[k % size], self.rates[k % size])
+                for k in range(self.count - len(self), self.count)]
+
+
+def queue_caps(spec):
+    """
+    Returns {(dpid, port, queue_id): max bit/s} of the queues of a network
+    spec (as sdnlib.netspec.load_spec() returns it). Ports are named the
+    Mininet way, s<dpid>-eth<port>; uncapped queues are left out.
+    """
+    from sdnlib.qos import UNCAPPED_RATE
+
+    caps = {}
+    for name, queues in spec.get('qos', {}).items():
+        switch, port = name.split('-eth')
+        for queue_id, queue in enumerate(queues):
+            rate = queue.get('max_rate')
+            if rate is not None and rate < UNCAPPED_RATE:
+                caps[(int(switch.lstrip('s')), int(port), queue_id)] = rate
+    return caps
+
+
+class StatsPoller(object):
+    """
+    Polls the flow, port and queue statistics of every connected switch
+    and keeps their rates.
+
+    caps ({(dpid, port, queue_id): bit/s}) are checked against every queue
+    stats reply, averaged over cap_samples polls; a queue is logged when it
+    goes above its cap, and again when it is back under it.
+    """
+
+    def __init__(self, interval=10, jitter=0.1, batch=50, capacity=60, max_series=100000,
+                 caps=None, cap_samples=3, clock=time.time, rng=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.batch = batch
+        self.capacity = capacity
+        self.max_series = max_series
+        self.caps = caps or {}
+        self.cap_samples = cap_samples
+        self.over = set()  # (dpid, port, queue_id) of the queues above their cap
+        self._clock = clock
+        self._rng = rng or random.Random()
+        self._due = {}    # dpid -> when it is polled next
+        self._queue = []  # heap of (due, dpid); entries not matching _due are stale
+        self._tables = {FLOW: {}, PORT_RX: {}, PORT_TX: {}, QUEUE: {}}  # kind -> dpid -> key -> RateSeries
+        self.series_count = 0
+        self.dropped = 0
+        self.polls = 0
+        self.replies = 0
+
+    def start(self):
+        """
+        Registers for the connection and stats events and polls from now
+        on; returns the Timer.
+        """
+        for name in ('ConnectionUp', 'ConnectionDown', 'FlowStatsReceived',
+                     'PortStatsReceived', 'QueueStatsReceived'):
+            core.openflow.addListenerByName(name, getattr(self, '_handle_' + name))
+        return Timer(self.interval / 10.0, self.poll, recurring=True)
+
+    def schedule(self, dpid, first=False):
+        """
+        Sets when switch dpid is polled next: at a random point of the next
+        interval if first, else an interval from now, give or take jitter.
+        """
+        if first:
+            delay = self.interval * self._rng.random()
+        else:
+            delay = self.interval * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        due = self._due[dpid] = self._clock() + delay
+        heapq.heappush(self._queue, (due, dpid))
+
+    def poll(self):
+        """
+        Sends the stats requests of the switches that are due, at most
+        batch of them; the others wait for the next call.
+        """
+        now = self._clock()
+        queue = self._queue
+        sent = 0
+        while queue and queue[0][0] <= now and sent < self.batch:
+            due, dpid = heapq.heappop(queue)
+            if self._due.get(dpid) != due:
+                continue
+            connection = core.openflow.getConnection(dpid)
+            if connection is None:
+                self.forget(dpid)
+                continue
+            out = buffer_for(connection)
+            out.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+            out.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+            out.send(of.ofp_stats_request(body=of.ofp_queue_stats_request()))
+            self.polls += 1
+            sent += 1
+            self.schedule(dpid)
+        return True
+
+    def forget(self, dpid):
+        """
+        Stops polling switch dpid and drops its series.
+        """
+        self._due.pop(dpid, None)
+        self.over = set(key for key in self.over if key[0] != dpid)
+        for table in self._tables.values():
+            self.series_count -= len(table.pop(dpid, ()))
+
+    def _update(self, kind, dpid, counters, now):
+        """
+        Feeds (key, byte count) readings of one reply to the series of
+        switch dpid, replacing those of the previous reply.
+        """
+        table = self._tables[kind]
+        old = table.get(dpid, {})
+        new = {}
+        created = 0
+        for key, byte_count in counters:
+            series = old.get(key)
+            if series is None:
+                if self.series_count + created >= self.max_series:
+                    self.dropped += 1
+                    continue
+                series = RateSeries(self.capacity)
+                created += 1
+            series.update(now, byte_count)
+            new[key] = series
+        table[dpid] = new
+        self.series_count += len(new) - len(old)
+
+    def _handle_ConnectionUp(self, event):
+        self.schedule(event.dpid, first=True)
+
+    def _handle_ConnectionDown(self, event):
+        self.forget(event.dpid)
+
+    def _handle_FlowStatsReceived(self, event):
+        # The flow stats requests (ours, and the snapshot's after a restart)
+        # all ask for the whole table, so flows missing here are gone. The
+        # match key leaves out in_port, which tells apart flows such as the
+        # admission block flows of one host on different ports
+        self.replies += 1
+        self._update(FLOW, event.connection.dpid,
+                     (((match_key(stat.match), stat.match.in_port, stat.priority), stat.byte_count)
+                      for stat in event.stats), self._clock())
+
+    def _handle_PortStatsReceived(self, event):
+        self.replies += 1
+        dpid = event.connection.dpid
+        now = self._clock()
+        self._update(PORT_RX, dpid, ((stat.port_no, stat.rx_bytes) for stat in event.stats), now)
+        self._update(PORT_TX, dpid, ((stat.port_no, stat.tx_bytes) for stat in event.stats), now)
+
+    def _handle_QueueStatsReceived(self, event):
+        self.replies += 1
+        dpid = event.connection.dpid
+        self._update(QUEUE, dpid, (((stat.port_no, stat.queue_id), stat.tx_bytes)
+                                   for stat in event.stats), self._clock())
+        if self.caps:
+            over = set()
+            for _, port, queue_id, rate, cap in self.over_cap(self.caps, dpid=dpid):
+                over.add((dpid, port, queue_id))
+                if (dpid, port, queue_id) not in self.over:
+                    log.warning("Queue %d of port %d on switch %s sends %.1f Mb/s, above its cap of %.1f Mb/s",
+                                queue_id, port, dpidToStr(dpid), rate / 1e6, cap / 1e6)
+            for key in [key for key in self.over if key[0] == dpid and key not in over]:
+                log.info("Queue %d of port %d on switch %s is back under its cap",
+                         key[2], key[1], dpidToStr(dpid))
+                self.over.discard(key)
+            self.over |= over
+
+    # -- queries --
+
+    def _rates(self, kind, samples, dpid=None):
+        """
+        Yields (dpid, key, bit/s) of every series of a kind with a rate.
+        """
+        table = self._tables[kind]
+        dpids = table if dpid is None else (dpid,) if dpid in table else ()
+        for switch in dpids:
+            for key, series in table[switch].items():
+                rate = series.rate(samples)
+                if rate is not None:
+                    yield switch, key, rate
+
+    def flow_rates(self, dpid=None, samples=1):
+        """
+        Returns {(dpid, match key, in_port, priority): bit/s}, averaged over the
+        last samples polls.
+        """
+        return dict(((switch,) + key, rate) for switch, key, rate in self._rates(FLOW, samples, dpid))
+
+    def port_rates(self, dpid=None, samples=1):
+        """
+        Returns {(dpid, port): (received bit/s, transmitted bit/s)}.
+        """
+        tx = dict(((switch, port), rate) for switch, port, rate in self._rates(PORT_TX, samples, dpid))
+        return dict(((switch, port), (rate, tx.get((switch, port))))
+                    for switch, port, rate in self._rates(PORT_RX, samples, dpid))
+
+    def queue_rates(self, dpid=None, samples=1):
+        """
+        Returns {(dpid, port, queue_id): transmitted bit/s}.
+        """
+        return dict(((switch,) + key, rate) for switch, key, rate in self._rates(QUEUE, samples, dpid))
+
+    def heavy_hitters(self, n=10, samples=1):
+        """
+        The n fastest flows, as [(bit/s, dpid, match key, in_port, priority)],
+        fastest first.
+        """
+        return heapq.nlargest(n, ((rate, switch) + key
+                                  for switch, key, rate in self._rates(FLOW, samples)))
+
+    def over_cap(self, caps, slack=0.05, samples=None, dpid=None):
+        """
+        The queues sending more than slack above their cap in caps
+        ({(dpid, port, queue_id): bit/s}), averaged over samples polls
+        (cap_samples by default), as [(dpid, port, queue_id, bit/s, cap)].
+        """
+        result = []
+        for key, rate in sorted(self.queue_rates(dpid, samples or self.cap_samples).items()):
+            cap = caps.get(key)
+            if cap is not None and rate > cap * (1 + slack):
+                result.append(key + (rate, cap))
+        return result
+
+    def series(self, kind, key):
+        """
+        The samples of one series, oldest first: kind is FLOW, PORT_RX,
+        PORT_TX or QUEUE, and key as the matching *_rates() returns it.
+        """
+        series = self._tables[kind].get(key[0], {}).get(key[1:] if len(key) > 2 else key[1])
+        return series.samples() if series is not None else []
+
+    def stats(self):
+        return {'switches': len(self._due), 'series': self.series_count,
+                'dropped': self.dropped, 'polls': self.polls, 'replies': self.replies}
@@ -0,0 +1,171 @@
+"""
+Pre-packed flow_mods and packet_outs for the PacketIn path.
+
+Answering a PacketIn with a rule used to mean building an ofp_flow_mod, its
+ofp_match and action objects and an ofp_packet_out from scratch, and
+packing them all again in send(). For a given rule and egress port the
+flow_mod is the same bytes every time except for its xid (and buffer_id and
+timeouts), and the packet_out only adds the frame to the same actions. A
+MessageTemplates cache packs each flow_mod once and patches the xid (and
+the rest) in at send time; packet_outs are assembled from the pre-packed actions.
+
+When the switch kept the packet in one of its buffers (and only sent the
+first miss_send_len bytes), the packet_out refers to the buffer rather
+than carrying the frame, and a new flow's flow_mod can take the buffer_id
+itself, so the switch applies the flow to the packet without a packet_out
+at all.
+
+Templates are filed under the MAC pair and the flow's actions, so they
+never go stale: a destination learned on another port selects another
+template. The controllers still drop the ones that can no longer be used
+-- those of a pair whose rules changed, or of a host that moved -- and the
+cache is emptied when it outgrows its capacity.
+"""
+import struct
+
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.flowcache import match_key
+
+NO_BUFFER = 0xffffffff
+
+# Offsets of the fields patched into a packed flow_mod: the xid in the
+# header, the idle and hard timeouts after the 40-byte match, cookie and
+# command, and the buffer_id after those and the priority.
+XID_OFFSET = 4
+FLOW_MOD_TIMEOUTS_OFFSET = 58
+FLOW_MOD_BUFFER_ID_OFFSET = 64
+
+_FIELD = struct.Struct('!I')
+_TIMEOUTS = struct.Struct('!HH')
+_PACKET_OUT = struct.Struct('!BBHIIHH')
+
+
+class FlowModTemplate(object):
+    """
+    A packed flow_mod, plus what the PacketIn path needs to know about it
+    without unpacking: its FlowCache match key and packed actions. Its
+    timeouts are not part of it; pack() is given them every time (see
+    sdnlib.timeouts).
+    """
+    __slots__ = ('data', 'key', 'actions')
+
+    def __init__(self, fm):
+        fm.xid = 0  # patched by pack()
+        self.data = fm.pack()
+        self.key = match_key(fm.match)
+        self.actions = b''.join(action.pack() for action in fm.actions)
+
+    def pack(self, buffer_id=None, timeouts=None):
+        """
+        The flow_mod with a fresh xid and, if given, the buffer_id of the
+        packet it is to be applied to and its (idle, hard) timeouts.
+        """
+        data = bytearray(self.data)
+        _FIELD.pack_into(data, XID_OFFSET, of.generate_xid())
+        if timeouts is not None:
+            _TIMEOUTS.pack_into(data, FLOW_MOD_TIMEOUTS_OFFSET, *timeouts)
+        if buffer_id is not None:
+            _FIELD.pack_into(data, FLOW_MOD_BUFFER_ID_OFFSET, buffer_id)
+        return bytes(data)
+
+    def packet_out(self, packet_in, in_port=None):
+        """
+        A packet_out applying the flow's actions to the packet of a PacketIn
+        (its ofp), as ofp_packet_out(data=packet_in) would send it.
+        """
+        return packet_out(self.actions, packet_in, in_port)
+
+
+def buffer_of(packet_in):
+    """
+    The id of the switch buffer holding the packet of a PacketIn, or None
+    if the switch sent the whole frame instead.
+    """
+    buffer_id = packet_in.buffer_id
+    if buffer_id is None or buffer_id == NO_BUFFER or buffer_id == -1:
+        return None
+    return buffer_id
+
+
+def packet_out(actions, packet_in, in_port=None):
+    """
+    Packs a packet_out with the given packed actions for the packet of a
+    PacketIn: by reference to the switch's buffer if it has one, else with
+    the frame. in_port defaults to the PacketIn's.
+    """
+    buffer_id = buffer_of(packet_in)
+    if buffer_id is None:
+        buffer_id = NO_BUFFER
+        data = packet_in.data
+    else:
+        data = b''
+    if in_port is None:
+        in_port = packet_in.in_port
+    return _PACKET_OUT.pack(of.OFP_VERSION, of.OFPT_PACKET_OUT,
+                            16 + len(actions) + len(data), of.generate_xid(),
+                            buffer_id, in_port, len(actions)) + actions + data
+
+
+class MessageTemplates(object):
+    """
+    FlowModTemplates by destination MAC, source MAC and a key naming the
+    flow's match and actions, e.g. (TCP port, egress port, queue).
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self._templates = {}  # dst -> {src: {key: FlowModTemplate}}
+        self.count = 0
+        self.hits = 0
+        self.builds = 0
+
+    def flow_mod(self, src, dst, key, build):
+        """
+        Returns the template of the flow_mod for key between src and dst;
+        build() makes that flow_mod if there is no template for it yet.
+        """
+        pairs = self._templates.get(dst)
+        if pairs is None:
+            pairs = self._templates[dst] = {}
+        templates = pairs.get(src)
+        if templates is None:
+            templates = pairs[src] = {}
+        template = templates.get(key)
+        if template is not None:
+            self.hits += 1
+            return template
+        if self.count >= self.capacity:
+            self.clear()
+            templates = self._templates.setdefault(dst, {}).setdefault(src, {})
+        template = templates[key] = FlowModTemplate(build())
+        self.count += 1
+        self.builds += 1
+        return template
+
+    def forget_pair(self, src, dst):
+        """
+        Drops the templates of one MAC pair, e.g. after its rules changed.
+        """
+        pairs = self._templates.get(dst)
+        if pairs:
+            self.count -= len(pairs.pop(src, ()))
+
+    def forget_host(self, mac):
+        """
+        Drops the templates of flows towards mac, e.g. after it was
+        learned on another port.
+        """
+        pairs = self._templates.pop(mac, None)
+        if pairs:
+            self.count -= sum(len(templates) for templates in pairs.values())
+
+    def clear(self):
+        self._templates.clear()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def stats(self):
+        return {'templates': self.count, 'hits': self.hits, 'builds': self.builds}
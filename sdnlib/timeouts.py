@@ -0,0 +1,152 @@
+"""
+Idle and hard timeouts of the reactive flows, per rule class and per flow.
+
+The flows used to get a fixed 40 seconds: a hard_timeout in assignment 1,
+and in assignment 2 a soft_timeout, which ofp_flow_mod does not have, so
+those flows never expired at all. A long-lived transfer between two hosts
+was set up again through a PacketIn every 40 seconds, while a single ping
+held its table slot for the full 40 seconds.
+
+TimeoutPolicy gives every flow an idle timeout, which frees the slot soon
+after the traffic stops, and a hard timeout, which bounds how long a flow
+outlives a policy change. Both start from the flow's rule class
+(CLASSES) and then adapt, from the FlowRemoved messages of earlier
+flows with the same match:
+
+- a flow removed by its hard timeout was still busy (its idle timeout had
+  not fired), so the next one gets twice the time the last one lasted, up
+  to max_hard -- and max_hard right away if its byte count shows a bulk
+  transfer of at least bulk_rate bit/s;
+- a flow removed by its idle timeout after at most short_packets packets
+  was a one-off exchange, so the next one gets half its idle timeout,
+  down to min_idle; one idling out after more traffic starts over from
+  its class.
+
+When the flows recorded on a switch fill more than pressure (a fraction)
+of its table_size, both timeouts shrink linearly with the occupancy, to
+min_scale of their value at a full table, so the switch frees slots
+faster than they are taken. table_size 0 leaves the occupancy out.
+"""
+from collections import OrderedDict
+
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.flowcache import match_key
+
+# (idle, hard) timeouts in seconds by rule class. The hard timeouts keep the
+# 40-second flow entries the assignments ask for.
+CLASSES = {
+    'tcp': (10, 40),   # rules for TCP or UDP ports, such as the iperf transfers
+    'pair': (5, 40),   # rules for all traffic between two hosts: pings, mostly
+    'drop': (10, 40),  # drop rules and the default drop
+}
+
+
+def rule_class(rule):
+    """
+    The class of the flows of a rule of the rules table.
+    """
+    if rule['drop']:
+        return 'drop'
+    if rule.get('TCPPort') is not None or 'SrcPort' in rule or 'DstPort' in rule:
+        return 'tcp'
+    return 'pair'
+
+
+class TimeoutPolicy(object):
+    """
+    Chooses the timeouts of each flow_mod and learns from FlowRemoved.
+
+    installed is the FlowCache whose record of each switch's flows gives
+    the table occupancy. The adapted timeouts of at most history flows are
+    remembered, the least recently removed going first; a timeout left
+    None there is the class's.
+    """
+
+    def __init__(self, installed, table_size=0, classes=CLASSES, max_hard=640, min_idle=1,
+                 short_packets=2, bulk_rate=1e6, pressure=0.75, min_scale=0.1, history=65536):
+        self.installed = installed
+        self.table_size = table_size
+        self.classes = classes
+        self.max_hard = max_hard
+        self.min_idle = min_idle
+        self.short_packets = short_packets
+        self.bulk_rate = bulk_rate
+        self.pressure = pressure
+        self.min_scale = min_scale
+        self.history = history
+        self._adapted = OrderedDict()  # match key -> (idle or None, hard or None)
+        self.extended = 0
+        self.shortened = 0
+        self.scaled = 0
+
+    def timeouts(self, dpid, rule_class, key):
+        """
+        Returns (idle_timeout, hard_timeout) for a flow of the given class
+        with the given match key, to be installed on switch dpid.
+        """
+        idle, hard = self.classes[rule_class]
+        adapted = self._adapted.get(key)
+        if adapted is not None:
+            idle = adapted[0] or idle
+            hard = adapted[1] or hard
+        scale = self.scale(dpid)
+        if scale < 1:
+            self.scaled += 1
+            idle = max(self.min_idle, int(round(idle * scale)))
+            hard = max(self.min_idle, int(round(hard * scale)))
+        return idle, hard
+
+    def scale(self, dpid):
+        """
+        The factor the timeouts on switch dpid are shrunk by for its table
+        occupancy: 1 up to the pressure threshold, min_scale when full.
+        """
+        if not self.table_size:
+            return 1.0
+        occupancy = float(self.installed.count(dpid)) / self.table_size
+        if occupancy <= self.pressure:
+            return 1.0
+        over = min(1.0, (occupancy - self.pressure) / (1 - self.pressure))
+        return 1 - over * (1 - self.min_scale)
+
+    def flow_removed(self, ofp):
+        """
+        Learns from the ofp_flow_removed of a flow whose timeouts came from
+        timeouts().
+        """
+        key = match_key(ofp.match)
+        idle, hard = self._adapted.pop(key, (None, None))
+        if ofp.reason == of.OFPRR_HARD_TIMEOUT and ofp.packet_count:
+            duration = ofp.duration_sec + ofp.duration_nsec / 1e9
+            if duration and ofp.byte_count * 8 / duration >= self.bulk_rate:
+                hard = self.max_hard
+            else:
+                hard = min(self.max_hard, max(1, int(round(duration))) * 2)
+            self.extended += 1
+        elif ofp.reason == of.OFPRR_IDLE_TIMEOUT:
+            if ofp.packet_count > self.short_packets:
+                return
+            idle = max(self.min_idle, ofp.idle_timeout // 2)
+            self.shortened += 1
+        elif idle is None and hard is None:
+            return
+        self._adapted[key] = (idle, hard)
+        if len(self._adapted) > self.history:
+            self._adapted.popitem(last=False)
+
+    def forget_pair(self, src, dst):
+        """
+        Drops what was learned about the flows of one MAC pair, e.g. after
+        its rules changed.
+        """
+        for key in [key for key in self._adapted if key[0] == src and key[1] == dst]:
+            del self._adapted[key]
+
+    def stats(self):
+        return {
+            'adapted': len(self._adapted),
+            'extended': self.extended,
+            'shortened': self.shortened,
+            'scaled': self.scaled,
+        }
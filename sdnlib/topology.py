@@ -0,0 +1,141 @@
+"""
+Switch graph and host locations for multi-switch topologies.
+
+Learning switches only know the next port at the switch a packet is on, so
+a new flow crossing k switches costs k PacketIns and floods while ports are
+unknown. Topology keeps the whole picture -- inter-switch links, taken from
+the topology script or from openflow.discovery, and the edge port of every
+host -- so the first PacketIn of a flow can be answered with flow_mods for
+every switch on its path.
+"""
+from collections import deque
+
+from pox.lib.addresses import EthAddr
+
+
+class Topology(object):
+    """
+    Inter-switch links and host attachment points.
+
+    links maps dpid -> {neighbour dpid: local port}, and hosts maps
+    MAC -> (dpid, port), both in the format of the controllers' tables.
+    """
+
+    def __init__(self, hosts=None, links=None):
+        self._links = {}
+        self._link_ports = set()
+        self._hosts = {}
+        self._paths = {}
+        for mac, (dpid, port) in (hosts or {}).items():
+            self.set_host(mac, dpid, port)
+        for dpid, neighbours in (links or {}).items():
+            for neighbour, port in neighbours.items():
+                self._add_half_link(dpid, port, neighbour)
+
+    def _add_half_link(self, dpid, port, neighbour):
+        self._links.setdefault(dpid, {})[neighbour] = port
+        self._link_ports.add((dpid, port))
+        self._paths.clear()
+
+    def add_link(self, dpid1, port1, dpid2, port2):
+        self._add_half_link(dpid1, port1, dpid2)
+        self._add_half_link(dpid2, port2, dpid1)
+
+    def remove_link(self, dpid1, port1, dpid2, port2):
+        for dpid, port, neighbour in ((dpid1, port1, dpid2), (dpid2, port2, dpid1)):
+            if self._links.get(dpid, {}).get(neighbour) == port:
+                del self._links[dpid][neighbour]
+            self._link_ports.discard((dpid, port))
+        self._paths.clear()
+
+    def remove_switch(self, dpid):
+        for neighbour, port in list(self._links.pop(dpid, {}).items()):
+            self._link_ports.discard((dpid, port))
+            back = self._links.get(neighbour, {}).pop(dpid, None)
+            if back is not None:
+                self._link_ports.discard((neighbour, back))
+        self._paths.clear()
+
+    def is_link_port(self, dpid, port):
+        """
+        Tells whether a port connects to another switch rather than a host.
+        """
+        return (dpid, port) in self._link_ports
+
+    def set_host(self, mac, dpid, port):
+        """
+        Records (or moves) a host's attachment point.
+        """
+        if not isinstance(mac, EthAddr):
+            mac = EthAddr(mac)
+        if self._hosts.get(mac) != (dpid, port):
+            self._hosts[mac] = (dpid, port)
+
+    def locate(self, mac):
+        """
+        Returns the (dpid, port) a host is attached to, or None.
+        """
+        return self._hosts.get(mac)
+
+    def switch_path(self, src_dpid, dst_dpid):
+        """
+        Returns the shortest switch path from src_dpid to dst_dpid as a list
+        of (dpid, port towards the next switch), or None if they are not
+        connected. The destination switch itself is not part of the list.
+        """
+        key = (src_dpid, dst_dpid)
+        if key in self._paths:
+            return self._paths[key]
+
+        previous = {src_dpid: None}
+        queue = deque([src_dpid])
+        while queue and dst_dpid not in previous:
+            dpid = queue.popleft()
+            for neighbour in self._links.get(dpid, {}):
+                if neighbour not in previous:
+                    previous[neighbour] = dpid
+                    queue.append(neighbour)
+
+        path = None
+        if dst_dpid in previous:
+            path = []
+            dpid = dst_dpid
+            while previous[dpid] is not None:
+                hop = previous[dpid]
+                path.append((hop, self._links[hop][dpid]))
+                dpid = hop
+            path.reverse()
+        self._paths[key] = path
+        return path
+
+    def route(self, src_dpid, mac):
+        """
+        Returns the hops from switch src_dpid to the host with the given MAC
+        as a list of (dpid, output port) ending at the host's edge port, or
+        None if the host or a path to it is unknown.
+        """
+        location = self._hosts.get(mac)
+        if location is None:
+            return None
+        path = self.switch_path(src_dpid, location[0])
+        if path is None:
+            return None
+        return path + [location]
+
+    def egress_port(self, dpid, mac):
+        """
+        Returns the port of switch dpid leading towards the host with the
+        given MAC, or None.
+        """
+        hops = self.route(dpid, mac)
+        return hops[0][1] if hops else None
+
+    def handle_link_event(self, event):
+        """
+        Keeps the links up to date from openflow.discovery's LinkEvents.
+        """
+        link = event.link
+        if event.added:
+            self.add_link(link.dpid1, link.port1, link.dpid2, link.port2)
+        elif event.removed:
+            self.remove_link(link.dpid1, link.port1, link.dpid2, link.port2)
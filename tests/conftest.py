@@ -0,0 +1,14 @@
+"""
+Tests of the modules built on POX need a POX checkout. It is looked for
+the way the command line tools look for it: importable already, or at
+$POX_HOME. Without one those tests are skipped.
+"""
+import os
+
+from sdnlib.shim import init_pox
+
+try:
+    init_pox(os.environ.get('POX_HOME'))
+except ImportError:
+    pass
+
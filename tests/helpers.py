@@ -0,0 +1,120 @@
+"""
+Helpers shared by the tests.
+"""
+import ipaddress
+import struct
+
+from sdnlib.classifier import DL_TYPE, FIELDS, IP_TYPE, NW_PROTO, NW_DST, NW_SRC, TP_DST, TP_SRC
+
+
+def split_messages(data):
+    """
+    Splits the bytes of one or more OpenFlow messages into a list of
+    (type, message bytes).
+    """
+    messages = []
+    while data:
+        length = struct.unpack('!H', data[2:4])[0]
+        messages.append((data[1], data[:length]))
+        data = data[length:]
+    return messages
+
+
+def without_xid(message):
+    return message[:4] + b'\0\0\0\0' + message[8:]
+
+
+# -- random rules tables and packet keys for sdnlib.classifier --
+
+HOSTS = ['00:00:00:00:00:%02x' % i for i in range(1, 9)]
+SUBNETS = ['10.0.%d.%d' % (i, j) for i in range(4) for j in (0, 64, 128)]
+PORTS = [22, 53, 80, 443, 1000, 5001, 8080, 50000]
+
+
+def mac_value(mac):
+    return int(mac.replace(':', ''), 16)
+
+
+def random_rule(rng):
+    """
+    A rule on some of the classifier's fields, "*" MACs included.
+    """
+    rule = {'drop': rng.random() < 0.3}
+    rule['EthSrc'] = rng.choice(HOSTS) if rng.random() < 0.8 else '*'
+    rule['EthDst'] = rng.choice(HOSTS) if rng.random() < 0.8 else '*'
+    for field in ('IPSrc', 'IPDst'):
+        if rng.random() < 0.5:
+            rule[field] = '%s/%d' % (rng.choice(SUBNETS), rng.choice((32, 30, 28, 24, 16)))
+    proto = rng.choice((None, None, 'tcp', 'udp', 'icmp', 'tcp'))
+    if proto is not None:
+        rule['Proto'] = proto
+    if proto in ('tcp', 'udp'):
+        for field in ('SrcPort', 'DstPort'):
+            roll = rng.random()
+            if roll < 0.3:
+                rule[field] = rng.choice(PORTS)
+            elif roll < 0.6:
+                low = rng.choice(PORTS)
+                rule[field] = [low, min(0xffff, low + rng.randint(0, 300))]
+    elif proto is None and rng.random() < 0.2:
+        rule['TCPPort'] = rng.choice(PORTS)
+    return rule
+
+
+def random_key(rng):
+    """
+    The packet key of a random ARP, ICMP, TCP, UDP or GRE packet near the
+    rules' addresses and ports.
+    """
+    key = [mac_value(rng.choice(HOSTS)), mac_value(rng.choice(HOSTS)), None, None, None, None, None,
+           None]
+    if rng.random() < 0.1:
+        key[DL_TYPE] = 0x0806
+        return tuple(key)
+    key[DL_TYPE] = IP_TYPE
+    for index in (NW_SRC, NW_DST):
+        key[index] = int(ipaddress.ip_address(rng.choice(SUBNETS))) + rng.randint(0, 40)
+    key[NW_PROTO] = rng.choice((1, 6, 6, 17, 47))
+    if key[NW_PROTO] in (6, 17):
+        key[TP_SRC] = rng.choice(PORTS) + rng.randint(0, 200)
+        key[TP_DST] = rng.choice(PORTS) + rng.randint(0, 200)
+    return tuple(key)
+
+
+def flow_packet(rng, fields):
+    """
+    A random packet key within the match of Classifier.flow_fields().
+    """
+    fields = dict(fields)
+    key = list(random_key(rng))
+    for index, (name, _) in enumerate(FIELDS):
+        if name in fields:
+            key[index] = fields[name]
+    if key[DL_TYPE] != IP_TYPE:
+        key[NW_SRC] = key[NW_DST] = key[NW_PROTO] = None
+    elif key[NW_SRC] is None:
+        key[NW_SRC], key[NW_DST], key[NW_PROTO] = random_key(rng)[NW_SRC:TP_SRC]
+        key[DL_TYPE] = IP_TYPE
+    if key[NW_PROTO] not in (6, 17):
+        key[TP_SRC] = key[TP_DST] = None
+    elif key[TP_SRC] is None or key[TP_DST] is None:
+        key[TP_SRC] = rng.choice(PORTS)
+        key[TP_DST] = rng.choice(PORTS)
+    return tuple(key)
+
+
+def covers(fields, key):
+    """
+    Tells whether a match of match_fields() covers a packet key.
+    """
+    names = [name for name, _ in FIELDS]
+    for name, value in fields:
+        index = names.index(name)
+        if isinstance(value, tuple):
+            network = ipaddress.ip_network(value, strict=False)
+            if key[index] is None or not (int(network.network_address) <= key[index]
+                                          <= int(network.broadcast_address)):
+                return False
+        elif key[index] != value:
+            return False
+    return True
@@ -0,0 +1,56 @@
+"""
+PacketIn admission: token buckets, blocks and the flows that enforce them.
+"""
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+from pox.lib.addresses import EthAddr
+
+from sdnlib.admission import ADMIT, BLOCK, BLOCKED, THROTTLED, AdmissionControl, release
+
+HOST = EthAddr('00:00:00:00:00:01')
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_a_host_over_its_budget_is_blocked_for_block_time():
+    clock = Clock()
+    admission = AdmissionControl(host_rate=1, host_burst=2, block_time=5, clock=clock)
+    assert [admission.admit(1, HOST) for _ in range(4)] == [ADMIT, ADMIT, BLOCK, BLOCKED]
+    # only on that switch
+    assert admission.admit(2, HOST) == ADMIT
+    clock.now += 5
+    assert admission.admit(1, HOST) == ADMIT
+    assert admission.stats()['blocks'] == 1
+
+
+def test_a_switch_over_its_budget_is_throttled():
+    clock = Clock()
+    admission = AdmissionControl(switch_rate=1, switch_burst=1, clock=clock)
+    hosts = [EthAddr('00:00:00:00:00:%02x' % n) for n in range(1, 4)]
+    assert [admission.admit(1, host) for host in hosts] == [ADMIT, THROTTLED, THROTTLED]
+    clock.now += 1
+    assert admission.admit(1, hosts[2]) == ADMIT
+
+
+@pytest.mark.parametrize('block_time, hard_timeout', [(0.2, 1), (1, 1), (2.5, 3), (10, 10)])
+def test_block_flows_expire(block_time, hard_timeout):
+    fm = AdmissionControl(host_rate=1, block_time=block_time).block_flow(HOST, 3, buffer_id=12)
+    assert fm.hard_timeout == hard_timeout
+    assert fm.match.dl_src == HOST and fm.match.in_port == 3
+    assert fm.buffer_id == 12
+    assert fm.actions == []
+
+
+def test_release_drops_the_buffered_packet():
+    po = release(12, 3)
+    assert po.buffer_id == 12 and po.in_port == 3
+    assert po.actions == []
@@ -0,0 +1,113 @@
+"""
+The aggregate drop of a MAC pair and its punt flows, as built from the
+rules table and as assignment2 installs them.
+"""
+import struct
+
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.lib.packet as pkt
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+
+from sdnlib import shim
+from sdnlib.aggregate import AGGREGATE_DROP_PRIORITY, PUNT_PRIORITY, aggregated_drop
+from sdnlib.rules import RuleIndex
+from sdnlib.templates import FLOW_MOD_TIMEOUTS_OFFSET
+
+# where tp_dst sits in a packed flow_mod: the header, then the match's
+TP_DST_OFFSET = 8 + 38
+
+H1, H3, H4 = (EthAddr('00:00:00:00:00:%02d' % n) for n in (1, 3, 4))
+RULES = [
+    {'EthSrc': '00:00:00:00:00:01', 'EthDst': '00:00:00:00:00:03', 'TCPPort': 40, 'queue': 1,
+     'drop': False},
+    {'EthSrc': '00:00:00:00:00:01', 'EthDst': '00:00:00:00:00:03', 'TCPPort': 50, 'drop': True},
+    {'EthSrc': '00:00:00:00:00:01', 'EthDst': '00:00:00:00:00:03', 'TCPPort': 60, 'queue': 0,
+     'drop': False},
+]
+
+
+def test_drop_then_a_punt_per_permitted_port():
+    flow_mods = aggregated_drop(RuleIndex(RULES), H1, H3)
+    drop, punts = flow_mods[0], flow_mods[1:]
+    assert drop.priority == AGGREGATE_DROP_PRIORITY
+    assert drop.actions == []
+    assert (drop.match.dl_src, drop.match.dl_dst) == (H1, H3)
+    assert [fm.match.tp_dst for fm in punts] == [40, 60]
+    for fm in punts:
+        assert fm.priority == PUNT_PRIORITY
+        assert (fm.match.dl_src, fm.match.dl_dst) == (H1, H3)
+        assert fm.actions[0].port == of.OFPP_CONTROLLER
+    # a pair without rules only gets the drop
+    assert len(aggregated_drop(RuleIndex(RULES), H1, H4)) == 1
+
+
+class Connection(object):
+
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data if isinstance(data, bytes) else data.pack())
+
+
+class Timer(object):
+
+    def __init__(self, *args, **kw):
+        pass
+
+
+def _flow_mods(data):
+    """
+    The (priority, idle_timeout, hard_timeout, tp_dst) of each flow_mod in
+    a write.
+    """
+    flow_mods = []
+    while data:
+        kind, length = struct.unpack_from('!xBH', data)
+        if kind == of.OFPT_FLOW_MOD:
+            idle, hard, priority = struct.unpack_from('!HHH', data, FLOW_MOD_TIMEOUTS_OFFSET)
+            tp_dst, = struct.unpack_from('!H', data, TP_DST_OFFSET)
+            flow_mods.append((priority, idle, hard, tp_dst))
+        data = data[length:]
+    return flow_mods
+
+
+def _tcp_frame(src, dst, port):
+    segment = pkt.tcp(srcport=33000, dstport=port)
+    packet = pkt.ipv4(srcip=IPAddr('10.0.0.1'), dstip=IPAddr('10.0.0.3'), protocol=pkt.ipv4.TCP_PROTOCOL)
+    packet.payload = segment
+    frame = pkt.ethernet(type=pkt.ethernet.IP_TYPE, src=src, dst=dst)
+    frame.payload = packet
+    return frame.pack()
+
+
+def test_punts_expire_with_the_drop(monkeypatch):
+    import pox.lib.recoco
+    from sdnlib import sendbuf
+
+    core = shim.init_pox()
+    monkeypatch.setattr(sendbuf, '_schedule', None)
+    monkeypatch.setattr(pox.lib.recoco, 'Timer', Timer)
+    nexus = shim.Nexus(Connection)
+    core.register('openflow', nexus)
+    controller = shim.load_controller('assignment2')
+    controller.launch(aggregate=True)
+
+    connection = nexus.getConnection(1)
+    ofp = of.ofp_packet_in(buffer_id=None, in_port=1, data=_tcp_frame(H1, H3, 80))
+    nexus.raiseEvent('PacketIn', shim.PacketIn(connection, ofp))
+    sendbuf.flush_pending()
+
+    flow_mods = _flow_mods(b''.join(connection.sent))
+    drops = [fm for fm in flow_mods if fm[0] == AGGREGATE_DROP_PRIORITY]
+    punts = [fm for fm in flow_mods if fm[0] == PUNT_PRIORITY]
+    assert len(drops) == 1
+    hard_timeout = drops[0][2]
+    assert hard_timeout > 0
+    # the controller's table permits H1->H3 on TCP port 40 only
+    assert punts == [(PUNT_PRIORITY, 0, hard_timeout, 40)]
@@ -0,0 +1,31 @@
+"""
+The asyncio front end end to end: each controller served on a loopback
+port to fake switches, as python -m sdnlib.aioflow --selfcheck does.
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.lib.recoco
+
+from sdnlib import aioflow, sendbuf
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    # setup() swaps in the loop's timer and scheduler; put POX's back after
+    monkeypatch.setattr(pox.lib.recoco, 'Timer', pox.lib.recoco.Timer)
+    monkeypatch.setattr(sendbuf, '_schedule', sendbuf._schedule)
+    loop = aioflow.new_event_loop(use_uvloop=False)
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+@pytest.mark.parametrize('controller', ['assignment1', 'assignment2'])
+def test_selfcheck(loop, controller):
+    problems = loop.run_until_complete(aioflow.selfcheck(controller, switches=3, events=600))
+    assert problems == []
@@ -0,0 +1,102 @@
+"""
+ArpResponder answering requests from its cache, within the firewall rules,
+and freeing the switch buffer of a request it answered.
+"""
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.lib.packet as pkt
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr, IPAddr
+
+from sdnlib.arpproxy import ArpResponder
+from sdnlib.rules import RuleIndex
+
+HOST_IPS = dict(('10.0.0.%d' % n, '00:00:00:00:00:%02d' % n) for n in range(1, 5))
+RULES = [
+    {'EthSrc': '00:00:00:00:00:03', 'EthDst': '00:00:00:00:00:04', 'drop': True},
+    {'EthSrc': '00:00:00:00:00:04', 'EthDst': '00:00:00:00:00:03', 'drop': True},
+    {'EthSrc': '00:00:00:00:00:01', 'EthDst': '00:00:00:00:00:03', 'TCPPort': 40, 'queue': 1,
+     'drop': False},
+]
+
+
+class Out(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+class Event(object):
+
+    def __init__(self, frame, port, buffer_id=None):
+        self.port = port
+        self.ofp = of.ofp_packet_in(buffer_id=buffer_id, in_port=port, data=frame.pack())
+
+
+def _request(src, dst):
+    request = pkt.arp()
+    request.opcode = pkt.arp.REQUEST
+    request.hwsrc = EthAddr(HOST_IPS['10.0.0.%d' % src])
+    request.protosrc = IPAddr('10.0.0.%d' % src)
+    request.protodst = IPAddr('10.0.0.%d' % dst)
+    frame = pkt.ethernet(type=pkt.ethernet.ARP_TYPE, src=request.hwsrc, dst=pkt.ETHER_BROADCAST)
+    frame.payload = request
+    return frame
+
+
+def _ask(responder, src, dst, buffer_id=None):
+    frame = _request(src, dst)
+    out = Out()
+    answered = responder.handle(Event(frame, src, buffer_id), frame, out)
+    return answered, out.sent
+
+
+def test_answers_from_the_cache():
+    responder = ArpResponder(HOST_IPS, RuleIndex(RULES))
+    answered, sent = _ask(responder, 1, 3)
+    assert answered
+    assert len(sent) == 1
+    reply = pkt.ethernet(sent[0].data)
+    assert reply.src == EthAddr('00:00:00:00:00:03')
+    assert reply.payload.opcode == pkt.arp.REPLY
+    assert reply.payload.protosrc == IPAddr('10.0.0.3')
+    assert sent[0].actions[0].port == of.OFPP_IN_PORT
+    assert responder.stats()['replies'] == 1
+
+
+def test_frees_the_buffer_of_an_answered_request():
+    responder = ArpResponder(HOST_IPS)
+    answered, sent = _ask(responder, 1, 2, buffer_id=7)
+    assert answered
+    assert len(sent) == 2
+    release = sent[1]
+    assert release.buffer_id == 7
+    assert release.actions == []
+    assert release.in_port == 1
+
+
+def test_refuses_pairs_the_rules_drop():
+    responder = ArpResponder(HOST_IPS, RuleIndex(RULES))
+    for src, dst in ((3, 4), (4, 3)):
+        answered, sent = _ask(responder, src, dst, buffer_id=9)
+        assert not answered
+        assert sent == []
+    assert responder.stats()['refused'] == 2
+    # pairs without a rule are answered
+    assert _ask(responder, 2, 4)[0]
+    # and without rules every pair is
+    assert _ask(ArpResponder(HOST_IPS), 3, 4)[0]
+
+
+def test_leaves_unknown_addresses_to_the_caller():
+    responder = ArpResponder({'10.0.0.2': '00:00:00:00:00:02'})
+    answered, sent = _ask(responder, 1, 3)
+    assert not answered and sent == []
+    assert responder.stats()['misses'] == 1
+    # but learns the sender
+    assert responder.lookup(IPAddr('10.0.0.1')) == EthAddr('00:00:00:00:00:01')
@@ -0,0 +1,80 @@
+"""
+The compiled Classifier against a linear scan of the same rules, on random
+tables and packets from fixed seeds, so a failure always reproduces; see
+test_classifier_properties.py for the same checks with hypothesis.
+"""
+import random
+
+import pytest
+
+from sdnlib.classifier import (Classifier, DL_SRC, DL_DST, linear_lookup, match_fields, matches,
+                               rule_ranges)
+
+from tests.helpers import covers, flow_packet, mac_value, random_key, random_rule
+
+
+def _table(seed, count, packets=500):
+    rng = random.Random(seed)
+    rules = [random_rule(rng) for _ in range(count)]
+    keys = [random_key(rng) for _ in range(packets)]
+    return rng, rules, keys
+
+
+@pytest.mark.parametrize('count', [0, 1, 10, 100, 1000])
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_lookup_matches_linear_scan(seed, count):
+    _, rules, keys = _table(seed, count)
+    classifier = Classifier(rules)
+    expected = [linear_lookup(rules, key) for key in keys]
+    # the second pass is answered from the cross-product table
+    for _ in range(2):
+        assert [classifier.lookup(key) for key in keys] == expected
+    assert classifier.hits + classifier.misses == 2 * len(keys)
+
+
+def test_lookup_survives_a_full_cross_product_table():
+    _, rules, keys = _table(4, 300, packets=1000)
+    classifier = Classifier(rules, capacity=16)
+    for key in keys + keys:
+        assert classifier.lookup(key) is linear_lookup(rules, key)
+    assert classifier.stats()['products'] <= 16
+
+
+def test_skipped_fields_are_left_to_the_caller():
+    _, rules, keys = _table(5, 200)
+    src, dst = '00:00:00:00:00:01', '00:00:00:00:00:02'
+    pair = [dict(rule, EthSrc=src, EthDst=dst) for rule in rules]
+    classifier = Classifier(pair, skip=(DL_SRC, DL_DST))
+    for key in keys:
+        assert classifier.lookup(key) is linear_lookup(pair, (mac_value(src), mac_value(dst)) + key[2:])
+
+
+def test_flows_only_take_packets_of_the_same_rule():
+    rng, rules, keys = _table(6, 100)
+    classifier = Classifier(rules)
+    for key in keys:
+        other = flow_packet(rng, classifier.flow_fields(key))
+        assert linear_lookup(rules, other) is linear_lookup(rules, key)
+
+
+def test_match_fields_cover_exactly_the_rule():
+    _, rules, keys = _table(7, 50)
+    for rule in rules:
+        fields = match_fields(rule)
+        if fields is None:
+            continue
+        ranges = rule_ranges(rule)
+        for key in keys:
+            assert matches(ranges, key) == any(covers(match, key) for match in fields)
+
+
+@pytest.mark.parametrize('rule', [
+    {'EthSrc': '*', 'EthDst': '*', 'TCPPort': 80, 'Proto': 'udp'},
+    {'EthSrc': '*', 'EthDst': '*', 'SrcPort': 80},
+    {'EthSrc': '*', 'EthDst': '*', 'Proto': 'tcp', 'DstPort': '2000-1000'},
+    {'EthSrc': '*', 'EthDst': '*', 'IPSrc': '10.0.0.0/33'},
+    {'EthSrc': '*', 'EthDst': '*', 'Proto': 300},
+])
+def test_malformed_rules_are_refused(rule):
+    with pytest.raises(ValueError):
+        Classifier([rule])
@@ -0,0 +1,73 @@
+"""
+The Classifier against a linear scan on tables and packets generated by
+hypothesis, which shrinks a failing table to a small one.
+"""
+import ipaddress
+
+import pytest
+
+pytest.importorskip('hypothesis')
+
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from sdnlib.classifier import Classifier, IP_TYPE, linear_lookup, match_fields, matches, rule_ranges
+
+from tests.helpers import HOSTS, PORTS, SUBNETS, covers, mac_value
+
+macs = st.sampled_from(HOSTS + ['*'])
+prefixes = st.tuples(st.sampled_from(SUBNETS), st.sampled_from((32, 30, 28, 24, 16))).map('%s/%d'.__mod__)
+ports = st.one_of(st.sampled_from(PORTS),
+                  st.tuples(st.sampled_from(PORTS), st.integers(0, 300)).map(
+                      lambda bounds: [bounds[0], min(0xffff, bounds[0] + bounds[1])]))
+
+
+@st.composite
+def rules(draw):
+    rule = {'drop': draw(st.booleans()), 'EthSrc': draw(macs), 'EthDst': draw(macs)}
+    for field in ('IPSrc', 'IPDst'):
+        if draw(st.booleans()):
+            rule[field] = draw(prefixes)
+    proto = draw(st.sampled_from((None, 'tcp', 'udp', 'icmp')))
+    if proto is not None:
+        rule['Proto'] = proto
+    if proto in ('tcp', 'udp'):
+        for field in ('SrcPort', 'DstPort'):
+            if draw(st.booleans()):
+                rule[field] = draw(ports)
+    elif proto is None and draw(st.booleans()):
+        rule['TCPPort'] = draw(st.sampled_from(PORTS))
+    return rule
+
+
+@st.composite
+def keys(draw):
+    key = (mac_value(draw(st.sampled_from(HOSTS))), mac_value(draw(st.sampled_from(HOSTS))))
+    if draw(st.integers(0, 9)) == 0:
+        return key + (0x0806, None, None, None, None, None)
+    addresses = tuple(int(ipaddress.ip_address(draw(st.sampled_from(SUBNETS)))) + draw(st.integers(0, 40))
+                      for _ in range(2))
+    proto = draw(st.sampled_from((1, 6, 17, 47)))
+    if proto in (6, 17):
+        l4 = tuple(draw(st.sampled_from(PORTS)) + draw(st.integers(0, 200)) for _ in range(2))
+    else:
+        l4 = (None, None)
+    return key + (IP_TYPE,) + addresses + (proto,) + l4
+
+
+@settings(max_examples=200, deadline=None)
+@given(st.lists(rules(), max_size=40), st.lists(keys(), min_size=1, max_size=20))
+def test_lookup_matches_linear_scan(table, packets):
+    classifier = Classifier(table)
+    for key in packets + packets:
+        assert classifier.lookup(key) is linear_lookup(table, key)
+
+
+@settings(max_examples=200, deadline=None)
+@given(rules(), st.lists(keys(), min_size=1, max_size=20))
+def test_match_fields_cover_exactly_the_rule(rule, packets):
+    fields = match_fields(rule)
+    if fields is not None:
+        ranges = rule_ranges(rule)
+        for key in packets:
+            assert matches(ranges, key) == any(covers(match, key) for match in fields)
@@ -0,0 +1,219 @@
+"""
+Planning, scheduling and evaluating the iperf checks of the assignment
+specs, with canned iperf client output, and running them on fake Mininet
+hosts.
+"""
+import copy
+import os
+
+import pytest
+
+from sdnlib.conformance import (DEFAULT_PORT, evaluate, parse_iperf, plan_checks, run_checks,
+                                schedule, uncapped_floor)
+from sdnlib.netspec import load_spec
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPECS = [os.path.join(ROOT, 'assignment%d' % n, 'network_assignment%d.json' % n) for n in (1, 2)]
+
+CAPPED_OUTPUT = """\
+------------------------------------------------------------
+Client connecting to 10.0.0.3, TCP port 40
+TCP window size: 85.3 KByte (default)
+------------------------------------------------------------
+[  3] local 10.0.0.1 port 52346 connected with 10.0.0.3 port 40
+[ ID] Interval       Transfer     Bandwidth
+[  3]  0.0- 5.0 sec  17.9 MBytes  29.9 Mbits/sec
+"""
+
+INTERVALS_OUTPUT = """\
+------------------------------------------------------------
+Client connecting to 10.0.0.2, TCP port 60
+TCP window size: 85.3 KByte (default)
+------------------------------------------------------------
+[  3] local 10.0.0.1 port 41234 connected with 10.0.0.2 port 60
+[ ID] Interval       Transfer     Bandwidth
+[  3]  0.0- 1.0 sec  21.2 MBytes   178 Mbits/sec
+[  3]  1.0- 2.0 sec  17.5 MBytes   147 Mbits/sec
+[  3]  0.0- 2.0 sec  38.8 MBytes   163 Mbits/sec
+"""
+
+FAST_OUTPUT = """\
+[  3] local 10.0.0.2 port 39874 connected with 10.0.0.1 port 5001
+[ ID] Interval       Transfer     Bandwidth
+[  3]  0.0- 5.0 sec  18.2 GBytes  31.2 Gbits/sec
+"""
+
+SLOW_OUTPUT = """\
+[  3] local 10.0.0.2 port 39874 connected with 10.0.0.1 port 5001
+[ ID] Interval       Transfer     Bandwidth
+[  3]  0.0- 5.0 sec   312 KBytes   512 Kbits/sec
+"""
+
+BLOCKED_OUTPUT = """\
+connect failed: Connection timed out
+"""
+
+
+def _plan(n):
+    return plan_checks(load_spec(SPECS[n - 1]))
+
+
+def _check(checks, src, dst, port=DEFAULT_PORT):
+    found = [check for check in checks if (check['src'], check['dst'], check['port']) == (src, dst, port)]
+    assert len(found) == 1
+    return found[0]
+
+
+@pytest.mark.parametrize('output, rate', [
+    (CAPPED_OUTPUT, 29.9),
+    (INTERVALS_OUTPUT, 163.0),
+    (FAST_OUTPUT, 31200.0),
+    (SLOW_OUTPUT, 0.512),
+    (BLOCKED_OUTPUT, None),
+    ('', None),
+])
+def test_parse_iperf(output, rate):
+    if rate is None:
+        assert parse_iperf(output) is None
+    else:
+        assert parse_iperf(output) == pytest.approx(rate)
+
+
+@pytest.mark.parametrize('n', [1, 2])
+def test_plan_checks_covers_every_rule(n):
+    spec = load_spec(SPECS[n - 1])
+    checks = _plan(n)
+    assert len(checks) == len(spec['rules'])
+    assert _check(checks, 'h1', 'h3', 40)['expect'] == 'capped'
+    assert _check(checks, 'h1', 'h3', 40)['rate'] == 30.0
+    assert _check(checks, 'h1', 'h2', 60)['rate'] == 150.0
+    assert _check(checks, 'h2', 'h4')['rate'] == 200.0
+    assert _check(checks, 'h1', 'h4')['expect'] == 'uncapped'
+    assert _check(checks, 'h3', 'h4')['expect'] == 'blocked'
+    assert _check(checks, 'h4', 'h3')['expect'] == 'blocked'
+    assert _check(checks, 'h1', 'h3', 40)['dst_ip'] == '10.0.0.3'
+
+
+def test_plan_checks_follows_the_path_across_switches():
+    checks = _plan(2)
+    assert _check(checks, 'h1', 'h3', 40)['egress'] == ['s1-eth3', 's2-eth1']
+    assert _check(checks, 'h4', 'h1')['egress'] == ['s2-eth3', 's1-eth1']
+    assert _check(checks, 'h1', 'h2', 60)['egress'] == ['s1-eth2']
+    assert _plan(1)[0]['egress'] == ['s1-eth3']
+
+
+def test_plan_checks_checks_shadowed_rules_as_the_rule_that_wins():
+    spec = copy.deepcopy(load_spec(SPECS[0]))
+    # h1->h4 port 80 is allowed, but the earlier rule for all of h1->h4 drops it
+    spec['rules'].insert(0, {'EthSrc': '00:00:00:00:00:01', 'EthDst': '00:00:00:00:00:04', 'drop': True})
+    spec['rules'].append({'EthSrc': '00:00:00:00:00:01', 'EthDst': '00:00:00:00:00:04',
+                          'TCPPort': 80, 'drop': False})
+    checks = plan_checks(spec)
+    assert _check(checks, 'h1', 'h4', 80)['expect'] == 'blocked'
+    assert _check(checks, 'h1', 'h4')['expect'] == 'blocked'
+
+
+@pytest.mark.parametrize('n', [1, 2])
+def test_schedule_keeps_conflicting_checks_apart(n):
+    checks = _plan(n)
+    rounds = schedule(checks)
+    assert sorted(id(check) for checks_of_round in rounds for check in checks_of_round) == \
+        sorted(id(check) for check in checks)
+    assert len(rounds) < len(checks)
+    for checks_of_round in rounds:
+        hosts = [host for check in checks_of_round for host in (check['src'], check['dst'])]
+        assert len(hosts) == len(set(hosts))
+        egress = [port for check in checks_of_round if check['expect'] != 'blocked'
+                  for port in check['egress']]
+        assert len(egress) == len(set(egress))
+    # greedy in plan order: the first check opens the first round
+    assert rounds[0][0] is checks[0]
+
+
+def test_evaluate_capped():
+    check = _check(_plan(1), 'h1', 'h3', 40)
+    result = evaluate(check, CAPPED_OUTPUT)
+    assert result['passed'] and result['measured'] == pytest.approx(29.9)
+    assert result['src'] == 'h1' and result['expect'] == 'capped'
+    assert not evaluate(check, FAST_OUTPUT)['passed']
+    assert not evaluate(check, BLOCKED_OUTPUT)['passed']
+    # 163 Mb/s is within 10% of 150 but not within 5%
+    check = _check(_plan(1), 'h1', 'h2', 60)
+    assert evaluate(check, INTERVALS_OUTPUT)['passed']
+    assert not evaluate(check, INTERVALS_OUTPUT, tolerance=0.05)['passed']
+
+
+def test_evaluate_blocked():
+    check = _check(_plan(2), 'h3', 'h4')
+    assert evaluate(check, BLOCKED_OUTPUT)['passed']
+    assert evaluate(check, BLOCKED_OUTPUT)['measured'] is None
+    assert not evaluate(check, SLOW_OUTPUT)['passed']
+
+
+def test_evaluate_uncapped():
+    checks = _plan(2)
+    floor = uncapped_floor(checks)
+    assert floor == pytest.approx(220.0)
+    check = _check(checks, 'h2', 'h1')
+    assert evaluate(check, FAST_OUTPUT, uncapped_floor=floor)['passed']
+    assert not evaluate(check, INTERVALS_OUTPUT, uncapped_floor=floor)['passed']
+    assert not evaluate(check, BLOCKED_OUTPUT, uncapped_floor=floor)['passed']
+    assert evaluate(check, SLOW_OUTPUT)['passed']
+
+
+class FakeClient(object):
+
+    def communicate(self, timeout=None):
+        return FAST_OUTPUT.encode(), None
+
+
+class FakeHost(object):
+    """
+    A Mininet host whose shell starts iperf servers as pids and lists the
+    ports they listen on.
+    """
+
+    def __init__(self, log, pids):
+        self.log = log
+        self.pids = pids
+        self.listening = {}  # port -> pid
+
+    def cmd(self, command):
+        self.log.append(command)
+        words = command.split()
+        if words[:2] == ['iperf', '-s']:
+            pid = next(self.pids)
+            self.listening[int(words[3])] = pid
+            return '[1] %d\n%d\n' % (pid, pid)
+        if words[0] == 'ss':
+            port = int(words[-1].lstrip(':'))
+            return 'LISTEN 0 5 0.0.0.0:%d 0.0.0.0:*\n' % port if port in self.listening else ''
+        if words[0] == 'kill':
+            pid = int(words[1])
+            self.listening = dict((p, q) for p, q in self.listening.items() if q != pid)
+        return ''
+
+    def popen(self, args, **kwargs):
+        self.log.append(' '.join(args))
+        return FakeClient()
+
+
+def test_run_checks_starts_and_stops_every_server():
+    spec = load_spec(SPECS[1])
+    log = []
+    pids = iter(range(100, 200))
+    hosts = dict((name, FakeHost(log, pids)) for name in ('h1', 'h2', 'h3', 'h4'))
+    net = type('FakeNet', (), {'get': lambda self, name: hosts[name]})()
+    report = run_checks(net, spec, duration=0)
+    assert report['results']
+    servers = set((check['dst'], check['port']) for check in plan_checks(spec))
+    started = [command for command in log if command.startswith('iperf -s')]
+    assert len(started) == len(servers)
+    # h3 runs two servers: each is stopped by its own pid
+    assert len([port for name, port in servers if name == 'h3']) == 2
+    killed = [command for command in log if command.startswith('kill')]
+    assert sorted(killed) == sorted('kill %d' % pid for pid in range(100, 100 + len(servers)))
+    assert all(not host.listening for host in hosts.values())
+    # every server listens before the first client connects
+    first_client = min(i for i, command in enumerate(log) if command.startswith('iperf -c'))
+    assert all(log.index(command) < first_client for command in started)
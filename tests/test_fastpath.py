@@ -0,0 +1,107 @@
+"""
+fastpath.classify() reading the raw frame against headers_of() on POX's
+parsed one, for the frames the controllers see.
+"""
+import struct
+
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.lib.packet as pkt
+from pox.lib.addresses import EthAddr, IPAddr
+
+from sdnlib.fastpath import classify, headers_of
+
+H1, H2 = EthAddr('00:00:00:00:00:01'), EthAddr('00:00:00:00:00:02')
+IP1, IP2 = IPAddr('10.0.0.1'), IPAddr('10.0.1.2')
+
+FIELDS = ('src', 'dst', 'type', 'nw_proto', 'tp_dst', 'nw_src', 'nw_dst', 'ports')
+
+
+class PacketIn(object):
+    """
+    The parts of a PacketIn event classify() and headers_of() use.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.parses = 0
+
+    @property
+    def parsed(self):
+        self.parses += 1
+        return pkt.ethernet(self.data)
+
+
+def _ip(protocol, payload):
+    ip_packet = pkt.ipv4(srcip=IP1, dstip=IP2, protocol=protocol)
+    ip_packet.payload = payload
+    return _frame(pkt.ethernet.IP_TYPE, ip_packet)
+
+
+def _frame(eth_type, payload, src=H1, dst=H2):
+    frame = pkt.ethernet(type=eth_type, src=src, dst=dst)
+    frame.payload = payload
+    return frame.pack()
+
+
+def _tcp():
+    segment = pkt.tcp(srcport=40000, dstport=80)
+    segment.off = 5
+    return _ip(pkt.ipv4.TCP_PROTOCOL, segment)
+
+
+def _udp():
+    datagram = pkt.udp(srcport=5353, dstport=53)
+    datagram.payload = b'query'
+    return _ip(pkt.ipv4.UDP_PROTOCOL, datagram)
+
+
+def _icmp():
+    message = pkt.icmp(type=pkt.TYPE_ECHO_REQUEST)
+    message.payload = pkt.echo(id=7, seq=1)
+    return _ip(pkt.ipv4.ICMP_PROTOCOL, message)
+
+
+def _arp():
+    request = pkt.arp(opcode=pkt.arp.REQUEST, hwsrc=H1, protosrc=IP1, protodst=IP2)
+    return _frame(pkt.ethernet.ARP_TYPE, request, dst=pkt.ETHER_BROADCAST)
+
+
+@pytest.mark.parametrize('frame, expected', [
+    (_tcp, {'type': 0x0800, 'nw_proto': 6, 'tp_dst': 80, 'ports': (40000, 80)}),
+    (_udp, {'type': 0x0800, 'nw_proto': 17, 'tp_dst': None, 'ports': (5353, 53)}),
+    (_icmp, {'type': 0x0800, 'nw_proto': 1, 'tp_dst': None, 'ports': None}),
+    (_arp, {'type': 0x0806, 'nw_proto': None, 'nw_src': None, 'ports': None}),
+], ids=['tcp', 'udp', 'icmp', 'arp'])
+def test_classify_agrees_with_the_parser(frame, expected):
+    event = PacketIn(frame())
+    fast = classify(event)
+    # read from the bytes, without parsing
+    assert event.parses == 0
+    parsed = headers_of(event)
+    for field in FIELDS:
+        assert getattr(fast, field) == getattr(parsed, field), field
+    for field, value in expected.items():
+        assert getattr(fast, field) == value, field
+    assert fast.src == H1
+    if fast.type == 0x0800:
+        assert (fast.nw_src, fast.nw_dst) == (IP1.toUnsigned(), IP2.toUnsigned())
+
+
+def test_the_rest_goes_to_the_parser():
+    # a VLAN tag: the headers are not where classify() looks
+    untagged = _arp()
+    event = PacketIn(untagged[:12] + struct.pack('!HH', 0x8100, 10) + untagged[12:])
+    headers = classify(event)
+    assert event.parses == 1
+    assert (headers.src, headers.type, headers.nw_proto) == (H1, 0x8100, None)
+
+
+def test_payload_and_find_parse_on_demand():
+    event = PacketIn(_arp())
+    headers = classify(event)
+    assert event.parses == 0
+    assert headers.payload.protodst == IP2
+    assert headers.find('arp').hwsrc == H1
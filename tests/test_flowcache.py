@@ -0,0 +1,114 @@
+"""
+FlowCache: duplicate PacketIns within the install window, expiry,
+removal and the ways flows are forgotten.
+"""
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+
+from sdnlib.flowcache import FlowCache, match_key, track_removal
+
+H1, H2, H3 = (EthAddr('00:00:00:00:00:%02x' % n) for n in range(1, 4))
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _match(src, dst, tcp_port=None, nw_dst=None):
+    match = of.ofp_match(dl_src=src, dl_dst=dst)
+    if tcp_port is not None or nw_dst is not None:
+        match.dl_type = 0x0800
+    if tcp_port is not None:
+        match.nw_proto = 6
+        match.tp_dst = tcp_port
+    if nw_dst is not None:
+        match.nw_dst = nw_dst
+    return match
+
+
+def test_duplicates_within_the_window_are_suppressed():
+    clock = Clock()
+    cache = FlowCache(window=1.0, clock=clock)
+    assert cache.should_install(1, _match(H1, H2))
+    clock.now += 0.5
+    assert not cache.should_install(1, _match(H1, H2))
+    # another switch, port or pair is another flow
+    assert cache.should_install(2, _match(H1, H2))
+    assert cache.should_install(1, _match(H1, H2, 80))
+    assert cache.should_install(1, _match(H2, H1))
+    # past the window the switch evidently lacks the flow: install it again
+    clock.now += 0.6
+    assert cache.should_install(1, _match(H1, H2))
+    assert cache.stats()['installs'] == 5 and cache.stats()['suppressed'] == 1
+
+
+def test_nested_prefixes_are_apart():
+    cache = FlowCache(clock=Clock())
+    assert cache.should_install(1, _match(H1, H2, nw_dst='10.0.0.0/24'))
+    assert cache.should_install(1, _match(H1, H2, nw_dst='10.0.0.0/16'))
+    assert match_key(_match(H1, H2, nw_dst='10.0.0.0/24')) != match_key(_match(H1, H2))
+
+
+def test_hard_timeouts_lapse_without_a_flow_removed():
+    clock = Clock()
+    cache = FlowCache(window=10, clock=clock)
+    assert cache.should_install(1, _match(H1, H2), hard_timeout=5)
+    assert cache.has(1, _match(H1, H2))
+    clock.now += 5
+    assert not cache.has(1, _match(H1, H2))
+    assert cache.should_install(1, _match(H1, H2), hard_timeout=5)
+
+
+def test_removed_flows_are_installed_again():
+    cache = FlowCache(window=10, clock=Clock())
+    cache.should_install(1, _match(H1, H2))
+    cache.remove(1, _match(H1, H2))
+    assert cache.stats()['removals'] == 1
+    assert cache.should_install(1, _match(H1, H2))
+    # a removal of a flow we never recorded is not counted
+    cache.remove(3, _match(H1, H2))
+    assert cache.stats()['removals'] == 1
+
+
+def test_forgetting_flows():
+    cache = FlowCache(window=10, clock=Clock())
+    for dpid in (1, 2):
+        for src, dst in ((H1, H2), (H2, H1), (H3, H2), (H1, H3)):
+            cache.should_install(dpid, _match(src, dst))
+    assert len(cache) == 8
+    cache.forget_pair(H1, H2)
+    assert len(cache) == 6 and not cache.has(2, _match(H1, H2))
+    # the flows towards H2, from anyone and on every switch
+    cache.forget_host(H2)
+    assert len(cache) == 4 and not cache.has(1, _match(H3, H2))
+    assert cache.has(1, _match(H2, H1))
+    cache.purge_switch(1)
+    assert cache.switches() == [2] and cache.count(2) == 2
+    assert cache.retain(2, {match_key(_match(H2, H1))}) == 1
+    assert cache.count(2) == 1
+
+
+def test_dump_and_load():
+    clock = Clock()
+    cache = FlowCache(clock=clock)
+    cache.should_install(1, _match(H1, H2))
+    cache.should_install(1, _match(H1, H3), hard_timeout=5)
+    flows = cache.dump()
+    clock.now += 6
+    restored = FlowCache(clock=clock)
+    assert restored.load(flows) == 1
+    assert restored.has(1, _match(H1, H2)) and not restored.has(1, _match(H1, H3))
+
+
+def test_track_removal():
+    fm = track_removal(of.ofp_flow_mod())
+    assert fm.flags & of.OFPFF_SEND_FLOW_REM
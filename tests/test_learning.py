@@ -0,0 +1,101 @@
+"""
+The MAC learning table: TTLs, the per-switch LRU cap, purges and
+dump()/load().
+"""
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+from pox.lib.addresses import EthAddr
+
+from sdnlib.learning import LearningTable
+
+MACS = [EthAddr('00:00:00:00:00:%02x' % n) for n in range(1, 9)]
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_learn_tells_what_is_news():
+    table = LearningTable(clock=Clock())
+    assert table.learn(1, MACS[0], 1)
+    assert not table.learn(1, MACS[0], 1)
+    # moved to another port
+    assert table.learn(1, MACS[0], 2)
+    assert table.lookup(1, MACS[0]) == 2
+    # switches are apart
+    assert table.lookup(2, MACS[0]) is None
+    assert table.stats()['hits'] == 1 and table.stats()['misses'] == 1
+
+
+def test_bindings_expire_after_the_ttl():
+    clock = Clock()
+    table = LearningTable(ttl=10, clock=clock)
+    table.learn(1, MACS[0], 1)
+    table.learn(1, MACS[1], 2)
+    clock.now += 5
+    table.learn(1, MACS[1], 2)  # seen again: another ttl from now
+    clock.now += 6
+    assert table.lookup(1, MACS[0]) is None
+    assert table.lookup(1, MACS[1]) == 2
+    assert table.stats()['expirations'] == 1
+    # expire() sweeps the bindings no lookup runs into
+    table.learn(2, MACS[2], 3)
+    clock.now += 11
+    assert table.expire() == 2
+    assert len(table) == 0
+    assert table.stats()['expirations'] == 3
+
+
+def test_the_least_recently_used_binding_goes_first():
+    table = LearningTable(capacity=3, clock=Clock())
+    for port, mac in enumerate(MACS[:3], 1):
+        table.learn(1, mac, port)
+    assert table.lookup(1, MACS[0]) == 1  # a lookup is a use too
+    table.learn(1, MACS[3], 4)
+    assert table.lookup(1, MACS[1]) is None
+    assert [table.lookup(1, mac) for mac in (MACS[0], MACS[2], MACS[3])] == [1, 3, 4]
+    assert table.stats()['evictions'] == 1
+    # the cap is per switch
+    table.learn(2, MACS[4], 1)
+    assert len(table) == 4
+
+
+def test_purges_return_the_macs_forgotten():
+    table = LearningTable(clock=Clock())
+    table.learn(1, MACS[0], 1)
+    table.learn(1, MACS[1], 1)
+    table.learn(1, MACS[2], 2)
+    table.learn(2, MACS[3], 1)
+    assert set(table.purge_port(1, 1)) == {MACS[0], MACS[1]}
+    assert table.purge_port(1, 1) == []
+    assert table.lookup(1, MACS[2]) == 2
+    assert table.purge_switch(1) == [MACS[2]]
+    assert table.purge_switch(1) == []
+    assert table.lookup(2, MACS[3]) == 1
+
+
+def test_dump_and_load():
+    clock = Clock()
+    table = LearningTable(ttl=10, clock=clock)
+    table.learn(1, MACS[0], 1)
+    clock.now += 5
+    table.learn(1, MACS[1], 2)
+    table.learn(2, MACS[2], 3)
+    bindings = table.dump()
+    # least recently used first, per switch
+    assert bindings == [(1, MACS[0], 1, 1010.0), (1, MACS[1], 2, 1015.0), (2, MACS[2], 3, 1015.0)]
+
+    # a restart 7 s later: the first binding has expired meanwhile
+    clock.now += 7
+    restored = LearningTable(ttl=10, capacity=1, clock=clock)
+    assert restored.load(bindings) == 2
+    assert restored.lookup(1, MACS[0]) is None
+    assert restored.lookup(1, MACS[1]) == 2
+    assert restored.lookup(2, MACS[2]) == 3
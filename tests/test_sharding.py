@@ -0,0 +1,56 @@
+"""
+A ShardPool of two workers against one of a single worker: every switch
+has to get the same messages in the same order.
+"""
+import threading
+
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.openflow.libopenflow_01 as of
+
+from sdnlib.bench import synthetic_frames
+from sdnlib.sharding import ShardPool
+from sdnlib.shim import load_controller
+
+from tests.helpers import split_messages, without_xid
+
+SWITCHES = 4
+
+
+def _run(workers, frames):
+    written = {}  # dpid -> [message without its xid, ...]
+    lock = threading.Lock()
+
+    def deliver(replies):
+        with lock:
+            for dpid, data in replies:
+                written.setdefault(dpid, []).extend(
+                    without_xid(message) for _, message in split_messages(data))
+
+    pool = ShardPool('assignment1', workers, deliver=deliver)
+    try:
+        for dpid in range(1, SWITCHES + 1):
+            pool.dispatch('ConnectionUp', dpid)
+        for i, (in_port, data) in enumerate(frames):
+            pool.dispatch('PacketIn', i % SWITCHES + 1,
+                          (None, in_port, of.OFPR_NO_MATCH, len(data), data))
+            if i % 16 == 15:
+                pool.flush()
+        pool.drain()
+    finally:
+        pool.stop()
+    return written
+
+
+def test_two_workers_answer_every_switch_like_one():
+    frames = synthetic_frames(load_controller('assignment1').rules, 400)
+    single = _run(1, frames)
+    sharded = _run(2, frames)
+    assert sorted(sharded) == list(range(1, SWITCHES + 1))
+    for dpid in range(1, SWITCHES + 1):
+        assert sharded[dpid] == single[dpid]
+    types = [message[1] for messages in sharded.values() for message in messages]
+    assert types.count(of.OFPT_FLOW_MOD) > 0
+    assert types.count(of.OFPT_PACKET_OUT) > 0
@@ -0,0 +1,187 @@
+"""
+The emulated switches' flow tables and packet buffers, driven directly,
+and one short run against each controller.
+"""
+import asyncio
+import struct
+
+import pytest
+
+from sdnlib import switchsim
+from sdnlib.aioflow import header
+from sdnlib.switchsim import (FlowEntry, FlowTable, Network, Simulation, icmp_echo, packet_fields,
+                              OFPT_FLOW_MOD, OFPFC_ADD, OFPFC_DELETE, OFPFC_DELETE_STRICT,
+                              OFPRR_IDLE_TIMEOUT, OFPRR_HARD_TIMEOUT, OFPP_NONE, NO_BUFFER)
+
+OFPFW_ALL = 0x3fffff
+OFPFW_DL_DST = 8
+OFPFW_NW_DST_SHIFT = 14
+
+
+def _match(wildcards=OFPFW_ALL, key=None):
+    key = key or (0, b'\0' * 6, b'\0' * 6, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    return switchsim._MATCH.pack(wildcards, *key)
+
+
+def _output(*ports):
+    return b''.join(struct.pack('!HHHH', 0, 8, port, 0) for port in ports)
+
+
+def _entry(match, priority, idle_timeout=0, hard_timeout=0, ports=(1,), now=0.0):
+    return FlowEntry(match, 0, priority, idle_timeout, hard_timeout, 0, _output(*ports), now)
+
+
+def _key(src, dst, in_port=1):
+    return (in_port,) + packet_fields(icmp_echo(src, dst, 1))
+
+
+def _dl_dst_match(dst):
+    key = list(_key(1, dst))
+    return _match(OFPFW_ALL & ~OFPFW_DL_DST, key)
+
+
+def test_priority_and_exact_matches():
+    table = FlowTable()
+    exact = _entry(_match(0, _key(1, 2)), 1, ports=(3,))
+    by_mac = _entry(_dl_dst_match(2), 0xffff, ports=(2,))
+    low = _entry(_match(), 5, ports=(4,))
+    for entry in (low, by_mac, exact):
+        table.add(entry)
+    assert len(table) == 3
+    # an exact match beats any wildcarded one, whatever its priority
+    assert table.lookup(_key(1, 2)) is exact
+    assert table.lookup(_key(3, 2)) is by_mac
+    assert table.lookup(_key(3, 4)) is low
+    table.remove(exact)
+    assert table.lookup(_key(1, 2)) is by_mac
+    # the same match and priority replaces the entry
+    again = _entry(_dl_dst_match(2), 0xffff, ports=(5,))
+    table.add(again)
+    assert len(table) == 2
+    assert table.lookup(_key(1, 2)) is again
+
+
+def test_ip_prefixes():
+    table = FlowTable()
+    key = _key(1, 0x0203)  # 10.0.2.3
+    wide = _entry(_match(OFPFW_ALL & ~(0x3f << OFPFW_NW_DST_SHIFT) | (16 << OFPFW_NW_DST_SHIFT), key), 10)
+    narrow = _entry(_match(OFPFW_ALL & ~(0x3f << OFPFW_NW_DST_SHIFT) | (8 << OFPFW_NW_DST_SHIFT), key), 20)
+    table.add(wide)
+    table.add(narrow)
+    assert table.lookup(_key(5, 0x0209)) is narrow  # 10.0.2.9: both, narrow is higher
+    assert table.lookup(_key(5, 0x0109)) is wide  # 10.0.1.9: only the /16
+    assert table.lookup(_key(5, 0x010209)) is None  # 10.1.2.9: neither
+
+
+def test_select():
+    table = FlowTable()
+    first = _entry(_match(0, _key(1, 2)), 10, ports=(2,))
+    second = _entry(_match(0, _key(3, 2)), 10, ports=(3,))
+    wildcard = _entry(_dl_dst_match(2), 10, ports=(2,))
+    for entry in (first, second, wildcard):
+        table.add(entry)
+    fields = switchsim._MATCH.unpack(_dl_dst_match(2))
+    assert set(table.select(fields[0], fields[1:])) == {first, second, wildcard}
+    assert set(table.select(fields[0], fields[1:], out_port=2)) == {first, wildcard}
+    assert table.select(fields[0], fields[1:], 10, strict=True) == [wildcard]
+    assert table.select(fields[0], fields[1:], 11, strict=True) == []
+    fields = switchsim._MATCH.unpack(_match())
+    assert len(table.select(fields[0], fields[1:], out_port=OFPP_NONE)) == 3
+
+
+def test_expiry():
+    table = FlowTable()
+    idle = _entry(_match(0, _key(1, 2)), 1, idle_timeout=5)
+    hard = _entry(_match(0, _key(1, 3)), 1, idle_timeout=5, hard_timeout=8)
+    table.add(idle)
+    table.add(hard)
+    assert table.expire(4.9) == []
+    # traffic refreshes the idle timeout, but not the hard one
+    idle.used = hard.used = 4.0
+    assert table.expire(5.0) == []
+    assert table.expire(8.0) == [(hard, OFPRR_HARD_TIMEOUT)]
+    assert table.expire(9.0) == [(idle, OFPRR_IDLE_TIMEOUT)]
+    assert len(table) == 0
+    # an entry removed earlier does not expire again
+    gone = _entry(_match(0, _key(1, 4)), 1, hard_timeout=1)
+    table.add(gone)
+    table.remove(gone)
+    assert table.expire(10.0) == []
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def _flow_mod(match, command=OFPFC_ADD, priority=10, buffer_id=NO_BUFFER, ports=()):
+    body = match + switchsim._FLOW_MOD.pack(0, command, 0, 0, priority, buffer_id, OFPP_NONE, 0)
+    body += _output(*ports)
+    return header(OFPT_FLOW_MOD, 8 + len(body)) + body
+
+
+def test_buffers(loop):
+    # hosts 1 and 2 on switch 1, two packet buffers
+    sim = Simulation(Network(2, 2), [], buffers=2)
+    switch = sim.switches[1]
+    frames = [icmp_echo(1, 2, ident) for ident in range(3)]
+    for frame in frames:
+        switch.receive(1, frame, packet_fields(frame))
+    assert sim.packet_ins == 3
+    # the third miss took the first one's buffer
+    assert sim.buffers_reused == 1
+    assert [packet[1] for packet in switch.buffers.values()] == frames[1:]
+    first, second = list(switch.buffers)
+
+    # a flow_mod with a buffer_id installs the flow and forwards the packet
+    switch._dispatch(OFPT_FLOW_MOD, 0, _flow_mod(_dl_dst_match(2), buffer_id=first, ports=(2,)))
+    assert len(switch.table) == 1
+    assert sim.delivered == 1
+    assert first not in switch.buffers
+    # and a buffer goes once
+    switch._dispatch(OFPT_FLOW_MOD, 0, _flow_mod(_dl_dst_match(2), buffer_id=first, ports=(2,)))
+    assert sim.unknown_buffers == 1
+    assert sim.delivered == 1
+
+    # the next packet hits the flow
+    switch.receive(1, frames[0], packet_fields(frames[0]))
+    assert sim.hits == 1
+    assert sim.delivered == 2
+
+    # deleting it brings back the misses
+    switch._dispatch(OFPT_FLOW_MOD, 0, _flow_mod(_match(), OFPFC_DELETE))
+    assert len(switch.table) == 0
+    switch.receive(1, frames[0], packet_fields(frames[0]))
+    assert sim.packet_ins == 4
+    assert second in switch.buffers
+
+    # a strict delete needs the priority too
+    switch._dispatch(OFPT_FLOW_MOD, 0, _flow_mod(_dl_dst_match(2), ports=(2,)))
+    switch._dispatch(OFPT_FLOW_MOD, 0, _flow_mod(_dl_dst_match(2), OFPFC_DELETE_STRICT, priority=11))
+    assert len(switch.table) == 1
+    switch._dispatch(OFPT_FLOW_MOD, 0, _flow_mod(_dl_dst_match(2), OFPFC_DELETE_STRICT))
+    assert len(switch.table) == 0
+
+
+@pytest.mark.parametrize('controller', ['assignment1', 'assignment2'])
+def test_simulate(loop, monkeypatch, controller):
+    pytest.importorskip('pox.openflow.libopenflow_01')
+    import pox.lib.recoco
+    from sdnlib import sendbuf
+
+    # setup() swaps in the loop's timer and scheduler; put POX's back after
+    monkeypatch.setattr(pox.lib.recoco, 'Timer', pox.lib.recoco.Timer)
+    monkeypatch.setattr(sendbuf, '_schedule', sendbuf._schedule)
+    network = Network(3, 4, fanout=2)
+    demands = switchsim.random_demands(network, 20)
+    report = loop.run_until_complete(switchsim.simulate(
+        network, demands, rate=100, duration=0.5, interval=0.25, controller=controller))
+    assert report['arrivals'] == 50
+    assert report['packet_ins'] > 0
+    assert report['flow_setups'] > 0
+    assert report['delivered'] > 0
+    assert report['loops'] == 0
@@ -0,0 +1,148 @@
+"""
+Pre-packed flow_mods and packet_outs: the bytes a template sends against
+what POX packs for the same message, buffered PacketIns included, and the
+MessageTemplates cache.
+"""
+import struct
+
+import pytest
+
+pytest.importorskip('pox.openflow.libopenflow_01')
+
+import pox.openflow.libopenflow_01 as of
+from pox.lib.addresses import EthAddr
+
+from sdnlib.flowcache import match_key
+from sdnlib.templates import (FlowModTemplate, MessageTemplates, buffer_of, packet_out,
+                              FLOW_MOD_BUFFER_ID_OFFSET, FLOW_MOD_TIMEOUTS_OFFSET, NO_BUFFER,
+                              XID_OFFSET)
+
+from tests.helpers import without_xid
+
+H1, H2, H3 = (EthAddr('00:00:00:00:00:%02x' % n) for n in range(1, 4))
+
+
+def _flow_mod(xid=None, idle_timeout=0, hard_timeout=0, buffer_id=None, queue=1):
+    fm = of.ofp_flow_mod()
+    if xid is not None:
+        fm.xid = xid
+    fm.priority = 0x8000
+    fm.match.dl_src = H1
+    fm.match.dl_dst = H2
+    fm.match.dl_type = 0x0800
+    fm.match.nw_proto = 6
+    fm.match.tp_dst = 40
+    fm.idle_timeout = idle_timeout
+    fm.hard_timeout = hard_timeout
+    if buffer_id is not None:
+        fm.buffer_id = buffer_id
+    fm.flags = of.OFPFF_SEND_FLOW_REM
+    fm.actions.append(of.ofp_action_enqueue(port=3, queue_id=queue))
+    return fm
+
+
+def test_template_packs_what_pox_packs():
+    template = FlowModTemplate(_flow_mod())
+    data = template.pack(timeouts=(10, 30))
+    assert data == _flow_mod(xid=struct.unpack_from('!I', data, XID_OFFSET)[0],
+                             idle_timeout=10, hard_timeout=30).pack()
+    assert struct.unpack_from('!HH', data, FLOW_MOD_TIMEOUTS_OFFSET) == (10, 30)
+    # every message gets its own xid
+    again = template.pack(timeouts=(10, 30))
+    assert data[XID_OFFSET:XID_OFFSET + 4] != again[XID_OFFSET:XID_OFFSET + 4]
+    assert without_xid(data) == without_xid(again)
+    # without timeouts, the ones it was built with
+    assert without_xid(template.pack()) == without_xid(_flow_mod().pack())
+
+
+def test_template_takes_the_buffer_id():
+    template = FlowModTemplate(_flow_mod())
+    data = template.pack(buffer_id=77, timeouts=(10, 30))
+    assert struct.unpack_from('!I', data, FLOW_MOD_BUFFER_ID_OFFSET)[0] == 77
+    assert data == _flow_mod(xid=struct.unpack_from('!I', data, XID_OFFSET)[0],
+                             idle_timeout=10, hard_timeout=30, buffer_id=77).pack()
+    assert struct.unpack_from('!I', template.pack(), FLOW_MOD_BUFFER_ID_OFFSET)[0] == NO_BUFFER
+
+
+def test_template_knows_its_match_and_actions():
+    fm = _flow_mod()
+    template = FlowModTemplate(fm)
+    assert template.key == match_key(_flow_mod().match)
+    assert template.actions == of.ofp_action_enqueue(port=3, queue_id=1).pack()
+
+
+def test_templates_are_built_once_per_key():
+    templates = MessageTemplates()
+    built = []
+
+    def build(queue=1):
+        built.append(queue)
+        return _flow_mod(queue=queue)
+
+    first = templates.flow_mod(H1, H2, (40, 3, 1), build)
+    assert templates.flow_mod(H1, H2, (40, 3, 1), build) is first
+    assert templates.flow_mod(H1, H2, (40, 3, 2), lambda: build(2)) is not first
+    assert built == [1, 2]
+    assert templates.stats() == {'templates': 2, 'hits': 1, 'builds': 2}
+
+
+def test_forgetting_templates():
+    templates = MessageTemplates()
+    for src, dst in ((H1, H2), (H3, H2), (H2, H1)):
+        templates.flow_mod(src, dst, 'key', _flow_mod)
+    templates.forget_pair(H1, H2)
+    assert len(templates) == 2
+    # the flows towards a host that moved
+    templates.forget_host(H2)
+    assert len(templates) == 1
+    built = []
+    templates.flow_mod(H3, H2, 'key', lambda: built.append(1) or _flow_mod())
+    assert built == [1]
+
+
+def test_the_cache_is_emptied_when_full():
+    templates = MessageTemplates(capacity=2)
+    templates.flow_mod(H1, H2, 1, _flow_mod)
+    templates.flow_mod(H1, H2, 2, _flow_mod)
+    templates.flow_mod(H1, H2, 3, _flow_mod)
+    assert len(templates) == 1
+    assert templates.stats()['builds'] == 3
+
+
+FRAME = bytes(range(64)) * 2
+
+
+def _packet_in(buffer_id=None, data=FRAME):
+    return of.ofp_packet_in(buffer_id=buffer_id, in_port=2, data=data, total_len=len(FRAME))
+
+
+def _pox_packet_out(packet_in, in_port=None):
+    po = of.ofp_packet_out(data=packet_in)
+    po.in_port = packet_in.in_port if in_port is None else in_port
+    po.actions.append(of.ofp_action_output(port=3))
+    return po
+
+
+@pytest.mark.parametrize('buffer_id', [None, NO_BUFFER, 5])
+def test_buffer_of(buffer_id):
+    assert buffer_of(_packet_in(buffer_id)) == (None if buffer_id in (None, NO_BUFFER) else buffer_id)
+
+
+def test_packet_out_echoes_an_unbuffered_frame():
+    packet_in = _packet_in()
+    data = packet_out(of.ofp_action_output(port=3).pack(), packet_in)
+    expected = _pox_packet_out(packet_in)
+    expected.xid = struct.unpack_from('!I', data, XID_OFFSET)[0]
+    assert data == expected.pack()
+    assert data.endswith(FRAME)
+
+
+def test_packet_out_refers_to_the_buffer():
+    packet_in = _packet_in(buffer_id=5, data=FRAME[:16])
+    data = packet_out(of.ofp_action_output(port=3).pack(), packet_in, in_port=1)
+    expected = _pox_packet_out(packet_in, in_port=1)
+    expected.xid = struct.unpack_from('!I', data, XID_OFFSET)[0]
+    assert data == expected.pack()
+    # the 16 bytes the switch sent are not sent back
+    assert len(data) == 16 + 8
+    assert FlowModTemplate(_flow_mod()).packet_out(packet_in)[8:12] == struct.pack('!I', 5)